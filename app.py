@@ -1,48 +1,120 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, make_response
-from pymongo import MongoClient
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, make_response, Response, stream_with_context, g
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timedelta
 import hashlib
 import os
-import io
 import base64
+import hmac
+import time
+import mimetypes
 from functools import wraps
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.utils import ImageReader
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
 import json
-from bson import json_util
+import tempfile
+from indices import asegurar_indices, imprimir_reporte_indices
+import resumen_ventas
+from reportes_pdf import generar_reporte_ventas
+from cache_comprobantes import CacheComprobantes
+from comprobantes import generar_comprobante
+from trabajos_pdf import ColaReportesPDF
+from inventario import reservar_inventario
+import cancelaciones
+import carritos
+import seguimiento
+from eventos_pedidos import BrokerPedidos, iniciar_escucha
+import catalogo
+from catalogo import CacheCatalogo
+import imagenes
+from imagenes import ProcesadorImagenes
+from conexion import ConexionMongo
+from metricas import RegistroMetricas, EscuchaComandos
+import consultas_n1
 
 app = Flask(__name__)
 app.secret_key = 'clave_secreta_biblioteca_2024'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+app.config['COMPROBANTES_CACHE'] = os.path.join(app.root_path, 'cache', 'comprobantes')
+app.config['COMPROBANTES_CACHE_MAX_BYTES'] = 64 * 1024 * 1024  # 64MB max
+app.config['MONGO_URI'] = 'mongodb://localhost:27017/'
+app.config['MONGO_DB'] = 'libros'
+app.config['MONGO_MAX_POOL'] = 100  # Conexiones por proceso
+app.config['MONGO_MIN_POOL'] = 0
+app.config['MONGO_ESPERA_COLA_MS'] = 2000  # Espera máxima por una conexión libre del pool
+app.config['MONGO_COMPRESORES'] = ('zstd', 'snappy', 'zlib')  # Se usan los que estén instalados
+app.config['METRICAS_TOKEN'] = None  # Token Bearer para que Prometheus lea /metrics sin sesión
+# Directorio local compartido por los workers para que /metrics exponga los
+# contadores de todos (vaciarlo al desplegar); None: sólo los del que responde
+app.config['METRICAS_DIR'] = None
+app.config['N1_DETECTOR'] = None  # None: activo sólo en modo debug o testing
+app.config['N1_UMBRAL'] = 3  # Veces que puede repetirse la misma consulta en una petición
+app.config['N1_ACCION'] = 'log'  # 'log' imprime un aviso; 'error' lanza ConsultasRepetidas
+app.config['REPORTES_PDF_DIR'] = os.path.join(app.root_path, 'cache', 'reportes')
+app.config['REPORTES_PDF_WORKERS'] = 2
+app.config['REPORTES_PDF_VIGENCIA'] = timedelta(minutes=30)
+app.config['SEGUIMIENTO_CHANGE_STREAM'] = False  # True con replica set: eventos desde un change stream
+app.config['SEGUIMIENTO_LATIDO'] = 15  # Segundos entre latidos del canal de eventos
+# True si /api/seguimiento/eventos lo atiende un worker gevent (perfil 'eventos'
+# de gunicorn.conf.py); si no, la página de seguimiento consulta cada 30 s
+app.config['SEGUIMIENTO_SSE'] = False
+app.config['CATALOGO_POR_PAGINA'] = 24  # Libros por página del catálogo de clientes
+app.config['IMAGENES_DIR'] = os.path.join(app.root_path, 'static', 'uploads', 'libros')
+app.config['IMAGENES_URL'] = '/media/libros'
+app.config['IMAGENES_WORKERS'] = 2
+app.config['MEDIA_MAX_AGE'] = 365 * 24 * 3600  # Los nombres llevan el hash: cache de un año
+# Detrás de un proxy las portadas las envía el proxy y no el worker de Python:
+#   USE_X_SENDFILE = True               Apache/lighttpd (cabecera X-Sendfile)
+#   MEDIA_ACCEL_REDIRECT = '/_media/'   nginx, con una location interna:
+#       location /_media/ { internal; alias <IMAGENES_DIR>/; }
+app.config['MEDIA_ACCEL_REDIRECT'] = None
 
 # Crear carpeta de uploads si no existe
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # ----------------- CONEXIÓN A MONGODB -----------------
-try:
-    client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000)
-    client.admin.command('ping') 
-
-    db = client['libros']
-    
-    coleccion_libros = db['tipolibro']
-    coleccion_usuarios = db['usuarios']
-    coleccion_clientes = db['clientes']  
-    coleccion_ventas = db['ventas']
-    coleccion_pedidos = db['pedidos']  # Nueva colección para seguimiento
-    coleccion_cancelaciones = db['cancelaciones']  # Nueva colección para cancelaciones
-
-    print("Conexión exitosa a MongoDB.")
-
-except Exception as e:
-    print(f"ERROR: No se pudo conectar a MongoDB. Detalle: {e}")
+# El cliente se crea en el primer acceso de cada proceso (ver conexion.py):
+# importar la app no hace ningún viaje de red.
+registro_metricas = RegistroMetricas()
+escucha_comandos = EscuchaComandos(registro_metricas)  # Comandos a MongoDB por petición
+detector_n1 = consultas_n1.DetectorN1()  # Sólo trabaja si hay una captura activa
+
+def opciones_mongo():
+    return {
+        'escuchas': [escucha_comandos, detector_n1],
+        'max_pool': app.config['MONGO_MAX_POOL'],
+        'min_pool': app.config['MONGO_MIN_POOL'],
+        'espera_cola_ms': app.config['MONGO_ESPERA_COLA_MS'],
+        'compresores': app.config['MONGO_COMPRESORES']
+    }
+
+conexion_mongo = ConexionMongo(app.config['MONGO_URI'], app.config['MONGO_DB'], **opciones_mongo())
+db = conexion_mongo.base_datos()
+
+coleccion_libros = db['tipolibro']
+coleccion_usuarios = db['usuarios']
+coleccion_clientes = db['clientes']  
+coleccion_ventas = db['ventas']
+coleccion_pedidos = db['pedidos']  # Nueva colección para seguimiento
+coleccion_cancelaciones = db['cancelaciones']  # Nueva colección para cancelaciones
+coleccion_ventas_diarias = db['ventas_diarias']  # Resumen diario para dashboard y reportes
+coleccion_trabajos_pdf = db['trabajos_pdf']  # Reportes PDF generados en segundo plano
+coleccion_carritos = db['carritos']  # Carritos de compra de los clientes
+coleccion_versiones = db['versiones']  # Versiones del catálogo para la cache
+
+# ----------------- SALUD DEL SERVICIO -----------------
+
+@app.route('/salud/vivo')
+def salud_vivo():
+    """Liveness: el proceso atiende peticiones (no consulta MongoDB)"""
+    return jsonify(conexion_mongo.vivo())
+
+@app.route('/salud/listo')
+def salud_listo():
+    """Readiness: MongoDB responde a un ping; 503 si no"""
+    listo, detalle = conexion_mongo.listo()
+    return jsonify(detalle), (200 if listo else 503)
 
 # ----------------- FUNCIONES AUXILIARES -----------------
 def encriptar_password(password):
@@ -57,15 +129,23 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# app_async.py usa los mismos valores en su versión asíncrona del decorador
+AVISO_LOGIN_CLIENTE = 'Por favor inicia sesión como cliente'
+LOGIN_CLIENTE = 'login_cliente'
+
 def cliente_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'cliente_id' not in session:
-            flash('Por favor inicia sesión como cliente', 'error')
-            return redirect(url_for('login_cliente'))
+            flash(AVISO_LOGIN_CLIENTE, 'error')
+            return redirect(url_for(LOGIN_CLIENTE))
         return f(*args, **kwargs)
     return decorated_function
 
+def carrito_actual():
+    """Id del carrito del cliente en sesión (el carrito vive en la colección carritos)"""
+    return session.get('carrito_id') or session['cliente_id']
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -84,8 +164,120 @@ def puede_cancelar_venta(fecha_venta):
     tiempo_transcurrido = datetime.now() - fecha_venta
     return tiempo_transcurrido.total_seconds() < 900  # 15 minutos = 900 segundos
 
+def codificar_cursor(venta):
+    """Token opaco con la posición (fecha_venta, _id) de una venta"""
+    datos = json.dumps({'f': venta['fecha_venta'].isoformat(), 'i': str(venta['_id'])})
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+
+def filtro_cursor(token, operador):
+    """Filtro keyset sobre (fecha_venta, _id) a partir de un token de cursor.
+    
+    operador es '$lt' para avanzar (orden descendente) o '$gt' para retroceder.
+    """
+    datos = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    fecha = datetime.fromisoformat(datos['f'])
+    venta_id = ObjectId(datos['i'])
+    return {'$or': [
+        {'fecha_venta': {operador: fecha}},
+        {'fecha_venta': fecha, '_id': {operador: venta_id}}
+    ]}
+
+def _object_ids(valores):
+    """Convertir ids en texto a ObjectId, descartando los inválidos"""
+    return [ObjectId(v) for v in set(valores) if v and ObjectId.is_valid(v)]
+
+def enriquecer_ventas(ventas):
+    """Completar una página de ventas con cliente, usuario y cancelación.
+    
+    Resuelve clientes, usuarios y cancelaciones con una consulta $in por
+    colección en lugar de un find_one por venta.
+    """
+    if not ventas:
+        return ventas
+    
+    faltan_cliente = [v for v in ventas if 'cliente_nombre' not in v]
+    faltan_usuario = [v for v in ventas if 'usuario_nombre' not in v and v.get('usuario_id')]
+    
+    clientes = {}
+    if faltan_cliente:
+        ids = _object_ids(v.get('cliente_id') for v in faltan_cliente)
+        clientes = {str(c['_id']): c for c in coleccion_clientes.find(
+            {'_id': {'$in': ids}}, {'nombre': 1, 'email': 1, 'telefono': 1})}
+    
+    usuarios = {}
+    if faltan_usuario:
+        ids = _object_ids(v['usuario_id'] for v in faltan_usuario)
+        usuarios = {str(u['_id']): u for u in coleccion_usuarios.find(
+            {'_id': {'$in': ids}}, {'nombre': 1})}
+    
+    for venta in ventas:
+        if 'cliente_nombre' not in venta:
+            cliente = clientes.get(venta.get('cliente_id'))
+            if cliente:
+                venta['cliente_nombre'] = cliente['nombre']
+                venta['cliente_email'] = cliente.get('email', '')
+                venta['cliente_telefono'] = cliente.get('telefono', '')
+            else:
+                venta['cliente_nombre'] = 'Cliente no encontrado'
+                venta['cliente_email'] = ''
+                venta['cliente_telefono'] = ''
+        
+        if 'usuario_nombre' not in venta and venta.get('usuario_id'):
+            usuario = usuarios.get(venta['usuario_id'])
+            venta['usuario_nombre'] = usuario['nombre'] if usuario else 'Usuario no encontrado'
+    
+    return cancelaciones.marcar_canceladas(ventas, coleccion_cancelaciones.find(
+        {'venta_id': {'$in': [str(v['_id']) for v in ventas]}},
+        cancelaciones.PROYECCION_CANCELACION))
+
+# ----------------- MÉTRICAS -----------------
+
+def detector_n1_activo():
+    activo = app.config['N1_DETECTOR']
+    return (app.debug or app.testing) if activo is None else activo
+
+@app.before_request
+def iniciar_metricas():
+    g.inicio_peticion = time.perf_counter()
+    g.token_metricas = registro_metricas.iniciar_peticion(request.endpoint or 'desconocido')
+    if detector_n1_activo():
+        g.captura_n1, g.token_n1 = consultas_n1.iniciar_captura()
+
+@app.after_request
+def registrar_metricas(respuesta):
+    token = g.pop('token_metricas', None)
+    if token is not None:
+        tamano = None if respuesta.is_streamed else respuesta.calculate_content_length()
+        registro_metricas.terminar_peticion(token, request.method, respuesta.status_code,
+                                            time.perf_counter() - g.inicio_peticion, tamano)
+    token_n1 = g.pop('token_n1', None)
+    if token_n1 is not None:
+        consultas_n1.terminar_captura(token_n1)
+        consultas_n1.revisar(g.captura_n1, app.config['N1_UMBRAL'],
+                             f"{request.method} {request.path} ({request.endpoint})",
+                             app.config['N1_ACCION'])
+    return respuesta
+
+@app.route('/metrics')
+def metricas():
+    """Métricas en formato Prometheus (administradores o METRICAS_TOKEN).
+
+    Con METRICAS_DIR incluye las de todos los workers vivos; si no, sólo las
+    de este proceso.
+    """
+    token = app.config['METRICAS_TOKEN']
+    autorizacion = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(autorizacion, f'Bearer {token}')):
+        if session.get('usuario_rol') != 'administrador':
+            return 'No autorizado', 403
+    return Response(registro_metricas.exponer(), mimetype='text/plain; version=0.0.4')
+
 # ----------------- INICIALIZAR DATOS -----------------
 def inicializar_datos():
+    # Crear o reconciliar índices de todas las colecciones
+    reporte_indices = asegurar_indices(db)
+    imprimir_reporte_indices(reporte_indices)
+    
     # Verificar si existe al menos un usuario administrador
     if coleccion_usuarios.count_documents({}) == 0:
         usuario_admin = {
@@ -99,6 +291,29 @@ def inicializar_datos():
         coleccion_usuarios.insert_one(usuario_admin)
         print("Usuario administrador creado: admin@biblioteca.com / admin123")
 
+@app.cli.command('recrear-indices')
+def recrear_indices():
+    """Recrear los índices cuya definición cambió en indices.py"""
+    imprimir_reporte_indices(asegurar_indices(db, recrear=True))
+
+@app.cli.command('reconstruir-ventas-diarias')
+def reconstruir_ventas_diarias():
+    """Reconstruir el resumen ventas_diarias a partir de todas las ventas"""
+    procesadas = resumen_ventas.reconstruir_resumen(coleccion_ventas, coleccion_ventas_diarias)
+    print(f"Resumen diario reconstruido a partir de {procesadas} ventas.")
+
+@app.cli.command('completar-cancelaciones')
+def completar_cancelaciones():
+    """Terminar las cancelaciones que fallaron a mitad de camino"""
+    completadas = cancelaciones.completar_pendientes(db)
+    print(f"Cancelaciones completadas: {completadas}.")
+
+@app.cli.command('reconstruir-seguimiento')
+def reconstruir_seguimiento():
+    """Crear en bloque los seguimientos faltantes de las ventas online"""
+    creados = seguimiento.reconstruir_seguimiento(coleccion_ventas, coleccion_pedidos)
+    print(f"Seguimientos creados: {creados}.")
+
 # ----------------- RUTAS DE AUTENTICACIÓN -----------------
 
 @app.route('/')
@@ -150,8 +365,8 @@ def login_cliente():
             session['cliente_id'] = str(cliente['_id'])
             session['cliente_nombre'] = cliente['nombre']
             session['cliente_email'] = cliente['email']
-            # Inicializar carrito vacío
-            session['carrito'] = []
+            # El carrito se guarda en el servidor; en la sesión sólo va su id
+            session['carrito_id'] = str(cliente['_id'])
             flash('¡Bienvenido ' + cliente['nombre'] + '!', 'success')
             return redirect(url_for('catalogo_cliente'))
         else:
@@ -163,12 +378,6 @@ def login_cliente():
 def registro_cliente():
     if request.method == 'POST':
         try:
-            # Verificar si el email ya existe
-            cliente_existente = coleccion_clientes.find_one({'email': request.form.get('email')})
-            if cliente_existente:
-                flash('El email ya está registrado', 'error')
-                return render_template('registro_cliente.html')
-            
             # Obtener la contraseña del formulario
             password = request.form.get('password')
             if not password:
@@ -191,6 +400,9 @@ def registro_cliente():
             coleccion_clientes.insert_one(cliente)
             flash('Cliente registrado exitosamente. Ahora puedes iniciar sesión.', 'success')
             return redirect(url_for('login_cliente'))
+        except DuplicateKeyError:
+            # El índice único de email sustituye la búsqueda previa
+            flash('El email ya está registrado', 'error')
         except Exception as e:
             flash(f'Error al registrar cliente: {e}', 'error')
     
@@ -210,64 +422,27 @@ def dashboard():
     try:
         total_libros = coleccion_libros.count_documents({})
         total_clientes = coleccion_clientes.count_documents({'activo': True})
-        total_ventas = coleccion_ventas.count_documents({})
+        total_ventas = coleccion_ventas.estimated_document_count()
         
         inicio_mes = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        ventas_mes_cursor = coleccion_ventas.find({'fecha_venta': {'$gte': inicio_mes}})
-        ventas_mes = list(ventas_mes_cursor)
-        total_ventas_mes = sum(venta.get('total', 0) for venta in ventas_mes)
+        total_ventas_mes = resumen_ventas.totales_desde(coleccion_ventas_diarias, inicio_mes)['total']
         
         libros_stock_bajo = list(coleccion_libros.find({'stock': {'$lt': 5}}))
         
         # Ventas recientes
         ventas_recientes_cursor = coleccion_ventas.find().sort('fecha_venta', -1).limit(5)
-        ventas_recientes = list(ventas_recientes_cursor)
-        
-        for venta in ventas_recientes:
-            if 'cliente_nombre' not in venta:
-                cliente = coleccion_clientes.find_one({'_id': ObjectId(venta['cliente_id'])})
-                venta['cliente_nombre'] = cliente['nombre'] if cliente else 'Cliente no encontrado'
+        ventas_recientes = enriquecer_ventas(list(ventas_recientes_cursor))
         
-        # Datos para gráficos
+        # Datos para gráficos, leídos del resumen diario (un documento por día y tipo)
         # Top 5 libros más vendidos
-        pipeline_libros = [
-            {"$unwind": "$items"},
-            {"$group": {
-                "_id": "$items.libro_id",
-                "titulo": {"$first": "$items.titulo"},
-                "total_vendido": {"$sum": "$items.cantidad"},
-                "total_ingresos": {"$sum": "$items.subtotal"}
-            }},
-            {"$sort": {"total_vendido": -1}},
-            {"$limit": 5}
-        ]
-        libros_mas_vendidos = list(coleccion_ventas.aggregate(pipeline_libros))
+        libros_mas_vendidos = resumen_ventas.top_libros(coleccion_ventas_diarias, 5)
         
         # Top 5 clientes más frecuentes
-        pipeline_clientes = [
-            {"$group": {
-                "_id": "$cliente_id",
-                "cliente_nombre": {"$first": "$cliente_nombre"},
-                "total_compras": {"$sum": 1},
-                "total_gastado": {"$sum": "$total"}
-            }},
-            {"$sort": {"total_compras": -1}},
-            {"$limit": 5}
-        ]
-        clientes_frecuentes = list(coleccion_ventas.aggregate(pipeline_clientes))
+        clientes_frecuentes = resumen_ventas.top_clientes(coleccion_ventas_diarias, 5)
         
         # Ventas por día últimos 7 días
         fecha_inicio = datetime.now() - timedelta(days=7)
-        pipeline_ventas_diarias = [
-            {"$match": {"fecha_venta": {"$gte": fecha_inicio}}},
-            {"$group": {
-                "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$fecha_venta"}},
-                "total_ventas": {"$sum": 1},
-                "total_ingresos": {"$sum": "$total"}
-            }},
-            {"$sort": {"_id": 1}}
-        ]
-        ventas_diarias = list(coleccion_ventas.aggregate(pipeline_ventas_diarias))
+        ventas_diarias = resumen_ventas.ventas_por_dia(coleccion_ventas_diarias, fecha_inicio)
         
         # Preparar datos para gráficos
         fechas = [v['_id'] for v in ventas_diarias]
@@ -319,12 +494,6 @@ def listar_usuarios():
 def agregar_usuario():
     if request.method == 'POST':
         try:
-            # Verificar si el email ya existe
-            usuario_existente = coleccion_usuarios.find_one({'email': request.form.get('email')})
-            if usuario_existente:
-                flash('El email ya está registrado', 'error')
-                return render_template('agregar_usuario.html')
-            
             usuario = {
                 'nombre': request.form.get('nombre'),
                 'email': request.form.get('email'),
@@ -336,6 +505,9 @@ def agregar_usuario():
             coleccion_usuarios.insert_one(usuario)
             flash('Usuario agregado exitosamente', 'success')
             return redirect(url_for('listar_usuarios'))
+        except DuplicateKeyError:
+            # El índice único de email sustituye la búsqueda previa
+            flash('El email ya está registrado', 'error')
         except Exception as e:
             flash(f'Error al crear el usuario: {e}', 'error')
     
@@ -401,6 +573,105 @@ def eliminar_usuario(id):
     
     return redirect(url_for('listar_usuarios'))
 
+# ----------------- CATÁLOGO EN CACHE -----------------
+
+cache_catalogo = None
+
+def obtener_cache_catalogo():
+    """Cache de consultas del catálogo del proceso, creada al primer uso"""
+    global cache_catalogo
+    if cache_catalogo is None:
+        cache_catalogo = CacheCatalogo(coleccion_versiones)
+    return cache_catalogo
+
+def responder_catalogo(plantilla, entrada, variante, **contexto):
+    """Renderizar una página del catálogo con ETag fuerte, o 304 si no cambió.
+
+    variante son los datos del usuario que también aparecen en la página.
+    Si hay mensajes flash pendientes la página es única y no se usa ETag.
+    """
+    if '_flashes' in session:
+        return render_template(plantilla, libros=entrada['libros'], **contexto)
+    version = catalogo.etag(entrada, *variante)
+    if version in request.if_none_match:
+        respuesta = make_response('', 304)
+    else:
+        respuesta = make_response(render_template(plantilla, libros=entrada['libros'], **contexto))
+    respuesta.set_etag(version)
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+def registrar_stock_vendido(libros, lineas):
+    """Avisar a la cache del catálogo del stock que descontó una venta"""
+    vendidos = {}
+    for libro_id, cantidad in lineas:
+        vendidos[libro_id] = vendidos.get(libro_id, 0) + cantidad
+    catalogo.registrar_stock(coleccion_versiones, [
+        (libro_id, libros[libro_id]['stock'], -cantidad) for libro_id, cantidad in vendidos.items()
+    ])
+
+# ----------------- PORTADAS DE LIBROS -----------------
+
+procesador_imagenes = None
+
+def obtener_procesador_imagenes():
+    """Procesador de portadas del proceso, creado al primer uso"""
+    global procesador_imagenes
+    if procesador_imagenes is None:
+        procesador_imagenes = ProcesadorImagenes(
+            coleccion_libros,
+            app.config['IMAGENES_DIR'],
+            app.config['IMAGENES_URL'],
+            app.config['MONGO_URI'],
+            db.name,
+            max_workers=app.config['IMAGENES_WORKERS']
+        )
+    return procesador_imagenes
+
+def guardar_portada(archivo):
+    """Guardar una portada subida.
+
+    Devuelve (campos, pendiente): los campos de imagen para el libro y, si
+    las variantes aún no existen, la tarea (huella, ruta) a encolar una vez
+    guardado el libro.
+    """
+    procesador = obtener_procesador_imagenes()
+    huella, ruta, url = procesador.guardar(archivo)
+    imagenes = procesador.variantes_listas(huella)
+    campos = {'imagen_url': url, 'imagen_hash': huella, 'imagenes': imagenes,
+              'imagen_estado': 'lista' if imagenes else 'pendiente'}
+    return campos, (None if imagenes else (huella, ruta))
+
+@app.route('/media/libros/<path:nombre>')
+def media_libro(nombre):
+    """Servir una portada o variante con cache inmutable.
+
+    Sin proxy se usa send_file, que responde Range e If-None-Match y entrega
+    el archivo con wsgi.file_wrapper (sendfile en gunicorn y uWSGI).
+    """
+    ruta = imagenes.ruta_archivo(app.config['IMAGENES_DIR'], nombre)
+    if not ruta:
+        return "Imagen no encontrada", 404
+
+    prefijo = app.config['MEDIA_ACCEL_REDIRECT']
+    if prefijo:
+        respuesta = Response(mimetype=mimetypes.guess_type(nombre)[0])
+        respuesta.headers['X-Accel-Redirect'] = prefijo + nombre
+    else:
+        respuesta = send_file(
+            ruta,
+            etag=os.path.basename(nombre),  # El nombre ya es el hash del contenido
+            conditional=True
+        )
+    respuesta.headers['Cache-Control'] = f"public, max-age={app.config['MEDIA_MAX_AGE']}, immutable"
+    return respuesta
+
+@app.template_global()
+def imagen_libro(libro, variante='miniatura', formato='jpg'):
+    """URL de una variante de la portada, o la imagen original si aún no está lista"""
+    imagenes = libro.get('imagenes') or {}
+    return imagenes.get(variante, {}).get(formato) or libro.get('imagen_url', '')
+
 # ----------------- CRUD LIBROS CON IMÁGENES -----------------
 
 @app.route('/libros')
@@ -408,18 +679,23 @@ def eliminar_usuario(id):
 def listar_libros():
     try:
         query = request.args.get('q', '')
-        if query:
-            libros = list(coleccion_libros.find({
-                '$or': [
-                    {'nombre': {'$regex': query, '$options': 'i'}},
-                    {'autor': {'$regex': query, '$options': 'i'}},
-                    {'genero': {'$regex': query, '$options': 'i'}},
-                    {'isbn': {'$regex': query, '$options': 'i'}}
-                ]
-            }))
-        else:
-            libros = list(coleccion_libros.find())
-        return render_template('libros.html', libros=libros, query=query)
+        
+        def cargar():
+            if query:
+                return list(coleccion_libros.find({
+                    '$or': [
+                        {'nombre': {'$regex': query, '$options': 'i'}},
+                        {'autor': {'$regex': query, '$options': 'i'}},
+                        {'genero': {'$regex': query, '$options': 'i'}},
+                        {'isbn': {'$regex': query, '$options': 'i'}}
+                    ]
+                })), None
+            return list(coleccion_libros.find()), None
+        
+        entrada = obtener_cache_catalogo().obtener(('libros', query), cargar)
+        return responder_catalogo('libros.html', entrada,
+                                  (session.get('usuario_nombre'), session.get('usuario_rol')),
+                                  query=query)
     except Exception as e:
         flash(f'Error al cargar libros: {e}', 'error')
         return render_template('libros.html', libros=[], query='')
@@ -429,16 +705,12 @@ def listar_libros():
 def agregar_libro():
     if request.method == 'POST':
         try:
-            # Manejar carga de imagen
-            imagen_url = ''
+            # Manejar carga de imagen (las variantes se generan en segundo plano)
+            portada, pendiente = {'imagen_url': ''}, None
             if 'imagen' in request.files:
                 imagen = request.files['imagen']
                 if imagen.filename != '':
-                    # Guardar imagen
-                    filename = f"libro_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{imagen.filename}"
-                    imagen_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    imagen.save(imagen_path)
-                    imagen_url = f"/static/uploads/{filename}"
+                    portada, pendiente = guardar_portada(imagen)
             
             libro = {
                 'nombre': request.form.get('nombre'),         
@@ -449,10 +721,13 @@ def agregar_libro():
                 'anio_publicacion': int(request.form.get('anio_publicacion', 0)),
                 'precio': float(request.form.get('precio', 0)),
                 'descripcion': request.form.get('descripcion', ''),
-                'imagen_url': imagen_url,
+                **portada,
                 'fecha_agregado': datetime.now()
             }
             coleccion_libros.insert_one(libro)
+            catalogo.registrar_cambio(coleccion_versiones)
+            if pendiente:
+                obtener_procesador_imagenes().encolar(*pendiente)
             flash('Libro agregado exitosamente', 'success')
             return redirect(url_for('listar_libros'))
         except Exception as e:
@@ -479,18 +754,20 @@ def editar_libro(id):
             }
             
             # Manejar nueva imagen si se sube
+            pendiente = None
             if 'imagen' in request.files:
                 imagen = request.files['imagen']
                 if imagen.filename != '':
-                    filename = f"libro_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{imagen.filename}"
-                    imagen_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    imagen.save(imagen_path)
-                    datos_actualizados['imagen_url'] = f"/static/uploads/{filename}"
+                    portada, pendiente = guardar_portada(imagen)
+                    datos_actualizados.update(portada)
             
             coleccion_libros.update_one(
                 {'_id': ObjectId(id)},
                 {'$set': datos_actualizados}
             )
+            catalogo.registrar_cambio(coleccion_versiones)
+            if pendiente:
+                obtener_procesador_imagenes().encolar(*pendiente)
             flash('Libro actualizado exitosamente', 'success')
             return redirect(url_for('listar_libros'))
         
@@ -505,6 +782,7 @@ def editar_libro(id):
 def eliminar_libro(id):
     try:
         coleccion_libros.delete_one({'_id': ObjectId(id)})
+        catalogo.registrar_cambio(coleccion_versiones)
         flash('Libro eliminado exitosamente', 'success')
     except Exception as e:
         flash(f'Error al eliminar libro: {e}', 'error')
@@ -618,44 +896,48 @@ def eliminar_cliente(id):
 @login_required
 def listar_ventas():
     try:
-        pagina = int(request.args.get('pagina', 1))
+        pagina = max(int(request.args.get('pagina', 1)), 1)
+        despues = request.args.get('despues')
+        antes = request.args.get('antes')
         ventas_por_pagina = 10
+        paginas_numeradas = 5  # Primeras páginas accesibles por número
         
-        # Calcular paginación
-        total_ventas = coleccion_ventas.count_documents({})
+        # Total estimado desde los metadatos de la colección (sin recorrerla)
+        total_ventas = coleccion_ventas.estimated_document_count()
         total_paginas = (total_ventas + ventas_por_pagina - 1) // ventas_por_pagina
         
-        skip = (pagina - 1) * ventas_por_pagina
-        ventas_cursor = coleccion_ventas.find().sort('fecha_venta', -1).skip(skip).limit(ventas_por_pagina)
-        ventas = list(ventas_cursor)
+        # Paginación por cursor sobre (fecha_venta, _id)
+        orden = [('fecha_venta', -1), ('_id', -1)]
+        if despues:
+            ventas_cursor = coleccion_ventas.find(filtro_cursor(despues, '$lt')).sort(orden)
+        elif antes:
+            ventas_cursor = coleccion_ventas.find(filtro_cursor(antes, '$gt')).sort(
+                [('fecha_venta', 1), ('_id', 1)])
+        else:
+            skip = (min(pagina, paginas_numeradas) - 1) * ventas_por_pagina
+            pagina = min(pagina, paginas_numeradas)
+            ventas_cursor = coleccion_ventas.find().sort(orden).skip(skip)
+        
+        # Se pide un documento extra para saber si hay más páginas
+        ventas = list(ventas_cursor.limit(ventas_por_pagina + 1))
+        hay_mas = len(ventas) > ventas_por_pagina
+        ventas = ventas[:ventas_por_pagina]
+        if antes:
+            ventas.reverse()
+            hay_siguiente = True
+            hay_anterior = hay_mas
+        else:
+            hay_siguiente = hay_mas
+            hay_anterior = pagina > 1
+        
+        cursor_siguiente = codificar_cursor(ventas[-1]) if ventas and hay_siguiente else None
+        cursor_anterior = codificar_cursor(ventas[0]) if ventas and hay_anterior else None
+        
+        ventas = enriquecer_ventas(ventas)
         
         for venta in ventas:
-            # Asegurarse de que tenemos información del cliente
-            if 'cliente_nombre' not in venta:
-                cliente = coleccion_clientes.find_one({'_id': ObjectId(venta['cliente_id'])})
-                if cliente:
-                    venta['cliente_nombre'] = cliente['nombre']
-                    venta['cliente_email'] = cliente['email']
-                    venta['cliente_telefono'] = cliente.get('telefono', '')
-                else:
-                    venta['cliente_nombre'] = 'Cliente no encontrado'
-                    venta['cliente_email'] = ''
-                    venta['cliente_telefono'] = ''
-            
-            # Asegurarse de que tenemos información del usuario
-            if 'usuario_nombre' not in venta and 'usuario_id' in venta:
-                usuario = coleccion_usuarios.find_one({'_id': ObjectId(venta['usuario_id'])})
-                venta['usuario_nombre'] = usuario['nombre'] if usuario else 'Usuario no encontrado'
-            
             # Verificar si puede ser cancelada
             venta['puede_cancelar'] = puede_cancelar_venta(venta['fecha_venta'])
-            
-            # Verificar si ya está cancelada
-            cancelacion = coleccion_cancelaciones.find_one({'venta_id': str(venta['_id'])})
-            venta['cancelada'] = cancelacion is not None
-            if cancelacion:
-                venta['razon_cancelacion'] = cancelacion.get('razon', '')
-                venta['fecha_cancelacion'] = cancelacion.get('fecha_cancelacion', '')
         
         # Fechas para los filtros de reportes
         hoy = datetime.now().strftime('%Y-%m-%d')
@@ -666,6 +948,9 @@ def listar_ventas():
                              ventas=ventas,
                              pagina=pagina,
                              total_paginas=total_paginas,
+                             paginas_numeradas=paginas_numeradas,
+                             cursor_siguiente=cursor_siguiente,
+                             cursor_anterior=cursor_anterior,
                              hoy=hoy,
                              mes_actual=mes_actual,
                              anio_actual=anio_actual)
@@ -682,12 +967,6 @@ def cancelar_venta(id):
             flash('Venta no encontrada', 'error')
             return redirect(url_for('listar_ventas'))
         
-        # Verificar si ya está cancelada
-        cancelacion_existente = coleccion_cancelaciones.find_one({'venta_id': id})
-        if cancelacion_existente:
-            flash('Esta venta ya ha sido cancelada', 'error')
-            return redirect(url_for('listar_ventas'))
-        
         # Verificar tiempo (15 minutos)
         if not puede_cancelar_venta(venta['fecha_venta']):
             flash('No se puede cancelar la venta después de 15 minutos', 'error')
@@ -695,40 +974,16 @@ def cancelar_venta(id):
         
         razon = request.form.get('razon', 'Cancelación solicitada por el cliente')
         
-        # Crear registro de cancelación
-        cancelacion = {
-            'venta_id': id,
-            'cliente_id': venta['cliente_id'],
-            'cliente_nombre': venta.get('cliente_nombre', ''),
-            'total_venta': venta['total'],
-            'razon': razon,
-            'cancelado_por': session.get('usuario_id'),
-            'cancelado_por_nombre': session.get('usuario_nombre'),
-            'fecha_cancelacion': datetime.now(),
-            'fecha_venta_original': venta['fecha_venta']
-        }
-        
-        # Devolver stock de libros
-        for item in venta.get('items', []):
-            libro_id = item['libro_id']
-            cantidad = item['cantidad']
-            
-            libro = coleccion_libros.find_one({'_id': ObjectId(libro_id)})
-            if libro:
-                nuevo_stock = libro.get('stock', 0) + cantidad
-                coleccion_libros.update_one(
-                    {'_id': ObjectId(libro_id)},
-                    {'$set': {'stock': nuevo_stock}}
-                )
-        
-        # Guardar cancelación
-        coleccion_cancelaciones.insert_one(cancelacion)
-        
-        # Marcar venta como cancelada
-        coleccion_ventas.update_one(
-            {'_id': ObjectId(id)},
-            {'$set': {'estado': 'cancelada'}}
+        # Registrar cancelación, devolver stock y marcar la venta (idempotente)
+        cancelada = cancelaciones.cancelar_venta(
+            db, venta, razon,
+            cancelado_por=session.get('usuario_id'),
+            cancelado_por_nombre=session.get('usuario_nombre')
         )
+        if not cancelada:
+            flash('Esta venta ya ha sido cancelada', 'error')
+            return redirect(url_for('listar_ventas'))
+        cache_comprobantes.invalidar(id)
         
         flash('Venta cancelada exitosamente. Stock devuelto a inventario.', 'success')
         return redirect(url_for('listar_ventas'))
@@ -751,45 +1006,38 @@ def nueva_venta():
             libro_ids = request.form.getlist('libro_id[]')
             cantidades = request.form.getlist('cantidad[]')
             
-            subtotal_venta = 0
-            
-            for i, libro_id in enumerate(libro_ids):
-                if libro_id and cantidades[i] and int(cantidades[i]) > 0:
-                    cantidad = int(cantidades[i])
-                    libro = coleccion_libros.find_one({'_id': ObjectId(libro_id)})
-                    
-                    if libro and libro.get('stock', 0) >= cantidad:
-                        precio = libro.get('precio', 0)
-                        subtotal = precio * cantidad
-                        subtotal_venta += subtotal
-                        
-                        # Guardar información completa del libro
-                        items.append({
-                            'libro_id': str(libro['_id']),
-                            'titulo': libro['nombre'],
-                            'autor': libro.get('autor', ''),
-                            'genero': libro.get('genero', ''),
-                            'isbn': libro.get('isbn', ''),
-                            'cantidad': cantidad,
-                            'precio_unitario': precio,
-                            'subtotal': subtotal
-                        })
-                        
-                        # Actualizar stock
-                        nuevo_stock = libro['stock'] - cantidad
-                        coleccion_libros.update_one(
-                            {'_id': ObjectId(libro_id)},
-                            {'$set': {'stock': nuevo_stock}}
-                        )
-                    else:
-                        libro_nombre = libro['nombre'] if libro else 'Libro desconocido'
-                        flash(f'Stock insuficiente para {libro_nombre}', 'error')
-                        return redirect(url_for('nueva_venta'))
-            
-            if not items:
+            lineas = [(libro_id, int(cantidades[i])) for i, libro_id in enumerate(libro_ids)
+                      if libro_id and cantidades[i] and int(cantidades[i]) > 0]
+            if not lineas:
                 flash('Agrega al menos un libro a la venta', 'error')
                 return redirect(url_for('nueva_venta'))
             
+            # Descontar stock de todas las líneas de una vez
+            libros, error = reservar_inventario(coleccion_libros, lineas)
+            if error:
+                flash(error, 'error')
+                return redirect(url_for('nueva_venta'))
+            registrar_stock_vendido(libros, lineas)
+            
+            subtotal_venta = 0
+            for libro_id, cantidad in lineas:
+                libro = libros[libro_id]
+                precio = libro.get('precio', 0)
+                subtotal = precio * cantidad
+                subtotal_venta += subtotal
+                
+                # Guardar información completa del libro
+                items.append({
+                    'libro_id': str(libro['_id']),
+                    'titulo': libro['nombre'],
+                    'autor': libro.get('autor', ''),
+                    'genero': libro.get('genero', ''),
+                    'isbn': libro.get('isbn', ''),
+                    'cantidad': cantidad,
+                    'precio_unitario': precio,
+                    'subtotal': subtotal
+                })
+            
             # Calcular IVA y total
             iva_venta = calcular_iva(subtotal_venta)
             total_con_iva = subtotal_venta + iva_venta
@@ -815,6 +1063,7 @@ def nueva_venta():
             }
             
             resultado = coleccion_ventas.insert_one(venta)
+            resumen_ventas.registrar_venta(coleccion_ventas_diarias, venta)
             flash(f'Venta registrada exitosamente! Total con IVA: ${total_con_iva:.2f}', 'success')
             return redirect(url_for('ver_venta', id=resultado.inserted_id))
             
@@ -835,11 +1084,7 @@ def ver_venta(id):
             return redirect(url_for('listar_ventas'))
         
         # Verificar cancelación
-        cancelacion = coleccion_cancelaciones.find_one({'venta_id': id})
-        venta['cancelada'] = cancelacion is not None
-        if cancelacion:
-            venta['razon_cancelacion'] = cancelacion.get('razon', '')
-            venta['fecha_cancelacion'] = cancelacion.get('fecha_cancelacion', '')
+        enriquecer_ventas([venta])
         
         venta['puede_cancelar'] = puede_cancelar_venta(venta['fecha_venta'])
         
@@ -853,44 +1098,30 @@ def ver_venta(id):
 @app.route('/seguimiento-pedidos')
 @login_required
 def seguimiento_pedidos():
+    estado = request.args.get('estado', '')
+    if estado not in seguimiento.ESTADOS_ABIERTOS:
+        estado = ''
     try:
-        # Obtener pedidos online pendientes
-        pedidos = list(coleccion_ventas.find({
-            'tipo': 'online',
-            'estado': {'$in': ['pendiente', 'en_proceso', 'enviado']}
-        }).sort('fecha_venta', -1))
-        
-        # Obtener estados de seguimiento si existen
-        for pedido in pedidos:
-            seguimiento = coleccion_pedidos.find_one({'venta_id': str(pedido['_id'])})
-            if seguimiento:
-                pedido['estado_seguimiento'] = seguimiento.get('estado', 'pendiente')
-                pedido['ultima_actualizacion'] = seguimiento.get('ultima_actualizacion', '')
-                pedido['comentarios'] = seguimiento.get('comentarios', [])
-            else:
-                # Crear registro de seguimiento si no existe
-                nuevo_seguimiento = {
-                    'venta_id': str(pedido['_id']),
-                    'cliente_id': pedido['cliente_id'],
-                    'cliente_nombre': pedido.get('cliente_nombre', ''),
-                    'estado': 'pendiente',
-                    'fecha_pedido': pedido['fecha_venta'],
-                    'ultima_actualizacion': pedido['fecha_venta'],
-                    'comentarios': [{
-                        'fecha': pedido['fecha_venta'],
-                        'mensaje': 'Pedido recibido',
-                        'usuario': 'Sistema'
-                    }]
-                }
-                coleccion_pedidos.insert_one(nuevo_seguimiento)
-                pedido['estado_seguimiento'] = 'pendiente'
-                pedido['ultima_actualizacion'] = pedido['fecha_venta']
-                pedido['comentarios'] = nuevo_seguimiento['comentarios']
-        
-        return render_template('seguimiento_pedidos.html', pedidos=pedidos)
+        pagina = max(int(request.args.get('pagina', 1)), 1)
+        pedidos_por_pagina = 20
+        
+        # Una página de pedidos abiertos con su seguimiento ($lookup a pedidos)
+        pedidos, total_pedidos = seguimiento.tablero_pedidos(
+            coleccion_ventas, coleccion_pedidos, estado or None, pagina, pedidos_por_pagina)
+        total_paginas = (total_pedidos + pedidos_por_pagina - 1) // pedidos_por_pagina
+        
+        return render_template('seguimiento_pedidos.html',
+                             pedidos=pedidos,
+                             estado=estado,
+                             estados=seguimiento.ESTADOS_ABIERTOS,
+                             pagina=pagina,
+                             total_paginas=total_paginas,
+                             total_pedidos=total_pedidos)
     except Exception as e:
         flash(f'Error al cargar pedidos: {str(e)}', 'error')
-        return render_template('seguimiento_pedidos.html', pedidos=[])
+        return render_template('seguimiento_pedidos.html', pedidos=[], estado=estado,
+                             estados=seguimiento.ESTADOS_ABIERTOS, pagina=1,
+                             total_paginas=0, total_pedidos=0)
 
 @app.route('/actualizar-estado-pedido/<id>', methods=['POST'])
 @login_required
@@ -925,32 +1156,34 @@ def actualizar_estado_pedido(id):
                 }]
             }
         
-        # Actualizar estado
-        coleccion_pedidos.update_one(
-            {'venta_id': id},
-            {'$set': {
-                'estado': nuevo_estado,
-                'ultima_actualizacion': datetime.now()
-            }}
-        )
-        
-        # Agregar comentario si hay
+        # Actualizar estado y agregar comentario si hay, en una sola escritura
+        actualizacion = {'$set': {
+            'estado': nuevo_estado,
+            'ultima_actualizacion': datetime.now()
+        }}
         if comentario:
             nuevo_comentario = {
                 'fecha': datetime.now(),
                 'mensaje': comentario,
                 'usuario': session.get('usuario_nombre', 'Sistema')
             }
-            coleccion_pedidos.update_one(
-                {'venta_id': id},
-                {'$push': {'comentarios': nuevo_comentario}}
-            )
+            actualizacion['$push'] = {'comentarios': nuevo_comentario}
+        actualizado = coleccion_pedidos.find_one_and_update(
+            {'venta_id': id}, actualizacion, return_document=ReturnDocument.AFTER)
+        if actualizado is None:
+            # No había seguimiento: guardar el que se armó a partir de la venta
+            if comentario:
+                pedido['comentarios'].append(nuevo_comentario)
+            coleccion_pedidos.insert_one(pedido)
+            actualizado = pedido
+        publicar_seguimiento(actualizado)
         
         # Actualizar estado en ventas también
         coleccion_ventas.update_one(
             {'_id': ObjectId(id)},
             {'$set': {'estado': nuevo_estado}}
         )
+        cache_comprobantes.invalidar(id)
         
         flash(f'Estado del pedido actualizado a: {nuevo_estado}', 'success')
         return redirect(url_for('seguimiento_pedidos'))
@@ -1079,6 +1312,98 @@ def api_seguimiento(venta_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/seguimiento')
+@cliente_required
+def api_seguimiento_lote():
+    """Estados de varios pedidos en una respuesta: ?ids=a,b,c o todos los del cliente"""
+    try:
+        ids = request.args.get('ids')
+        venta_ids = [i for i in ids.split(',') if i] if ids else None
+        cliente_id = session.get('cliente_id')
+        
+        # Si nada cambió desde el último sondeo, responder 304 sin leer los pedidos
+        version = seguimiento.version_estados(coleccion_pedidos, cliente_id, venta_ids)
+        if request.if_none_match.contains_weak(version):
+            respuesta = make_response('', 304)
+            respuesta.set_etag(version, weak=True)
+            return respuesta
+        
+        respuesta = jsonify({'pedidos': seguimiento.estados_cliente(
+            coleccion_ventas, coleccion_pedidos, cliente_id, venta_ids)})
+        respuesta.set_etag(version, weak=True)
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+        return respuesta
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ----------------- EVENTOS DE SEGUIMIENTO (SSE) -----------------
+
+broker_pedidos = BrokerPedidos(latido=app.config['SEGUIMIENTO_LATIDO'])
+escucha_pedidos = None  # Hilo del change stream, si está activo
+
+def publicar_seguimiento(pedido):
+    """Avisar a las conexiones abiertas del cliente que su pedido cambió.
+
+    Si el change stream está escuchando, él publica el cambio (también los
+    hechos por otros procesos) y aquí no se hace nada para no duplicarlo.
+    """
+    if escucha_pedidos is not None and escucha_pedidos.is_alive():
+        return
+    broker_pedidos.publicar(pedido['cliente_id'], seguimiento.estado_pedido(pedido))
+
+def worker_asincrono():
+    """True si el proceso corre con gevent (sockets parcheados)"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+@app.route('/api/seguimiento/eventos')
+@cliente_required
+def eventos_seguimiento():
+    """Canal text/event-stream con los cambios de los pedidos del cliente.
+
+    Cada conexión queda abierta mientras la pestaña esté abierta: en un
+    worker sync o gthread ocuparía un hilo entero, así que sólo se atiende
+    con gevent (o con el servidor de desarrollo). Con 503 el navegador
+    cierra el EventSource y la página vuelve a consultar por sondeo.
+    """
+    if not (worker_asincrono() or app.debug):
+        return jsonify({'error': 'Canal de eventos no disponible en este servidor'}), 503
+    flujo = broker_pedidos.flujo(session['cliente_id'], app.json.dumps)
+    return Response(stream_with_context(flujo), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Evitar que nginx acumule el flujo
+    })
+
+# ----------------- COMPROBANTES EN PDF -----------------
+
+cache_comprobantes = CacheComprobantes(app.config['COMPROBANTES_CACHE'],
+                                       app.config['COMPROBANTES_CACHE_MAX_BYTES'])
+
+def enviar_comprobante(venta, variante, nombre_descarga):
+    """Servir un comprobante desde la cache en disco, con ETag/If-None-Match"""
+    version = cache_comprobantes.version(venta, variante)
+    if version in request.if_none_match:
+        respuesta = make_response('', 304)
+        respuesta.set_etag(version)
+        return respuesta
+    
+    ruta, version = cache_comprobantes.obtener_o_generar(
+        venta, variante, lambda v: generar_comprobante(v, variante))
+    respuesta = send_file(
+        ruta,
+        as_attachment=True,
+        download_name=nombre_descarga,
+        mimetype='application/pdf',
+        etag=version,
+        conditional=True
+    )
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
 # ----------------- COMPROBANTE DE VENTA -----------------
 
 @app.route('/ventas/<id>/comprobante')
@@ -1089,127 +1414,7 @@ def comprobante_venta(id):
         if not venta:
             return "Venta no encontrada", 404
         
-        # Crear PDF
-        buffer = io.BytesIO()
-        pdf = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        # Configuración inicial
-        pdf.setTitle(f"Comprobante de Venta - {venta['_id']}")
-        
-        # Encabezado
-        pdf.setFont("Helvetica-Bold", 18)
-        pdf.drawString(100, height - 50, "BIBLIOTECA DIGITAL")
-        pdf.setFont("Helvetica-Bold", 16)
-        pdf.drawString(100, height - 70, "COMPROBANTE DE VENTA")
-        pdf.line(100, height - 75, 500, height - 75)
-        
-        # Información de la venta
-        y_position = height - 100
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(100, y_position, "INFORMACIÓN DE LA VENTA:")
-        pdf.setFont("Helvetica", 10)
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Folio: {str(venta['_id'])}")
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Fecha: {venta['fecha_venta'].strftime('%d/%m/%Y')}")
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Hora: {venta['fecha_venta'].strftime('%H:%M:%S')}")
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Estado: {venta.get('estado', 'Completada')}")
-        
-        # Información del cliente
-        y_position -= 25
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(100, y_position, "INFORMACIÓN DEL CLIENTE:")
-        pdf.setFont("Helvetica", 10)
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Nombre: {venta.get('cliente_nombre', 'N/A')}")
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Email: {venta.get('cliente_email', 'N/A')}")
-        if venta.get('cliente_telefono'):
-            y_position -= 15
-            pdf.drawString(100, y_position, f"Teléfono: {venta['cliente_telefono']}")
-        
-        # Información del vendedor
-        y_position -= 25
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(100, y_position, "INFORMACIÓN DEL VENDEDOR:")
-        pdf.setFont("Helvetica", 10)
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Atendió: {venta.get('usuario_nombre', 'N/A')}")
-        
-        # Tabla de productos
-        y_position -= 30
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(100, y_position, "DETALLE DE PRODUCTOS:")
-        
-        # Encabezados de la tabla
-        y_position -= 20
-        pdf.setFont("Helvetica-Bold", 10)
-        pdf.drawString(100, y_position, "Producto")
-        pdf.drawString(300, y_position, "Cant.")
-        pdf.drawString(350, y_position, "Precio Unit.")
-        pdf.drawString(450, y_position, "Subtotal")
-        
-        y_position -= 10
-        pdf.line(100, y_position, 500, y_position)
-        y_position -= 10
-        
-        # Items de la venta
-        pdf.setFont("Helvetica", 9)
-        for item in venta.get('items', []):
-            if y_position < 150:  # Nueva página si es necesario
-                pdf.showPage()
-                y_position = height - 50
-                pdf.setFont("Helvetica", 9)
-            
-            # Título del libro
-            titulo = item['titulo']
-            if len(titulo) > 40:
-                titulo = titulo[:37] + "..."
-            
-            pdf.drawString(100, y_position, titulo)
-            pdf.drawString(300, y_position, str(item['cantidad']))
-            pdf.drawString(350, y_position, f"${item['precio_unitario']:.2f}")
-            pdf.drawString(450, y_position, f"${item['subtotal']:.2f}")
-            
-            y_position -= 20
-        
-        # Línea separadora
-        y_position -= 10
-        pdf.line(100, y_position, 500, y_position)
-        
-        # Totales
-        subtotal = venta.get('subtotal', 0)
-        iva = venta.get('iva', 0)
-        total = venta.get('total', 0)
-        
-        y_position -= 20
-        pdf.setFont("Helvetica", 10)
-        pdf.drawString(350, y_position, f"Subtotal: ${subtotal:.2f}")
-        y_position -= 15
-        pdf.drawString(350, y_position, f"IVA (16%): ${iva:.2f}")
-        y_position -= 15
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(350, y_position, f"TOTAL: ${total:.2f}")
-        
-        # Pie de página con agradecimiento
-        y_position -= 40
-        pdf.setFont("Helvetica-Oblique", 10)
-        pdf.drawString(100, y_position, "¡Gracias por su compra en Biblioteca Digital!")
-        y_position -= 15
-        pdf.drawString(100, y_position, "Esperamos volver a servirle pronto.")
-        
-        pdf.save()
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=f"comprobante_venta_{id}.pdf",
-            mimetype='application/pdf'
-        )
+        return enviar_comprobante(venta, 'venta', f"comprobante_venta_{id}.pdf")
         
     except Exception as e:
         return f"Error al generar comprobante: {e}", 500
@@ -1221,25 +1426,58 @@ def comprobante_venta(id):
 def catalogo_cliente():
     try:
         query = request.args.get('q', '')
-        if query:
-            libros = list(coleccion_libros.find({
-                '$or': [
-                    {'nombre': {'$regex': query, '$options': 'i'}},
-                    {'autor': {'$regex': query, '$options': 'i'}},
-                    {'genero': {'$regex': query, '$options': 'i'}}
-                ],
-                'stock': {'$gt': 0}
-            }))
-        else:
-            libros = list(coleccion_libros.find({'stock': {'$gt': 0}}))
-        
-        # Inicializar carrito si no existe
-        if 'carrito' not in session:
-            session['carrito'] = []
-        return render_template('catalogo_cliente.html', libros=libros, query=query)
+        orden = request.args.get('orden', 'titulo')
+        if orden not in catalogo.ORDENES:
+            orden = 'titulo'
+        
+        # Primera página en el servidor; las siguientes las pide el navegador a /api/catalogo
+        entrada = obtener_cache_catalogo().obtener(
+            ('catalogo', query, orden),
+            lambda: catalogo.pagina_catalogo(coleccion_libros, query, orden,
+                                             limite=app.config['CATALOGO_POR_PAGINA']))
+        carrito_count = carritos.contar(coleccion_carritos, carrito_actual())
+        return responder_catalogo('catalogo_cliente.html', entrada, (carrito_count,),
+                                  query=query, orden=orden, siguiente=entrada['siguiente'],
+                                  carrito_count=carrito_count)
     except Exception as e:
         flash(f'Error al cargar catálogo: {e}', 'error')
-        return render_template('catalogo_cliente.html', libros=[], query='')
+        return render_template('catalogo_cliente.html', libros=[], query='', orden='titulo',
+                               siguiente=None, carrito_count=0)
+
+@app.route('/api/catalogo')
+@cliente_required
+def api_catalogo():
+    """Páginas del catálogo en JSON: ?q=&orden=titulo|precio|recientes&despues=&limite=&campos="""
+    query = request.args.get('q', '')
+    orden = request.args.get('orden', 'titulo')
+    if orden not in catalogo.ORDENES:
+        return jsonify({'error': 'Orden no válido'}), 400
+    despues = request.args.get('despues') or None
+    campos = tuple(c for c in request.args.get('campos', '').split(',') if c in catalogo.CAMPOS)
+    campos = campos or catalogo.CAMPOS
+    try:
+        limite = min(max(int(request.args.get('limite', app.config['CATALOGO_POR_PAGINA'])), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'Límite no válido'}), 400
+    
+    try:
+        entrada = obtener_cache_catalogo().obtener(
+            ('api', query, orden, despues, limite, campos),
+            lambda: catalogo.pagina_catalogo(coleccion_libros, query, orden, despues, limite, campos))
+    except (ValueError, KeyError, TypeError, InvalidId):
+        return jsonify({'error': 'Cursor no válido'}), 400
+    
+    version = catalogo.etag(entrada)
+    if version in request.if_none_match:
+        respuesta = make_response('', 304)
+    else:
+        respuesta = jsonify({
+            'libros': [dict(libro, _id=str(libro['_id'])) for libro in entrada['libros']],
+            'siguiente': entrada['siguiente']
+        })
+    respuesta.set_etag(version)
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
 
 @app.route('/carrito/agregar', methods=['POST'])
 @cliente_required
@@ -1248,48 +1486,21 @@ def agregar_carrito():
         libro_id = request.form.get('libro_id')
         cantidad = int(request.form.get('cantidad', 1))
         
-        libro = coleccion_libros.find_one({'_id': ObjectId(libro_id)})
+        libro = coleccion_libros.find_one({'_id': ObjectId(libro_id)}, carritos.PROYECCION_LIBRO)
         if not libro:
             return jsonify({'éxito': False, 'error': 'Libro no encontrado'})
         
         if libro.get('stock', 0) < cantidad:
             return jsonify({'éxito': False, 'error': 'Stock insuficiente'})
         
-        # Inicializar carrito si no existe
-        carrito = session.get('carrito', [])
-        
-        # Verificar si el libro ya está en el carrito
-        libro_en_carrito = None
-        for item in carrito:
-            if item['libro_id'] == libro_id:
-                libro_en_carrito = item
-                break
-        
-        if libro_en_carrito:
-            # Actualizar cantidad si ya está en el carrito
-            nueva_cantidad = libro_en_carrito['cantidad'] + cantidad
-            if nueva_cantidad > libro['stock']:
-                return jsonify({'éxito': False, 'error': 'Stock insuficiente para la cantidad solicitada'})
-            libro_en_carrito['cantidad'] = nueva_cantidad
-            libro_en_carrito['subtotal'] = libro['precio'] * nueva_cantidad
-        else:
-            # Agregar nuevo item al carrito
-            carrito.append({
-                'libro_id': libro_id,
-                'titulo': libro['nombre'],
-                'autor': libro.get('autor', ''),
-                'precio': libro['precio'],
-                'cantidad': cantidad,
-                'subtotal': libro['precio'] * cantidad,
-                'imagen_url': libro.get('imagen_url', '')
-            })
-        
-        session['carrito'] = carrito
-        session.modified = True
+        # Sumar la línea en el carrito sin pasar del stock
+        carrito_count = carritos.agregar(coleccion_carritos, carrito_actual(), libro, cantidad)
+        if carrito_count is None:
+            return jsonify({'éxito': False, 'error': 'Stock insuficiente para la cantidad solicitada'})
         
         return jsonify({
             'éxito': True,
-            'carrito_count': len(carrito)
+            'carrito_count': carrito_count
         })
         
     except Exception as e:
@@ -1299,7 +1510,11 @@ def agregar_carrito():
 @cliente_required
 def ver_carrito():
     try:
-        carrito = session.get('carrito', [])
+        # Precios y stock vigentes de todas las líneas en una sola consulta
+        carrito, _, faltantes = carritos.cotizar(
+            coleccion_libros, carritos.obtener(coleccion_carritos, carrito_actual()))
+        for faltante in faltantes:
+            flash(faltante, 'error')
         subtotal = sum(item['subtotal'] for item in carrito)
         iva = calcular_iva(subtotal)
         total = subtotal + iva
@@ -1318,22 +1533,14 @@ def actualizar_carrito():
         if nueva_cantidad <= 0:
             return jsonify({'success': False, 'message': 'La cantidad debe ser mayor a 0'})
         
-        libro = coleccion_libros.find_one({'_id': ObjectId(libro_id)})
+        libro = coleccion_libros.find_one({'_id': ObjectId(libro_id)}, carritos.PROYECCION_LIBRO)
         if not libro:
             return jsonify({'success': False, 'message': 'Libro no encontrado'})
         
         if libro.get('stock', 0) < nueva_cantidad:
             return jsonify({'success': False, 'message': 'Stock insuficiente'})
         
-        carrito = session.get('carrito', [])
-        for item in carrito:
-            if item['libro_id'] == libro_id:
-                item['cantidad'] = nueva_cantidad
-                item['subtotal'] = libro['precio'] * nueva_cantidad
-                break
-        
-        session['carrito'] = carrito
-        session.modified = True
+        carrito = carritos.actualizar(coleccion_carritos, carrito_actual(), libro, nueva_cantidad)
         
         subtotal = sum(item['subtotal'] for item in carrito)
         iva = calcular_iva(subtotal)
@@ -1354,10 +1561,7 @@ def actualizar_carrito():
 @cliente_required
 def eliminar_del_carrito(libro_id):
     try:
-        carrito = session.get('carrito', [])
-        carrito = [item for item in carrito if item['libro_id'] != libro_id]
-        session['carrito'] = carrito
-        session.modified = True
+        carritos.eliminar(coleccion_carritos, carrito_actual(), libro_id)
         
         flash('Libro eliminado del carrito', 'success')
         return redirect(url_for('ver_carrito'))
@@ -1370,8 +1574,7 @@ def eliminar_del_carrito(libro_id):
 @cliente_required
 def vaciar_carrito():
     try:
-        session['carrito'] = []
-        session.modified = True
+        carritos.vaciar(coleccion_carritos, carrito_actual())
         flash('Carrito vaciado', 'success')
         return redirect(url_for('ver_carrito'))
     except Exception as e:
@@ -1382,7 +1585,7 @@ def vaciar_carrito():
 @cliente_required
 def comprar_carrito():
     try:
-        carrito = session.get('carrito', [])
+        carrito = carritos.obtener(coleccion_carritos, carrito_actual())
         
         if not carrito:
             flash('El carrito está vacío', 'error')
@@ -1391,17 +1594,24 @@ def comprar_carrito():
         items = []
         subtotal_venta = 0
         
-        # Verificar stock y preparar items
+        # Revalidar precios y stock de todas las líneas en una sola consulta
+        carrito, libros, faltantes = carritos.cotizar(coleccion_libros, carrito, campos=('genero', 'isbn'))
+        if faltantes:
+            # ver_carrito vuelve a cotizar y muestra cada faltante
+            flash('No se pudo completar la compra: revisa el stock de tu carrito', 'error')
+            return redirect(url_for('ver_carrito'))
+        
+        # Descontar stock de todo el carrito de una vez
+        lineas = [(item['libro_id'], item['cantidad']) for item in carrito]
+        libros, error = reservar_inventario(coleccion_libros, lineas, libros)
+        if error:
+            flash(error, 'error')
+            return redirect(url_for('ver_carrito'))
+        registrar_stock_vendido(libros, lineas)
+        
+        # Preparar items
         for item_carrito in carrito:
-            libro = coleccion_libros.find_one({'_id': ObjectId(item_carrito['libro_id'])})
-            if not libro:
-                flash(f'Libro {item_carrito["titulo"]} no encontrado', 'error')
-                return redirect(url_for('ver_carrito'))
-            
-            if libro.get('stock', 0) < item_carrito['cantidad']:
-                flash(f'Stock insuficiente para {libro["nombre"]}', 'error')
-                return redirect(url_for('ver_carrito'))
-            
+            libro = libros[item_carrito['libro_id']]
             items.append({
                 'libro_id': str(libro['_id']),
                 'titulo': libro['nombre'],
@@ -1414,13 +1624,6 @@ def comprar_carrito():
             })
             
             subtotal_venta += item_carrito['subtotal']
-            
-            # Actualizar stock
-            nuevo_stock = libro['stock'] - item_carrito['cantidad']
-            coleccion_libros.update_one(
-                {'_id': ObjectId(item_carrito['libro_id'])},
-                {'$set': {'stock': nuevo_stock}}
-            )
         
         # Calcular IVA y total
         iva_venta = calcular_iva(subtotal_venta)
@@ -1441,6 +1644,7 @@ def comprar_carrito():
         }
         
         resultado = coleccion_ventas.insert_one(venta)
+        resumen_ventas.registrar_venta(coleccion_ventas_diarias, venta)
         
         # Crear registro de seguimiento
         seguimiento = {
@@ -1459,8 +1663,7 @@ def comprar_carrito():
         coleccion_pedidos.insert_one(seguimiento)
         
         # Vaciar carrito después de la compra
-        session['carrito'] = []
-        session.modified = True
+        carritos.vaciar(coleccion_carritos, carrito_actual())
         
         flash(f'¡Compra realizada exitosamente! Total con IVA: ${total_venta:.2f}', 'success')
         return redirect(url_for('ver_compra', id=resultado.inserted_id))
@@ -1476,14 +1679,13 @@ def comprar_directo():
         libro_id = request.form.get('libro_id')
         cantidad = int(request.form.get('cantidad', 1))
         
-        libro = coleccion_libros.find_one({'_id': ObjectId(libro_id)})
-        if not libro:
-            flash('Libro no encontrado', 'error')
-            return redirect(url_for('catalogo_cliente'))
-        
-        if libro.get('stock', 0) < cantidad:
-            flash('Stock insuficiente', 'error')
+        # Verificar y descontar stock en una sola operación
+        libros, error = reservar_inventario(coleccion_libros, [(libro_id, cantidad)])
+        if error:
+            flash(error, 'error')
             return redirect(url_for('catalogo_cliente'))
+        registrar_stock_vendido(libros, [(libro_id, cantidad)])
+        libro = libros[libro_id]
         
         # Crear venta con información completa
         subtotal = libro.get('precio', 0) * cantidad
@@ -1514,14 +1716,8 @@ def comprar_directo():
             'tipo': 'online'
         }
         
-        # Actualizar stock
-        nuevo_stock = libro['stock'] - cantidad
-        coleccion_libros.update_one(
-            {'_id': ObjectId(libro_id)},
-            {'$set': {'stock': nuevo_stock}}
-        )
-        
         resultado = coleccion_ventas.insert_one(venta)
+        resumen_ventas.registrar_venta(coleccion_ventas_diarias, venta)
         
         # Crear registro de seguimiento
         seguimiento = {
@@ -1553,12 +1749,9 @@ def comprar_directo():
 def mis_compras():
     try:
         ventas_cursor = coleccion_ventas.find({'cliente_id': session.get('cliente_id', '')})
-        ventas = list(ventas_cursor)
+        ventas = enriquecer_ventas(list(ventas_cursor))
         
         for venta in ventas:
-            # Verificar cancelación
-            cancelacion = coleccion_cancelaciones.find_one({'venta_id': str(venta['_id'])})
-            venta['cancelada'] = cancelacion is not None
             venta['puede_cancelar'] = puede_cancelar_venta(venta['fecha_venta'])
         
         # Ordenar por fecha descendente
@@ -1582,12 +1775,6 @@ def cancelar_mi_compra(id):
             flash('Compra no encontrada', 'error')
             return redirect(url_for('mis_compras'))
         
-        # Verificar si ya está cancelada
-        cancelacion_existente = coleccion_cancelaciones.find_one({'venta_id': id})
-        if cancelacion_existente:
-            flash('Esta compra ya ha sido cancelada', 'error')
-            return redirect(url_for('mis_compras'))
-        
         # Verificar tiempo (15 minutos)
         if not puede_cancelar_venta(venta['fecha_venta']):
             flash('No se puede cancelar la compra después de 15 minutos', 'error')
@@ -1595,40 +1782,17 @@ def cancelar_mi_compra(id):
         
         razon = request.form.get('razon', 'Cancelación solicitada por el cliente')
         
-        # Crear registro de cancelación
-        cancelacion = {
-            'venta_id': id,
-            'cliente_id': session.get('cliente_id', ''),
-            'cliente_nombre': session.get('cliente_nombre', ''),
-            'total_venta': venta['total'],
-            'razon': razon,
-            'cancelado_por': session.get('cliente_id', ''),
-            'cancelado_por_nombre': session.get('cliente_nombre', ''),
-            'fecha_cancelacion': datetime.now(),
-            'fecha_venta_original': venta['fecha_venta']
-        }
-        
-        # Devolver stock de libros
-        for item in venta.get('items', []):
-            libro_id = item['libro_id']
-            cantidad = item['cantidad']
-            
-            libro = coleccion_libros.find_one({'_id': ObjectId(libro_id)})
-            if libro:
-                nuevo_stock = libro.get('stock', 0) + cantidad
-                coleccion_libros.update_one(
-                    {'_id': ObjectId(libro_id)},
-                    {'$set': {'stock': nuevo_stock}}
-                )
-        
-        # Guardar cancelación
-        coleccion_cancelaciones.insert_one(cancelacion)
-        
-        # Marcar venta como cancelada
-        coleccion_ventas.update_one(
-            {'_id': ObjectId(id)},
-            {'$set': {'estado': 'cancelada'}}
+        # Registrar cancelación, devolver stock y marcar la compra (idempotente)
+        cancelada = cancelaciones.cancelar_venta(
+            db, venta, razon,
+            cancelado_por=session.get('cliente_id', ''),
+            cancelado_por_nombre=session.get('cliente_nombre', ''),
+            cliente_nombre=session.get('cliente_nombre', '')
         )
+        if not cancelada:
+            flash('Esta compra ya ha sido cancelada', 'error')
+            return redirect(url_for('mis_compras'))
+        cache_comprobantes.invalidar(id)
         
         flash('Compra cancelada exitosamente. Stock devuelto a inventario.', 'success')
         return redirect(url_for('mis_compras'))
@@ -1648,116 +1812,7 @@ def comprobante_cliente(id):
             flash('Compra no encontrada', 'error')
             return redirect(url_for('mis_compras'))
         
-        # Crear PDF
-        buffer = io.BytesIO()
-        pdf = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        # Configuración inicial
-        pdf.setTitle(f"Comprobante de Compra - {venta['_id']}")
-        
-        # Encabezado
-        pdf.setFont("Helvetica-Bold", 18)
-        pdf.drawString(100, height - 50, "BIBLIOTECA DIGITAL")
-        pdf.setFont("Helvetica-Bold", 16)
-        pdf.drawString(100, height - 70, "COMPROBANTE DE COMPRA")
-        pdf.line(100, height - 75, 500, height - 75)
-        
-        # Información de la compra
-        y_position = height - 100
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(100, y_position, "INFORMACIÓN DE LA COMPRA:")
-        pdf.setFont("Helvetica", 10)
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Folio: {str(venta['_id'])}")
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Fecha: {venta['fecha_venta'].strftime('%d/%m/%Y')}")
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Hora: {venta['fecha_venta'].strftime('%H:%M:%S')}")
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Estado: {venta.get('estado', 'Completada')}")
-        
-        # Información del cliente
-        y_position -= 25
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(100, y_position, "INFORMACIÓN DEL CLIENTE:")
-        pdf.setFont("Helvetica", 10)
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Nombre: {venta.get('cliente_nombre', 'N/A')}")
-        y_position -= 15
-        pdf.drawString(100, y_position, f"Email: {venta.get('cliente_email', 'N/A')}")
-        
-        # Tabla de productos
-        y_position -= 30
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(100, y_position, "DETALLE DE PRODUCTOS:")
-        
-        # Encabezados de la tabla
-        y_position -= 20
-        pdf.setFont("Helvetica-Bold", 10)
-        pdf.drawString(100, y_position, "Producto")
-        pdf.drawString(300, y_position, "Cant.")
-        pdf.drawString(350, y_position, "Precio Unit.")
-        pdf.drawString(450, y_position, "Subtotal")
-        
-        y_position -= 10
-        pdf.line(100, y_position, 500, y_position)
-        y_position -= 10
-        
-        # Items de la venta
-        pdf.setFont("Helvetica", 9)
-        for item in venta.get('items', []):
-            if y_position < 150:  # Nueva página si es necesario
-                pdf.showPage()
-                y_position = height - 50
-                pdf.setFont("Helvetica", 9)
-            
-            # Título del libro
-            titulo = item['titulo']
-            if len(titulo) > 40:
-                titulo = titulo[:37] + "..."
-            
-            pdf.drawString(100, y_position, titulo)
-            pdf.drawString(300, y_position, str(item['cantidad']))
-            pdf.drawString(350, y_position, f"${item['precio_unitario']:.2f}")
-            pdf.drawString(450, y_position, f"${item['subtotal']:.2f}")
-            
-            y_position -= 20
-        
-        # Línea separadora
-        y_position -= 10
-        pdf.line(100, y_position, 500, y_position)
-        
-        # Totales
-        subtotal = venta.get('subtotal', 0)
-        iva = venta.get('iva', 0)
-        total = venta.get('total', 0)
-        
-        y_position -= 20
-        pdf.setFont("Helvetica", 10)
-        pdf.drawString(350, y_position, f"Subtotal: ${subtotal:.2f}")
-        y_position -= 15
-        pdf.drawString(350, y_position, f"IVA (16%): ${iva:.2f}")
-        y_position -= 15
-        pdf.setFont("Helvetica-Bold", 12)
-        pdf.drawString(350, y_position, f"TOTAL: ${total:.2f}")
-        
-        # Pie de página con agradecimiento
-        y_position -= 40
-        pdf.setFont("Helvetica-Oblique", 10)
-        pdf.drawString(100, y_position, "¡Gracias por su compra en Biblioteca Digital!")
-        y_position -= 15
-        pdf.drawString(100, y_position, "Esperamos volver a servirle pronto.")
-        
-        pdf.save()
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=f"comprobante_compra_{id}.pdf",
-            mimetype='application/pdf'
-        )
+        return enviar_comprobante(venta, 'cliente', f"comprobante_compra_{id}.pdf")
         
     except Exception as e:
         return f"Error al generar comprobante: {e}", 500
@@ -1784,109 +1839,137 @@ def ver_compra(id):
 @login_required
 def reporte_ventas_pdf():
     try:
-        tipo = request.args.get('tipo', 'dia')
-        fecha_str = request.args.get('fecha', '')
-        fecha_inicio = request.args.get('inicio', '')
-        fecha_fin = request.args.get('fin', '')
-        
-        # Construir consulta según el tipo de reporte
-        query = {}
-        
-        if tipo == 'dia' and fecha_str:
-            fecha = datetime.strptime(fecha_str, '%Y-%m-%d')
-            query['fecha_venta'] = {
-                '$gte': fecha,
-                '$lt': fecha + timedelta(days=1)
-            }
-        elif tipo == 'mes' and fecha_str:
-            fecha = datetime.strptime(fecha_str, '%Y-%m')
-            next_month = fecha.replace(day=28) + timedelta(days=4)
-            next_month = next_month.replace(day=1)
-            query['fecha_venta'] = {
-                '$gte': fecha,
-                '$lt': next_month
-            }
-        elif tipo == 'anio' and fecha_str:
-            año = int(fecha_str)
-            query['fecha_venta'] = {
-                '$gte': datetime(año, 1, 1),
-                '$lt': datetime(año + 1, 1, 1)
-            }
-        elif tipo == 'personalizado' and fecha_inicio and fecha_fin:
-            inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d')
-            fin = datetime.strptime(fecha_fin, '%Y-%m-%d') + timedelta(days=1)
-            query['fecha_venta'] = {
-                '$gte': inicio,
-                '$lt': fin
-            }
-        
-        # Obtener ventas filtradas
-        ventas = list(coleccion_ventas.find(query).sort('fecha_venta', -1))
-        
-        # Crear PDF
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        elements = []
+        tipo, fecha_str, query, titulo = parametros_reporte_pdf(request.args)
         
-        styles = getSampleStyleSheet()
+        # El PDF se escribe a un archivo temporal (en memoria sólo si es pequeño);
+        # reportlab aún guarda las páginas hasta terminar, ver reportes_pdf.py
+        archivo = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        generar_reporte_ventas(coleccion_ventas, query, titulo, archivo)
+        archivo.seek(0)
         
-        # Título del reporte
-        titulo = f"Reporte de Ventas - {tipo.capitalize()}"
-        if fecha_str:
-            titulo += f" - {fecha_str}"
-        elements.append(Paragraph(titulo, styles['Title']))
-        elements.append(Spacer(1, 12))
-        
-        # Estadísticas
-        total_ventas = len(ventas)
-        total_ingresos = sum(venta.get('total', 0) for venta in ventas)
-        
-        elements.append(Paragraph(f"Total de Ventas: {total_ventas}", styles['Normal']))
-        elements.append(Paragraph(f"Ingresos Totales: ${total_ingresos:.2f}", styles['Normal']))
-        elements.append(Spacer(1, 12))
-        
-        # Tabla de ventas
-        if ventas:
-            data = [['Folio', 'Cliente', 'Fecha', 'Total', 'Tipo']]
-            
-            for venta in ventas:
-                data.append([
-                    str(venta.get('_id', ''))[:8] + '...',
-                    venta.get('cliente_nombre', ''),
-                    venta.get('fecha_venta', datetime.now()).strftime('%d/%m/%Y %H:%M'),
-                    f"${venta.get('total', 0):.2f}",
-                    venta.get('tipo', '')
-                ])
-            
-            table = Table(data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            elements.append(table)
-        else:
-            elements.append(Paragraph("No hay ventas en el período seleccionado", styles['Normal']))
-        
-        # Generar PDF
-        doc.build(elements)
-        
-        buffer.seek(0)
-        response = make_response(buffer.getvalue())
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename=reporte_ventas_{tipo}_{fecha_str}.pdf'
-        
-        return response
+        return send_file(
+            archivo,
+            as_attachment=True,
+            download_name=f"reporte_ventas_{tipo}_{fecha_str}.pdf",
+            mimetype='application/pdf'
+        )
         
     except Exception as e:
         return f"Error al generar reporte: {str(e)}", 500
 
+# ----------------- REPORTES PDF EN SEGUNDO PLANO -----------------
+
+cola_reportes_pdf = None
+
+def obtener_cola_reportes_pdf():
+    """Cola de reportes PDF del proceso, creada al primer uso"""
+    global cola_reportes_pdf
+    if cola_reportes_pdf is None:
+        cola_reportes_pdf = ColaReportesPDF(
+            coleccion_trabajos_pdf,
+            app.config['REPORTES_PDF_DIR'],
+            app.config['MONGO_URI'],
+            db.name,
+            max_workers=app.config['REPORTES_PDF_WORKERS'],
+            vigencia=app.config['REPORTES_PDF_VIGENCIA']
+        )
+    return cola_reportes_pdf
+
+def estado_trabajo_pdf(trabajo):
+    """Datos JSON de un trabajo de reporte PDF"""
+    datos = {
+        'trabajo_id': str(trabajo['_id']),
+        'estado': trabajo['estado'],
+        'titulo': trabajo.get('titulo', ''),
+        'creado': trabajo['creado'].strftime('%Y-%m-%d %H:%M:%S'),
+        'expira': trabajo['expira'].strftime('%Y-%m-%d %H:%M:%S'),
+        'url_estado': url_for('estado_reporte_pdf', trabajo_id=str(trabajo['_id']))
+    }
+    if trabajo['estado'] == 'terminado':
+        datos['url_descarga'] = url_for('descargar_reporte_pdf', trabajo_id=str(trabajo['_id']))
+    if trabajo['estado'] == 'error':
+        datos['error'] = trabajo.get('error', '')
+    return datos
+
+@app.route('/reporte-ventas-pdf/trabajos', methods=['POST'])
+@login_required
+def encolar_reporte_pdf():
+    try:
+        tipo, fecha_str, query, titulo = parametros_reporte_pdf(request.values)
+        trabajo = obtener_cola_reportes_pdf().encolar(
+            tipo, query, titulo, f"reporte_ventas_{tipo}_{fecha_str}.pdf")
+        return jsonify(estado_trabajo_pdf(trabajo)), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/reporte-ventas-pdf/trabajos/<trabajo_id>')
+@login_required
+def estado_reporte_pdf(trabajo_id):
+    trabajo = obtener_cola_reportes_pdf().obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({'error': 'Trabajo no encontrado o vencido'}), 404
+    return jsonify(estado_trabajo_pdf(trabajo))
+
+@app.route('/reporte-ventas-pdf/trabajos/<trabajo_id>/descargar')
+@login_required
+def descargar_reporte_pdf(trabajo_id):
+    trabajo = obtener_cola_reportes_pdf().obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({'error': 'Trabajo no encontrado o vencido'}), 404
+    if trabajo['estado'] != 'terminado' or not os.path.exists(trabajo['ruta']):
+        return jsonify({'error': 'El reporte aún no está listo'}), 409
+    return send_file(
+        trabajo['ruta'],
+        as_attachment=True,
+        download_name=trabajo['nombre_archivo'],
+        mimetype='application/pdf'
+    )
+
+def parametros_reporte_pdf(parametros):
+    """Obtener (tipo, fecha, consulta, título) del reporte PDF a partir de los parámetros"""
+    tipo = parametros.get('tipo', 'dia')
+    fecha_str = parametros.get('fecha', '')
+    fecha_inicio = parametros.get('inicio', '')
+    fecha_fin = parametros.get('fin', '')
+    
+    # Construir consulta según el tipo de reporte
+    query = {}
+    
+    if tipo == 'dia' and fecha_str:
+        fecha = datetime.strptime(fecha_str, '%Y-%m-%d')
+        query['fecha_venta'] = {
+            '$gte': fecha,
+            '$lt': fecha + timedelta(days=1)
+        }
+    elif tipo == 'mes' and fecha_str:
+        fecha = datetime.strptime(fecha_str, '%Y-%m')
+        next_month = fecha.replace(day=28) + timedelta(days=4)
+        next_month = next_month.replace(day=1)
+        query['fecha_venta'] = {
+            '$gte': fecha,
+            '$lt': next_month
+        }
+    elif tipo == 'anio' and fecha_str:
+        año = int(fecha_str)
+        query['fecha_venta'] = {
+            '$gte': datetime(año, 1, 1),
+            '$lt': datetime(año + 1, 1, 1)
+        }
+    elif tipo == 'personalizado' and fecha_inicio and fecha_fin:
+        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d')
+        fin = datetime.strptime(fecha_fin, '%Y-%m-%d') + timedelta(days=1)
+        query['fecha_venta'] = {
+            '$gte': inicio,
+            '$lt': fin
+        }
+    
+    # Título del reporte
+    titulo = f"Reporte de Ventas - {tipo.capitalize()}"
+    if fecha_str:
+        titulo += f" - {fecha_str}"
+    
+    return tipo, fecha_str, query, titulo
+
 # ----------------- REPORTES DE VENTAS -----------------
 
 @app.route('/reportes')
@@ -1919,53 +2002,76 @@ def reportes_ventas():
             fecha_fin = datetime.now()
             titulo_periodo = "Hoy"
         
-        # Consultar ventas del período
-        ventas_cursor = coleccion_ventas.find({
-            'fecha_venta': {'$gte': fecha_inicio, '$lte': fecha_fin}
-        }).sort('fecha_venta', -1)
-        
-        ventas = list(ventas_cursor)
+        filtro = {'fecha_venta': {'$gte': fecha_inicio, '$lte': fecha_fin}}
+        
+        # Todas las estadísticas del período en una sola agregación
+        pipeline = [
+            {"$match": filtro},
+            {"$facet": {
+                "totales": [
+                    {"$group": {
+                        "_id": None,
+                        "total_ventas": {"$sum": 1},
+                        "total_ingresos": {"$sum": "$total"},
+                        "total_iva": {"$sum": "$iva"},
+                        "total_subtotal": {"$sum": "$subtotal"}
+                    }}
+                ],
+                "por_tipo": [
+                    {"$group": {"_id": "$tipo", "ventas": {"$sum": 1}}}
+                ],
+                "top_productos": [
+                    {"$unwind": "$items"},
+                    {"$group": {
+                        "_id": "$items.libro_id",
+                        "titulo": {"$first": "$items.titulo"},
+                        "cantidad": {"$sum": "$items.cantidad"},
+                        "total": {"$sum": "$items.subtotal"}
+                    }},
+                    {"$sort": {"cantidad": -1}},
+                    {"$limit": 10}
+                ],
+                "por_dia": [
+                    {"$group": {
+                        "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$fecha_venta"}},
+                        "monto": {"$sum": "$total"}
+                    }},
+                    {"$sort": {"_id": 1}}
+                ]
+            }}
+        ]
+        resultado = next(coleccion_ventas.aggregate(pipeline))
         
-        # Calcular estadísticas
-        total_ventas = len(ventas)
-        total_ingresos = sum(venta.get('total', 0) for venta in ventas)
-        total_iva = sum(venta.get('iva', 0) for venta in ventas)
-        total_subtotal = sum(venta.get('subtotal', 0) for venta in ventas)
+        totales = resultado['totales'][0] if resultado['totales'] else {}
+        total_ventas = totales.get('total_ventas', 0)
+        total_ingresos = totales.get('total_ingresos', 0)
+        total_iva = totales.get('total_iva', 0)
+        total_subtotal = totales.get('total_subtotal', 0)
         
         # Ventas por tipo
-        ventas_online = len([v for v in ventas if v.get('tipo') == 'online'])
-        ventas_presencial = len([v for v in ventas if v.get('tipo') == 'presencial'])
+        por_tipo = {t['_id']: t['ventas'] for t in resultado['por_tipo']}
+        ventas_online = por_tipo.get('online', 0)
+        ventas_presencial = por_tipo.get('presencial', 0)
         
-        # Top productos más vendidos
-        productos_vendidos = {}
-        for venta in ventas:
-            for item in venta.get('items', []):
-                producto_id = item.get('libro_id')
-                if producto_id not in productos_vendidos:
-                    productos_vendidos[producto_id] = {
-                        'titulo': item.get('titulo'),
-                        'cantidad': 0,
-                        'total': 0
-                    }
-                productos_vendidos[producto_id]['cantidad'] += item.get('cantidad', 0)
-                productos_vendidos[producto_id]['total'] += item.get('subtotal', 0)
-        
-        top_productos = sorted(productos_vendidos.values(), key=lambda x: x['cantidad'], reverse=True)[:10]
-        
-        # Ventas por día (para gráfico)
-        ventas_por_dia = {}
-        for venta in ventas:
-            fecha = venta['fecha_venta'].strftime('%Y-%m-%d')
-            if fecha not in ventas_por_dia:
-                ventas_por_dia[fecha] = 0
-            ventas_por_dia[fecha] += venta.get('total', 0)
+        top_productos = resultado['top_productos']
         
-        # Preparar datos para el gráfico
-        fechas = sorted(ventas_por_dia.keys())
-        montos = [ventas_por_dia[fecha] for fecha in fechas]
+        # Datos para el gráfico
+        fechas = [d['_id'] for d in resultado['por_dia']]
+        montos = [d['monto'] for d in resultado['por_dia']]
+        
+        # Tabla de ventas paginada por separado
+        pagina = max(int(request.args.get('pagina', 1)), 1)
+        ventas_por_pagina = 10
+        total_paginas = (total_ventas + ventas_por_pagina - 1) // ventas_por_pagina
+        ventas = list(coleccion_ventas.find(
+            filtro,
+            {'cliente_nombre': 1, 'fecha_venta': 1, 'total': 1, 'tipo': 1, 'items.libro_id': 1}
+        ).sort('fecha_venta', -1).skip((pagina - 1) * ventas_por_pagina).limit(ventas_por_pagina))
         
         return render_template('reportes.html',
                              ventas=ventas,
+                             pagina=pagina,
+                             total_paginas=total_paginas,
                              total_ventas=total_ventas,
                              total_ingresos=total_ingresos,
                              total_iva=total_iva,
@@ -2029,8 +2135,55 @@ def reporte_completo():
         flash(f'Error al generar reporte completo: {str(e)}', 'error')
         return render_template('reporte_completo.html', ventas=[], total_ventas=0, total_ingresos=0)
 
+# ----------------- FÁBRICA DE LA APLICACIÓN -----------------
+
+def create_app(config=None, servicios=True):
+    """Aplicar la configuración y preparar los servicios del proceso.
+
+    config puede ser un dict, la ruta de un archivo de configuración o un
+    objeto con atributos en mayúsculas; después se aplican las variables de
+    entorno LIBRERIA_* (p. ej. LIBRERIA_MONGO_URI). Las rutas están definidas
+    en este módulo, así que no construye una app nueva: configura la `app`
+    del módulo y la devuelve. Es un paso de configuración único por proceso,
+    antes de atender peticiones (ver wsgi.py); llamarla otra vez reconfigura
+    esa misma app. No crea índices ni datos iniciales, eso lo hace
+    inicializar_datos una vez por despliegue.
+
+    Con servicios=False no arranca tareas de fondo (el change stream de
+    pedidos), para usar este módulo como librería desde otro proceso, como
+    app_async.py. Los pools de PDF e imágenes ya se crean sólo al primer uso.
+    """
+    global cache_comprobantes, cache_catalogo, procesador_imagenes, cola_reportes_pdf, escucha_pedidos
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif isinstance(config, str):
+        app.config.from_pyfile(config)
+    elif config is not None:
+        app.config.from_object(config)
+    app.config.from_prefixed_env('LIBRERIA')
+
+    conexion_mongo.configurar(app.config['MONGO_URI'], app.config['MONGO_DB'], **opciones_mongo())
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    cache_comprobantes = CacheComprobantes(app.config['COMPROBANTES_CACHE'],
+                                           app.config['COMPROBANTES_CACHE_MAX_BYTES'])
+    broker_pedidos.latido = app.config['SEGUIMIENTO_LATIDO']
+    registro_metricas.directorio = app.config['METRICAS_DIR']
+    # Los servicios perezosos se crean de nuevo con esta configuración
+    cache_catalogo = procesador_imagenes = cola_reportes_pdf = None
+
+    if servicios and app.config['SEGUIMIENTO_CHANGE_STREAM'] and escucha_pedidos is None:
+        escucha_pedidos = iniciar_escucha(coleccion_pedidos, broker_pedidos, seguimiento.estado_pedido)
+    return app
+
+@app.cli.command('inicializar')
+def inicializar():
+    """Crear índices y el administrador inicial (una vez por despliegue)"""
+    inicializar_datos()
+
 # ----------------- INICIALIZACIÓN -----------------
 
 if __name__ == '__main__':
+    # Servidor de desarrollo; en producción usar gunicorn con wsgi.py
+    create_app()
     inicializar_datos()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
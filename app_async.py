@@ -0,0 +1,251 @@
+# app_async.py
+"""Variante asíncrona (ASGI) de las rutas de lectura de los clientes.
+
+Atiende con Quart y Motor las rutas que sólo leen de MongoDB y que los
+clientes piden muy seguido: catálogo, mis compras, mi seguimiento y el
+sondeo de estados. Mientras una petición espera a MongoDB el worker sigue
+atendiendo otras, y las consultas que no dependen entre sí salen a la vez
+con asyncio.gather.
+
+Usa la misma configuración, plantillas y cookie de sesión que app.py, así
+que un cliente que inició sesión en la app síncrona ya está autenticado
+aquí. Las demás rutas (login, carrito, compras, PDF) siguen en la app
+síncrona; el proxy envía a este servidor sólo las rutas de abajo:
+
+    hypercorn --workers 4 --bind 0.0.0.0:5001 app_async:app
+
+Requiere quart y motor.
+"""
+import asyncio
+import os
+import time
+from functools import wraps
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from quart import Quart, render_template, request, redirect, url_for, session, flash, jsonify, make_response, g
+import app as app_sync
+import cancelaciones
+import catalogo
+import seguimiento
+from catalogo import CacheCatalogo
+
+# Sólo la configuración: este proceso no atiende el canal de eventos ni
+# genera PDF o portadas, así que no arranca los servicios de app.py
+app_sync.create_app(os.environ.get('LIBRERIA_CONFIG'), servicios=False)
+
+app = Quart(__name__, template_folder=app_sync.app.template_folder,
+            static_folder=app_sync.app.static_folder)
+app.config.from_mapping(app_sync.app.config)
+app.secret_key = app_sync.app.secret_key
+app.add_template_global(app_sync.imagen_libro)
+
+motor_client = None
+db = None
+cache_catalogo = None
+
+@app.before_serving
+async def conectar():
+    """Un cliente Motor por worker, creado ya dentro de su event loop"""
+    global motor_client, db, cache_catalogo
+    conexion = app_sync.conexion_mongo
+    motor_client = AsyncIOMotorClient(conexion.uri, **conexion.opciones)
+    db = motor_client[conexion.nombre_db]
+    cache_catalogo = CacheCatalogo(db['versiones'])
+
+@app.after_serving
+async def desconectar():
+    motor_client.close()
+
+def url_de_la_app_sincrona(error, endpoint, values):
+    """Las plantillas enlazan rutas que sólo existen en app.py (carrito, logout...)"""
+    return app_sync.app.url_map.bind('localhost').build(endpoint, values)
+
+app.url_build_error_handlers.append(url_de_la_app_sincrona)
+
+def cliente_required(f):
+    """El de app.py, pero esperando la vista: en Quart flash y las rutas son corrutinas"""
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'cliente_id' not in session:
+            await flash(app_sync.AVISO_LOGIN_CLIENTE, 'error')
+            return redirect(url_for(app_sync.LOGIN_CLIENTE))
+        return await f(*args, **kwargs)
+    return decorated_function
+
+# ----------------- MÉTRICAS -----------------
+# Mismo registro que app.py: con METRICAS_DIR, el /metrics de la app
+# síncrona también expone los procesos de esta app.
+
+@app.before_request
+async def iniciar_metricas():
+    g.inicio_peticion = time.perf_counter()
+    g.token_metricas = app_sync.registro_metricas.iniciar_peticion(request.endpoint or 'desconocido')
+
+@app.after_request
+async def registrar_metricas(respuesta):
+    token = g.pop('token_metricas', None)
+    if token is not None:
+        app_sync.registro_metricas.terminar_peticion(token, request.method, respuesta.status_code,
+                                                     time.perf_counter() - g.inicio_peticion,
+                                                     respuesta.content_length)
+    return respuesta
+
+# ----------------- CATÁLOGO -----------------
+
+async def entrada_catalogo(clave, consulta, orden, limite):
+    """Igual que CacheCatalogo.obtener, pero leyendo con Motor"""
+    estado = await db['versiones'].find_one({'_id': 'catalogo'}) or {}
+    cache_catalogo.sincronizar(estado)
+    entrada = cache_catalogo.buscar(clave)
+    if entrada is None:
+        libros = await db['tipolibro'].aggregate(consulta).to_list(None)
+        entrada = cache_catalogo.guardar(clave, *catalogo.cortar_pagina(libros, orden, limite))
+    return entrada
+
+async def responder_catalogo(plantilla, entrada, variante, **contexto):
+    """Como responder_catalogo de app.py: ETag fuerte, o 304 si no cambió"""
+    if '_flashes' in session:
+        return await render_template(plantilla, libros=entrada['libros'], **contexto)
+    version = catalogo.etag(entrada, *variante)
+    if version in request.if_none_match:
+        respuesta = await make_response('', 304)
+    else:
+        respuesta = await make_response(
+            await render_template(plantilla, libros=entrada['libros'], **contexto))
+    respuesta.set_etag(version)
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+@app.route('/catalogo')
+@cliente_required
+async def catalogo_cliente():
+    try:
+        query = request.args.get('q', '')
+        orden = request.args.get('orden', 'titulo')
+        if orden not in catalogo.ORDENES:
+            orden = 'titulo'
+        limite = app.config['CATALOGO_POR_PAGINA']
+        carrito_id = session.get('carrito_id') or session['cliente_id']
+
+        # La página y el contador del carrito no dependen entre sí
+        entrada, carrito = await asyncio.gather(
+            entrada_catalogo(('catalogo', query, orden),
+                             catalogo.consulta_catalogo(query, orden, limite=limite), orden, limite),
+            db['carritos'].find_one({'_id': carrito_id}, {'lineas': 1})
+        )
+        carrito_count = len((carrito or {}).get('lineas', {}))
+        return await responder_catalogo('catalogo_cliente.html', entrada, (carrito_count,),
+                                        query=query, orden=orden, siguiente=entrada['siguiente'],
+                                        carrito_count=carrito_count)
+    except Exception as e:
+        await flash(f'Error al cargar catálogo: {e}', 'error')
+        return await render_template('catalogo_cliente.html', libros=[], query='', orden='titulo',
+                                     siguiente=None, carrito_count=0)
+
+# ----------------- MIS COMPRAS -----------------
+
+@app.route('/mis-compras')
+@cliente_required
+async def mis_compras():
+    try:
+        cliente_id = session.get('cliente_id', '')
+        # Las cancelaciones guardan cliente_id: se piden junto con las ventas
+        ventas, canceladas = await asyncio.gather(
+            db['ventas'].find({'cliente_id': cliente_id}).sort('fecha_venta', -1).to_list(None),
+            db['cancelaciones'].find(
+                {'cliente_id': cliente_id}, cancelaciones.PROYECCION_CANCELACION).to_list(None)
+        )
+        cancelaciones.marcar_canceladas(ventas, canceladas)
+
+        for venta in ventas:
+            venta['puede_cancelar'] = app_sync.puede_cancelar_venta(venta['fecha_venta'])
+
+        return await render_template('mis_compras.html', ventas=ventas)
+    except Exception as e:
+        await flash(f'Error al cargar compras: {str(e)}', 'error')
+        return await render_template('mis_compras.html', ventas=[])
+
+# ----------------- SEGUIMIENTO -----------------
+
+@app.route('/mi-seguimiento')
+@cliente_required
+async def mi_seguimiento():
+    try:
+        cliente_id = session.get('cliente_id')
+        # Los seguimientos llevan cliente_id: no hace falta esperar a las ventas
+        pedidos, seguimientos = await asyncio.gather(
+            db['ventas'].find({'cliente_id': cliente_id, 'tipo': 'online'})
+                        .sort('fecha_venta', -1).to_list(None),
+            db['pedidos'].find(
+                {'cliente_id': cliente_id},
+                {'venta_id': 1, 'estado': 1, 'ultima_actualizacion': 1, 'comentarios': 1}).to_list(None)
+        )
+        seguimientos = {s['venta_id']: s for s in seguimientos}
+        for pedido in pedidos:
+            seguimiento.aplicar_seguimiento(pedido, seguimientos.get(str(pedido['_id'])))
+
+        return await render_template('mi_seguimiento.html', pedidos=pedidos)
+    except Exception as e:
+        await flash(f'Error al cargar seguimiento: {str(e)}', 'error')
+        return await render_template('mi_seguimiento.html', pedidos=[])
+
+@app.route('/api/seguimiento/<venta_id>')
+@cliente_required
+async def api_seguimiento(venta_id):
+    try:
+        # La venta (que confirma que el pedido es del cliente) y su
+        # seguimiento se piden a la vez
+        venta, pedido = await asyncio.gather(
+            db['ventas'].find_one({'_id': ObjectId(venta_id), 'cliente_id': session.get('cliente_id')},
+                                  {'fecha_venta': 1}),
+            db['pedidos'].find_one({'venta_id': venta_id})
+        )
+        if not venta:
+            return jsonify({'error': 'Pedido no encontrado'}), 404
+        if not pedido:
+            return jsonify(seguimiento.estado_sin_seguimiento(venta))
+        return jsonify(seguimiento.estado_pedido(pedido))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/seguimiento')
+@cliente_required
+async def api_seguimiento_lote():
+    """Estados de varios pedidos en una respuesta: ?ids=a,b,c o todos los del cliente"""
+    try:
+        ids = request.args.get('ids')
+        venta_ids = [i for i in ids.split(',') if i] if ids else None
+        cliente_id = session.get('cliente_id')
+
+        # Si nada cambió desde el último sondeo, responder 304 sin leer los pedidos
+        resultado = await db['pedidos'].aggregate(
+            seguimiento.consulta_version(cliente_id, venta_ids)).to_list(None)
+        version = seguimiento.huella_version(resultado, venta_ids)
+        if request.if_none_match.contains_weak(version):
+            respuesta = await make_response('', 304)
+            respuesta.set_etag(version, weak=True)
+            return respuesta
+
+        consultas = [db['pedidos'].find(
+            seguimiento.filtro_cliente(cliente_id, venta_ids),
+            {'venta_id': 1, 'estado': 1, 'ultima_actualizacion': 1, 'comentarios': 1}).to_list(None)]
+        object_ids = [ObjectId(i) for i in venta_ids or [] if ObjectId.is_valid(i)]
+        if object_ids:
+            # Ventas pedidas que quizá aún no tienen seguimiento, en paralelo
+            consultas.append(db['ventas'].find(
+                {'_id': {'$in': object_ids}, 'cliente_id': cliente_id}, {'fecha_venta': 1}).to_list(None))
+        pedidos, *ventas = await asyncio.gather(*consultas)
+
+        estados = [seguimiento.estado_pedido(pedido) for pedido in pedidos]
+        encontrados = {estado['venta_id'] for estado in estados}
+        estados += [seguimiento.estado_sin_seguimiento(venta) for venta in (ventas[0] if ventas else [])
+                    if str(venta['_id']) not in encontrados]
+
+        respuesta = jsonify({'pedidos': estados})
+        respuesta.set_etag(version, weak=True)
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+        return respuesta
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
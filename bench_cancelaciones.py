@@ -0,0 +1,113 @@
+# bench_cancelaciones.py
+"""Latencia de cancelación para órdenes de 1, 10 y 50 líneas.
+
+Compara la cancelación anterior (find_one + $set por libro, insert_one y
+update_one por separado) contra cancelaciones.cancelar_venta. Usa una base
+de datos temporal 'libros_bench' en el servidor de MONGO_URI y la borra al
+terminar:
+
+    python bench_cancelaciones.py [repeticiones]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+from indices import asegurar_indices
+from cancelaciones import cancelar_venta
+
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+NOMBRE_DB = 'libros_bench'
+
+def crear_venta(db, lineas):
+    """Insertar libros y una venta con el número de líneas indicado"""
+    libros = [{'_id': ObjectId(), 'nombre': f'Libro {i}', 'precio': 199.0, 'stock': 100}
+              for i in range(lineas)]
+    db['tipolibro'].insert_many(libros)
+    items = [{
+        'libro_id': str(libro['_id']),
+        'titulo': libro['nombre'],
+        'cantidad': 2,
+        'precio_unitario': 199.0,
+        'subtotal': 398.0
+    } for libro in libros]
+    subtotal = sum(item['subtotal'] for item in items)
+    venta = {
+        '_id': ObjectId(),
+        'cliente_id': str(ObjectId()),
+        'cliente_nombre': 'Cliente de prueba',
+        'items': items,
+        'subtotal': subtotal,
+        'iva': subtotal * 0.16,
+        'total': subtotal * 1.16,
+        'fecha_venta': datetime.now(),
+        'estado': 'completada',
+        'tipo': 'presencial'
+    }
+    db['ventas'].insert_one(venta)
+    return venta
+
+def cancelacion_legada(db, venta, razon, cancelado_por, cancelado_por_nombre):
+    """Cancelación anterior (2N+2 viajes a la base), para comparar"""
+    id = str(venta['_id'])
+    cancelacion = {
+        'venta_id': id,
+        'cliente_id': venta['cliente_id'],
+        'cliente_nombre': venta.get('cliente_nombre', ''),
+        'total_venta': venta['total'],
+        'razon': razon,
+        'cancelado_por': cancelado_por,
+        'cancelado_por_nombre': cancelado_por_nombre,
+        'fecha_cancelacion': datetime.now(),
+        'fecha_venta_original': venta['fecha_venta']
+    }
+
+    # Devolver stock de libros
+    for item in venta.get('items', []):
+        libro_id = item['libro_id']
+        cantidad = item['cantidad']
+
+        libro = db['tipolibro'].find_one({'_id': ObjectId(libro_id)})
+        if libro:
+            nuevo_stock = libro.get('stock', 0) + cantidad
+            db['tipolibro'].update_one(
+                {'_id': ObjectId(libro_id)},
+                {'$set': {'stock': nuevo_stock}}
+            )
+
+    # Guardar cancelación
+    db['cancelaciones'].insert_one(cancelacion)
+
+    # Marcar venta como cancelada
+    db['ventas'].update_one(
+        {'_id': ObjectId(id)},
+        {'$set': {'estado': 'cancelada'}}
+    )
+    return True
+
+def medir(db, nombre, funcion, lineas, repeticiones):
+    ventas = [crear_venta(db, lineas) for _ in range(repeticiones)]
+    tiempos = []
+    for venta in ventas:
+        inicio = time.perf_counter()
+        funcion(db, venta, 'bench', 'bench', 'bench')
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    mediana = tiempos[len(tiempos) // 2]
+    p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+    print(f"{lineas:>3} líneas  {nombre:<8} mediana {mediana:7.2f} ms   p95 {p95:7.2f} ms")
+
+if __name__ == '__main__':
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    client = MongoClient(MONGO_URI)
+    client.drop_database(NOMBRE_DB)
+    db = client[NOMBRE_DB]
+    try:
+        asegurar_indices(db)
+        for lineas in (1, 10, 50):
+            medir(db, 'antes', cancelacion_legada, lineas, repeticiones)
+            medir(db, 'después', cancelar_venta, lineas, repeticiones)
+    finally:
+        client.drop_database(NOMBRE_DB)
+        client.close()
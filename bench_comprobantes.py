@@ -0,0 +1,178 @@
+# bench_comprobantes.py
+"""Micro-benchmark del renderizador de comprobantes.
+
+Compara el dibujo anterior de la ruta de mostrador contra el renderizador
+compartido de comprobantes.py, los dos con las mismas opciones del canvas,
+con y sin compresión de páginas. No necesita MongoDB:
+
+    python bench_comprobantes.py [numero_de_comprobantes]
+"""
+import io
+import sys
+import time
+from datetime import datetime
+from bson.objectid import ObjectId
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+import comprobantes
+from comprobantes import generar_comprobante
+
+def venta_de_ejemplo(lineas=5):
+    items = [{
+        'libro_id': str(ObjectId()),
+        'titulo': f'Libro de ejemplo número {i}',
+        'cantidad': 1 + i % 3,
+        'precio_unitario': 199.0,
+        'subtotal': 199.0 * (1 + i % 3)
+    } for i in range(lineas)]
+    subtotal = sum(item['subtotal'] for item in items)
+    return {
+        '_id': ObjectId(),
+        'cliente_nombre': 'Cliente de prueba',
+        'cliente_email': 'cliente@ejemplo.com',
+        'cliente_telefono': '555-0100',
+        'usuario_nombre': 'Cajero',
+        'items': items,
+        'subtotal': subtotal,
+        'iva': subtotal * 0.16,
+        'total': subtotal * 1.16,
+        'fecha_venta': datetime.now(),
+        'estado': 'completada',
+        'tipo': 'presencial'
+    }
+
+def comprobante_legado(venta):
+    """Renderizador anterior (dibujo completo con drawString), para comparar"""
+    # Crear PDF
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=comprobantes.COMPRESION)
+    width, height = A4
+    
+    # Configuración inicial
+    pdf.setTitle(f"Comprobante de Venta - {venta['_id']}")
+    
+    # Encabezado
+    pdf.setFont("Helvetica-Bold", 18)
+    pdf.drawString(100, height - 50, "BIBLIOTECA DIGITAL")
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(100, height - 70, "COMPROBANTE DE VENTA")
+    pdf.line(100, height - 75, 500, height - 75)
+    
+    # Información de la venta
+    y_position = height - 100
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(100, y_position, "INFORMACIÓN DE LA VENTA:")
+    pdf.setFont("Helvetica", 10)
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Folio: {str(venta['_id'])}")
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Fecha: {venta['fecha_venta'].strftime('%d/%m/%Y')}")
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Hora: {venta['fecha_venta'].strftime('%H:%M:%S')}")
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Estado: {venta.get('estado', 'Completada')}")
+    
+    # Información del cliente
+    y_position -= 25
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(100, y_position, "INFORMACIÓN DEL CLIENTE:")
+    pdf.setFont("Helvetica", 10)
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Nombre: {venta.get('cliente_nombre', 'N/A')}")
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Email: {venta.get('cliente_email', 'N/A')}")
+    if venta.get('cliente_telefono'):
+        y_position -= 15
+        pdf.drawString(100, y_position, f"Teléfono: {venta['cliente_telefono']}")
+    
+    # Información del vendedor
+    y_position -= 25
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(100, y_position, "INFORMACIÓN DEL VENDEDOR:")
+    pdf.setFont("Helvetica", 10)
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Atendió: {venta.get('usuario_nombre', 'N/A')}")
+    
+    # Tabla de productos
+    y_position -= 30
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(100, y_position, "DETALLE DE PRODUCTOS:")
+    
+    # Encabezados de la tabla
+    y_position -= 20
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.drawString(100, y_position, "Producto")
+    pdf.drawString(300, y_position, "Cant.")
+    pdf.drawString(350, y_position, "Precio Unit.")
+    pdf.drawString(450, y_position, "Subtotal")
+    
+    y_position -= 10
+    pdf.line(100, y_position, 500, y_position)
+    y_position -= 10
+    
+    # Items de la venta
+    pdf.setFont("Helvetica", 9)
+    for item in venta.get('items', []):
+        if y_position < 150:  # Nueva página si es necesario
+            pdf.showPage()
+            y_position = height - 50
+            pdf.setFont("Helvetica", 9)
+        
+        # Título del libro
+        titulo = item['titulo']
+        if len(titulo) > 40:
+            titulo = titulo[:37] + "..."
+        
+        pdf.drawString(100, y_position, titulo)
+        pdf.drawString(300, y_position, str(item['cantidad']))
+        pdf.drawString(350, y_position, f"${item['precio_unitario']:.2f}")
+        pdf.drawString(450, y_position, f"${item['subtotal']:.2f}")
+        
+        y_position -= 20
+    
+    # Línea separadora
+    y_position -= 10
+    pdf.line(100, y_position, 500, y_position)
+    
+    # Totales
+    subtotal = venta.get('subtotal', 0)
+    iva = venta.get('iva', 0)
+    total = venta.get('total', 0)
+    
+    y_position -= 20
+    pdf.setFont("Helvetica", 10)
+    pdf.drawString(350, y_position, f"Subtotal: ${subtotal:.2f}")
+    y_position -= 15
+    pdf.drawString(350, y_position, f"IVA (16%): ${iva:.2f}")
+    y_position -= 15
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(350, y_position, f"TOTAL: ${total:.2f}")
+    
+    # Pie de página con agradecimiento
+    y_position -= 40
+    pdf.setFont("Helvetica-Oblique", 10)
+    pdf.drawString(100, y_position, "¡Gracias por su compra en Biblioteca Digital!")
+    y_position -= 15
+    pdf.drawString(100, y_position, "Esperamos volver a servirle pronto.")
+    
+    pdf.save()
+    return buffer.getvalue()
+
+def medir(nombre, funcion, ventas):
+    inicio = time.perf_counter()
+    tamano = sum(len(funcion(venta)) for venta in ventas)
+    segundos = time.perf_counter() - inicio
+    print(f"{nombre:<24} {len(ventas) / segundos:8.1f} comprobantes/s "
+          f"{tamano / len(ventas) / 1024:6.1f} KB/comprobante")
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    ventas = [venta_de_ejemplo() for _ in range(n)]
+    for compresion in (1, 0):
+        comprobantes.COMPRESION = compresion
+        etiqueta = 'comprimido' if compresion else 'sin comprimir'
+        # Calentamiento
+        comprobante_legado(ventas[0])
+        generar_comprobante(ventas[0])
+        medir(f'antes, {etiqueta}', comprobante_legado, ventas)
+        medir(f'después, {etiqueta}', generar_comprobante, ventas)
@@ -0,0 +1,99 @@
+# bench_servidor.py
+"""Comparación de rendimiento: servidor de desarrollo contra gunicorn.
+
+Lanza peticiones concurrentes contra un servidor ya levantado y mide
+peticiones por segundo y latencias por ruta. Para comparar, correr el mismo
+comando contra cada servidor, con la misma base de datos:
+
+    python app.py                                        # desarrollo, puerto 5000
+    LIBRERIA_BIND=0.0.0.0:8000 gunicorn -c gunicorn.conf.py
+
+    python bench_servidor.py http://localhost:5000 --email c@c.com --password x
+    python bench_servidor.py http://localhost:8000 --email c@c.com --password x
+
+Las rutas por defecto cubren las dos cargas típicas: catálogo (consultas
+cortas a MongoDB) y comprobantes PDF (CPU). --venta indica la venta del
+cliente cuyo comprobante se descarga.
+
+El repositorio no guarda resultados: dependen del hardware y del despliegue
+de MongoDB, así que la comparación se corre en cada entorno antes de elegir
+el perfil de gunicorn.conf.py.
+"""
+import argparse
+import http.cookiejar
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+def crear_opener(base, email, password):
+    """Opener con la sesión del cliente, si se dieron credenciales"""
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    if email:
+        datos = urllib.parse.urlencode({'email': email, 'password': password}).encode()
+        opener.open(f"{base}/login-cliente", datos).read()
+    return opener
+
+def medir_ruta(opener, url, concurrencia, duracion):
+    """Pedir url desde varios hilos durante duracion segundos"""
+    latencias = []
+    errores = [0]
+    lock = threading.Lock()
+    fin = time.perf_counter() + duracion
+
+    def trabajador():
+        while time.perf_counter() < fin:
+            inicio = time.perf_counter()
+            try:
+                with opener.open(url, timeout=30) as respuesta:
+                    respuesta.read()
+                ok = True
+            except (urllib.error.URLError, OSError):
+                ok = False
+            transcurrido = time.perf_counter() - inicio
+            with lock:
+                if ok:
+                    latencias.append(transcurrido)
+                else:
+                    errores[0] += 1
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return latencias, errores[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('base', help='URL del servidor, p. ej. http://localhost:5000')
+    parser.add_argument('--email', help='Cliente con el que iniciar sesión')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--venta', help='Venta del cliente para medir su comprobante PDF')
+    parser.add_argument('--rutas', nargs='*', help='Rutas a medir (en lugar de las de por defecto)')
+    parser.add_argument('--concurrencia', type=int, default=16)
+    parser.add_argument('--duracion', type=float, default=10)
+    args = parser.parse_args()
+
+    rutas = args.rutas or ['/salud/vivo', '/catalogo', '/api/catalogo?orden=precio']
+    if args.venta and not args.rutas:
+        rutas.append(f'/mi-compra/{args.venta}/comprobante')
+
+    opener = crear_opener(args.base, args.email, args.password)
+    print(f"{args.base}  concurrencia={args.concurrencia}  duración={args.duracion}s")
+    print(f"{'ruta':45} {'peticiones':>10} {'errores':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for ruta in rutas:
+        latencias, errores = medir_ruta(opener, args.base + ruta, args.concurrencia, args.duracion)
+        if len(latencias) >= 2:
+            cortes = statistics.quantiles(latencias, n=20)
+            p50, p95 = statistics.median(latencias) * 1000, cortes[18] * 1000
+        else:
+            p50 = p95 = float('nan')
+        print(f"{ruta[:45]:45} {len(latencias):>10} {errores:>8} "
+              f"{len(latencias) / args.duracion:>8.1f} {p50:>8.1f} {p95:>8.1f}")
+
+if __name__ == '__main__':
+    main()
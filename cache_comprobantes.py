@@ -0,0 +1,95 @@
+# cache_comprobantes.py
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# Campos de la venta que aparecen en el comprobante; si cambia alguno, cambia la versión
+CAMPOS_COMPROBANTE = ('estado', 'items', 'subtotal', 'iva', 'total', 'fecha_venta',
+                      'cliente_nombre', 'cliente_email', 'cliente_telefono', 'usuario_nombre')
+
+class CacheComprobantes:
+    """Cache en disco de comprobantes PDF, direccionada por contenido.
+
+    Cada archivo se nombra <venta_id>_<variante>_<version>.pdf, donde la versión
+    es un hash de los campos que muestra el comprobante. El tamaño total está
+    acotado y se expulsan primero los archivos usados hace más tiempo (LRU).
+    """
+
+    def __init__(self, directorio, max_bytes=64 * 1024 * 1024):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+    def version(self, venta, variante):
+        """Hash estable de lo que muestra el comprobante de una venta"""
+        datos = {campo: venta.get(campo) for campo in CAMPOS_COMPROBANTE}
+        datos['_id'] = str(venta['_id'])
+        datos['variante'] = variante
+        serializado = json.dumps(datos, sort_keys=True, default=str)
+        return hashlib.sha256(serializado.encode()).hexdigest()[:32]
+
+    def ruta(self, venta_id, variante, version):
+        return os.path.join(self.directorio, f"{venta_id}_{variante}_{version}.pdf")
+
+    def obtener(self, venta_id, variante, version):
+        """Ruta del comprobante en cache o None; un acierto lo marca como usado"""
+        ruta = self.ruta(venta_id, variante, version)
+        try:
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        return ruta
+
+    def guardar(self, venta_id, variante, version, contenido):
+        """Escribir un comprobante de forma atómica y aplicar el límite de tamaño"""
+        ruta = self.ruta(venta_id, variante, version)
+        fd, temporal = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+        self._expulsar()
+        return ruta
+
+    def obtener_o_generar(self, venta, variante, generar):
+        """Devolver (ruta, version), generando el PDF con generar(venta) si falta"""
+        venta_id = str(venta['_id'])
+        version = self.version(venta, variante)
+        ruta = self.obtener(venta_id, variante, version)
+        if ruta is None:
+            ruta = self.guardar(venta_id, variante, version, generar(venta))
+        return ruta, version
+
+    def invalidar(self, venta_id):
+        """Eliminar todos los comprobantes en cache de una venta"""
+        prefijo = f"{venta_id}_"
+        for nombre in os.listdir(self.directorio):
+            if nombre.startswith(prefijo):
+                try:
+                    os.remove(os.path.join(self.directorio, nombre))
+                except FileNotFoundError:
+                    pass
+
+    def _expulsar(self):
+        """Borrar los archivos menos usados hasta quedar bajo max_bytes"""
+        with self._lock:
+            archivos = []
+            total = 0
+            for entrada in os.scandir(self.directorio):
+                if entrada.is_file() and entrada.name.endswith('.pdf'):
+                    info = entrada.stat()
+                    archivos.append((info.st_mtime, info.st_size, entrada.path))
+                    total += info.st_size
+            if total <= self.max_bytes:
+                return
+            archivos.sort()
+            for _, tamano, ruta in archivos:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(ruta)
+                    total -= tamano
+                except FileNotFoundError:
+                    pass
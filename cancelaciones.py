@@ -0,0 +1,129 @@
+# cancelaciones.py
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from inventario import devolver_inventario, stock_actual
+import catalogo
+import resumen_ventas
+
+# Tiempo que una cancelación en curso queda reservada para quien la empezó;
+# pasado el plazo, un reintento puede retomar los pasos que falten
+PLAZO_REINTENTO = timedelta(minutes=1)
+
+# Campos de la cancelación que se muestran junto a la venta
+PROYECCION_CANCELACION = {'venta_id': 1, 'razon': 1, 'fecha_cancelacion': 1}
+
+def marcar_canceladas(ventas, cancelaciones):
+    """Anotar en cada venta si está cancelada, con la razón y la fecha.
+
+    cancelaciones son los documentos (con PROYECCION_CANCELACION) de esas
+    ventas, leídos en una sola consulta con pymongo o con Motor.
+    """
+    por_venta = {c['venta_id']: c for c in cancelaciones}
+    for venta in ventas:
+        cancelacion = por_venta.get(str(venta['_id']))
+        venta['cancelada'] = cancelacion is not None
+        if cancelacion:
+            venta['razon_cancelacion'] = cancelacion.get('razon', '')
+            venta['fecha_cancelacion'] = cancelacion.get('fecha_cancelacion', '')
+    return ventas
+
+def cancelar_venta(db, venta, razon, cancelado_por, cancelado_por_nombre, cliente_nombre=None):
+    """Cancelar una venta: registrar la cancelación, devolver stock y marcarla.
+
+    Compartido por la cancelación del administrador y la del cliente. La
+    guardia contra la doble cancelación está en la propia venta: sólo una
+    cancelación puede quedar registrada en su campo cancelacion_id (ver
+    _reclamar_venta), haya o no índice único en cancelaciones.venta_id.
+
+    Cada paso (stock_devuelto, estado_actualizado, resumen_revertido) se
+    marca en la cancelación al terminar. Si una solicitud falla a mitad de
+    camino, un reintento posterior a PLAZO_REINTENTO retoma sólo los pasos
+    pendientes. La devolución de stock y la reversión del resumen llevan
+    además su marca en el mismo documento que modifican, así que repetirlas
+    (caída entre el cambio y la marca del paso, o una solicitud lenta que
+    sigue corriendo cuando otra la retoma) no suma dos veces. Devuelve False
+    si la venta ya estaba cancelada (o si otra solicitud la está cancelando
+    en este momento).
+    """
+    venta_id = str(venta['_id'])
+    ahora = datetime.now()
+    cancelacion = {
+        'venta_id': venta_id,
+        'cliente_id': venta['cliente_id'],
+        'cliente_nombre': cliente_nombre if cliente_nombre is not None else venta.get('cliente_nombre', ''),
+        'total_venta': venta['total'],
+        'razon': razon,
+        'cancelado_por': cancelado_por,
+        'cancelado_por_nombre': cancelado_por_nombre,
+        'fecha_cancelacion': ahora,
+        'fecha_venta_original': venta['fecha_venta'],
+        'completada': False,
+        'reservada_hasta': ahora + PLAZO_REINTENTO
+    }
+    try:
+        db['cancelaciones'].insert_one(cancelacion)
+    except DuplicateKeyError:
+        # Ya existe: retomarla sólo si quedó a medias y nadie la está procesando
+        cancelacion = db['cancelaciones'].find_one_and_update(
+            {'venta_id': venta_id, 'completada': False, 'reservada_hasta': {'$lt': ahora}},
+            {'$set': {'reservada_hasta': ahora + PLAZO_REINTENTO}},
+            return_document=ReturnDocument.AFTER
+        )
+        if cancelacion is None:
+            return False
+
+    if not _reclamar_venta(db, venta, cancelacion['_id']):
+        # Otra cancelación ya es dueña de la venta: descartar este registro
+        db['cancelaciones'].delete_one({'_id': cancelacion['_id']})
+        return False
+
+    _completar_pasos(db, venta, cancelacion)
+    return True
+
+def _reclamar_venta(db, venta, cancelacion_id):
+    """Registrar la cancelación en la venta si no tiene otra (o ya es ésta)"""
+    resultado = db['ventas'].update_one(
+        {'_id': venta['_id'], '$or': [
+            {'cancelacion_id': cancelacion_id},
+            {'cancelacion_id': {'$exists': False}, 'estado': {'$ne': 'cancelada'}},
+        ]},
+        {'$set': {'cancelacion_id': cancelacion_id}}
+    )
+    return resultado.matched_count == 1
+
+def _completar_pasos(db, venta, cancelacion):
+    """Aplicar los pasos de la cancelación que aún no estén marcados"""
+    def marcar(paso):
+        db['cancelaciones'].update_one({'_id': cancelacion['_id']}, {'$set': {paso: True}})
+
+    if not cancelacion.get('stock_devuelto'):
+        # Devolver stock de todos los libros en un solo bulk_write
+        lineas = [(item['libro_id'], item['cantidad']) for item in venta.get('items', [])]
+        devolver_inventario(db['tipolibro'], lineas, marca=str(venta['_id']))
+        marcar('stock_devuelto')
+        catalogo.registrar_stock(db['versiones'], stock_actual(db['tipolibro'], lineas))
+
+    if not cancelacion.get('estado_actualizado'):
+        db['ventas'].update_one({'_id': venta['_id']}, {'$set': {'estado': 'cancelada'}})
+        marcar('estado_actualizado')
+
+    if not cancelacion.get('resumen_revertido'):
+        resumen_ventas.revertir_venta(db['ventas_diarias'], venta)
+        marcar('resumen_revertido')
+
+    db['cancelaciones'].update_one({'_id': cancelacion['_id']},
+                                   {'$set': {'completada': True}, '$unset': {'reservada_hasta': ''}})
+
+def completar_pendientes(db):
+    """Retomar las cancelaciones que quedaron a medias (fuera del plazo de reserva).
+
+    Devuelve el número de cancelaciones completadas.
+    """
+    completadas = 0
+    for cancelacion in db['cancelaciones'].find({'completada': False}, {'venta_id': 1}):
+        venta = db['ventas'].find_one({'_id': ObjectId(cancelacion['venta_id'])})
+        if venta and cancelar_venta(db, venta, None, None, None):
+            completadas += 1
+    return completadas
@@ -0,0 +1,137 @@
+# carritos.py
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Carrito de compras del lado del servidor (colección carritos), un documento
+# por cliente. En la sesión sólo queda el id del carrito.
+# {_id: cliente_id, actualizado,
+#  lineas: {libro_id: {titulo, autor, precio, cantidad, imagen_url, imagenes}}}
+#
+# Las líneas se indexan por libro_id, así que agregar, cambiar o quitar un
+# libro es un solo $inc/$set/$unset sobre esa línea. El índice TTL sobre
+# 'actualizado' borra los carritos abandonados.
+
+# Campos del libro que necesita el carrito para revalidar precio y stock
+PROYECCION_LIBRO = {'nombre': 1, 'autor': 1, 'precio': 1, 'stock': 1, 'imagen_url': 1, 'imagenes': 1}
+
+def _lineas(documento):
+    """Convertir el documento del carrito a la lista que usan las vistas"""
+    carrito = []
+    for libro_id, linea in (documento or {}).get('lineas', {}).items():
+        item = dict(linea, libro_id=libro_id)
+        item['subtotal'] = item['precio'] * item['cantidad']
+        carrito.append(item)
+    return carrito
+
+def obtener(coleccion, carrito_id):
+    """Lista de líneas del carrito (vacía si no existe)"""
+    return _lineas(coleccion.find_one({'_id': carrito_id}))
+
+def contar(coleccion, carrito_id):
+    """Número de libros distintos en el carrito"""
+    documento = coleccion.find_one({'_id': carrito_id}, {'lineas': 1})
+    return len((documento or {}).get('lineas', {}))
+
+def cotizar(coleccion_libros, carrito, campos=()):
+    """Revalidar las líneas contra los libros actuales con una sola consulta $in.
+
+    Actualiza título, autor, precio y subtotal de cada línea con los datos
+    vigentes y marca 'disponible'. Devuelve (carrito, libros, faltantes):
+    libros indexados por id y la lista de todos los problemas de stock, no
+    sólo el primero. Las líneas de libros que ya no existen cuentan con
+    subtotal 0. campos agrega otros campos del libro a la proyección.
+    """
+    proyeccion = dict(PROYECCION_LIBRO, **{campo: 1 for campo in campos})
+    ids = [ObjectId(item['libro_id']) for item in carrito if ObjectId.is_valid(item['libro_id'])]
+    libros = {str(libro['_id']): libro for libro in coleccion_libros.find(
+        {'_id': {'$in': ids}}, proyeccion)}
+
+    faltantes = []
+    for item in carrito:
+        libro = libros.get(item['libro_id'])
+        if not libro:
+            item.update(subtotal=0, disponible=False)
+            faltantes.append(f"{item['titulo']} ya no está disponible")
+            continue
+        item.update(
+            titulo=libro['nombre'],
+            autor=libro.get('autor', ''),
+            precio=libro['precio'],
+            imagen_url=libro.get('imagen_url', ''),
+            imagenes=libro.get('imagenes'),
+            subtotal=libro['precio'] * item['cantidad'],
+            disponible=libro.get('stock', 0) >= item['cantidad']
+        )
+        if not item['disponible']:
+            faltantes.append(
+                f"Stock insuficiente para {libro['nombre']} "
+                f"(pedidos: {item['cantidad']}, disponibles: {libro.get('stock', 0)})")
+    return carrito, libros, faltantes
+
+def agregar(coleccion, carrito_id, libro, cantidad):
+    """Sumar cantidad de un libro al carrito sin pasar del stock disponible.
+
+    Es una sola actualización: el filtro exige que la cantidad ya en el
+    carrito más la nueva no supere el stock. Si no se cumple, el upsert choca
+    con el _id existente y se devuelve None. En otro caso devuelve el número
+    de libros distintos en el carrito.
+
+    El mismo choque ocurre cuando dos peticiones crean a la vez el carrito:
+    la que pierde reintenta una vez, ya contra el carrito existente, y sólo
+    si vuelve a chocar es por falta de stock.
+    """
+    for _ in range(2):
+        try:
+            return _sumar_linea(coleccion, carrito_id, libro, cantidad)
+        except DuplicateKeyError:
+            pass
+    return None
+
+def _sumar_linea(coleccion, carrito_id, libro, cantidad):
+    libro_id = str(libro['_id'])
+    campo = f'lineas.{libro_id}'
+    documento = coleccion.find_one_and_update(
+        {'_id': carrito_id,
+         f'{campo}.cantidad': {'$not': {'$gt': libro.get('stock', 0) - cantidad}}},
+        {'$inc': {f'{campo}.cantidad': cantidad},
+         '$set': {
+             f'{campo}.titulo': libro['nombre'],
+             f'{campo}.autor': libro.get('autor', ''),
+             f'{campo}.precio': libro['precio'],
+             f'{campo}.imagen_url': libro.get('imagen_url', ''),
+             f'{campo}.imagenes': libro.get('imagenes'),
+             'actualizado': datetime.now()
+         }},
+        projection={'lineas': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return len(documento.get('lineas', {}))
+
+def actualizar(coleccion, carrito_id, libro, cantidad):
+    """Fijar la cantidad de una línea y devolver el carrito resultante"""
+    campo = f"lineas.{libro['_id']}"
+    documento = coleccion.find_one_and_update(
+        {'_id': carrito_id, campo: {'$exists': True}},
+        {'$set': {
+            f'{campo}.cantidad': cantidad,
+            f'{campo}.precio': libro['precio'],
+            'actualizado': datetime.now()
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    return _lineas(documento) if documento else obtener(coleccion, carrito_id)
+
+def eliminar(coleccion, carrito_id, libro_id):
+    # libro_id llega de la URL y forma parte de la ruta del campo
+    if not ObjectId.is_valid(libro_id):
+        return
+    coleccion.update_one(
+        {'_id': carrito_id},
+        {'$unset': {f'lineas.{libro_id}': ''}, '$set': {'actualizado': datetime.now()}}
+    )
+
+def vaciar(coleccion, carrito_id):
+    coleccion.delete_one({'_id': carrito_id})
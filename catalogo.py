@@ -0,0 +1,218 @@
+# catalogo.py
+import base64
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+# Cache versionada de las consultas del catálogo (/catalogo y /libros).
+#
+# El documento {_id: 'catalogo'} de la colección versiones lleva:
+#   version        se incrementa con cada alta, edición o baja de un libro
+#                  y cuando un libro se agota o vuelve a tener stock
+#   serie_stock    se incrementa con cada cambio de stock que no cambia qué
+#                  libros aparecen en el catálogo
+#   cambios_stock  ids de libros de los últimos cambios de stock, uno por
+#                  serie (el último elemento corresponde a serie_stock)
+#
+# Cada proceso guarda en memoria las consultas ya hechas por (tipo, búsqueda,
+# página). Un cambio de version vacía la cache; un cambio de stock sólo
+# descarta las entradas que contienen alguno de los libros afectados.
+
+MAX_CAMBIOS_STOCK = 200
+
+def _incrementar(coleccion_versiones, actualizacion):
+    return coleccion_versiones.find_one_and_update(
+        {'_id': 'catalogo'}, actualizacion, upsert=True,
+        return_document=ReturnDocument.AFTER)
+
+def registrar_cambio(coleccion_versiones):
+    """Marcar el catálogo como modificado (alta, edición o baja de un libro)"""
+    _incrementar(coleccion_versiones, {'$inc': {'version': 1}})
+
+def registrar_stock(coleccion_versiones, cambios):
+    """Registrar cambios de stock: cambios es una lista de (libro_id, stock_nuevo, delta).
+
+    Si algún libro se agota o vuelve a tener stock cambia qué libros muestra
+    el catálogo, y se trata como un cambio completo. Si no, sólo se anotan
+    los libros afectados.
+    """
+    if not cambios:
+        return
+    if any(stock <= 0 or stock - delta <= 0 for _, stock, delta in cambios):
+        registrar_cambio(coleccion_versiones)
+        return
+    _incrementar(coleccion_versiones, {
+        '$inc': {'serie_stock': 1},
+        '$push': {'cambios_stock': {
+            '$each': [[str(libro_id) for libro_id, _, _ in cambios]],
+            '$slice': -MAX_CAMBIOS_STOCK
+        }}
+    })
+
+class CacheCatalogo:
+    """Consultas del catálogo en memoria, invalidadas por el documento de versiones"""
+
+    def __init__(self, coleccion_versiones, max_entradas=256):
+        self.coleccion_versiones = coleccion_versiones
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._version = None
+        self._serie_stock = 0
+        self._lock = threading.Lock()
+
+    def sincronizar(self, estado=None):
+        """Leer el documento de versiones y descartar lo que haya cambiado.
+
+        estado es el documento ya leído (la app asíncrona lo lee con Motor).
+        """
+        if estado is None:
+            estado = self.coleccion_versiones.find_one({'_id': 'catalogo'}) or {}
+        version = estado.get('version', 0)
+        serie_stock = estado.get('serie_stock', 0)
+        with self._lock:
+            if version != self._version:
+                self._entradas.clear()
+            elif serie_stock > self._serie_stock:
+                nuevos = serie_stock - self._serie_stock
+                cambios = estado.get('cambios_stock', [])
+                if nuevos > len(cambios):
+                    # Pasaron más cambios de los que guarda el registro
+                    self._entradas.clear()
+                else:
+                    afectados = {libro_id for cambio in cambios[-nuevos:] for libro_id in cambio}
+                    for clave in [clave for clave, entrada in self._entradas.items()
+                                  if entrada['ids'] & afectados]:
+                        del self._entradas[clave]
+            self._version = version
+            self._serie_stock = serie_stock
+
+    def obtener(self, clave, cargar):
+        """Devolver la entrada de una consulta, cargándola con cargar() si falta.
+
+        cargar devuelve (libros, siguiente), con siguiente el cursor de la
+        página que sigue o None. La entrada es {'libros', 'siguiente', 'ids',
+        'huella'}; la huella es un hash del contenido y sirve para armar el
+        ETag de la respuesta.
+        """
+        self.sincronizar()
+        entrada = self.buscar(clave)
+        if entrada is None:
+            entrada = self.guardar(clave, *cargar())
+        return entrada
+
+    def buscar(self, clave):
+        """Entrada ya cargada de una consulta, o None"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+            return entrada
+
+    def guardar(self, clave, libros, siguiente):
+        serializado = json.dumps([libros, siguiente], sort_keys=True, default=str)
+        entrada = {
+            'libros': libros,
+            'siguiente': siguiente,
+            'ids': {str(libro['_id']) for libro in libros},
+            'huella': hashlib.sha256(serializado.encode()).hexdigest()
+        }
+        with self._lock:
+            self._entradas[clave] = entrada
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return entrada
+
+def etag(entrada, *variante):
+    """ETag fuerte de una página: contenido de la consulta más lo propio del usuario"""
+    datos = json.dumps([entrada['huella'], variante], default=str)
+    return hashlib.sha256(datos.encode()).hexdigest()[:32]
+
+# Páginas del catálogo de clientes. Orden de las páginas: campo de orden (None para ordenar sólo por _id) y dirección
+ORDENES = {
+    'titulo': ('nombre', 1),
+    'precio': ('precio', 1),
+    'recientes': (None, -1),  # El _id lleva la fecha de alta
+}
+
+# Campos que puede pedir la API; la descripción se recorta a LARGO_DESCRIPCION
+CAMPOS = ('nombre', 'autor', 'genero', 'isbn', 'anio_publicacion', 'precio',
+          'stock', 'imagen_url', 'imagenes', 'descripcion')
+LARGO_DESCRIPCION = 100
+
+def codificar_cursor(libro, orden):
+    """Token opaco con la posición del último libro de una página"""
+    campo, _ = ORDENES[orden]
+    datos = {'i': str(libro['_id'])}
+    if campo:
+        datos['v'] = libro.get(campo)
+    return base64.urlsafe_b64encode(json.dumps(datos).encode()).decode().rstrip('=')
+
+def _filtro_cursor(token, orden):
+    datos = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    campo, direccion = ORDENES[orden]
+    operador = '$gt' if direccion == 1 else '$lt'
+    libro_id = ObjectId(datos['i'])
+    if not campo:
+        return {'_id': {operador: libro_id}}
+    return {'$or': [
+        {campo: {operador: datos['v']}},
+        {campo: datos['v'], '_id': {operador: libro_id}}
+    ]}
+
+def filtro_busqueda(query):
+    """Libros con stock, opcionalmente filtrados por título, autor o género"""
+    filtro = {'stock': {'$gt': 0}}
+    if query:
+        # El texto se busca literal: '(' o '*' no deben llegar como regex a MongoDB
+        patron = re.escape(query)
+        filtro['$or'] = [
+            {'nombre': {'$regex': patron, '$options': 'i'}},
+            {'autor': {'$regex': patron, '$options': 'i'}},
+            {'genero': {'$regex': patron, '$options': 'i'}}
+        ]
+    return filtro
+
+def pagina_catalogo(coleccion_libros, query='', orden='titulo', despues=None, limite=24, campos=CAMPOS):
+    """Una página del catálogo de clientes, con paginación por cursor (keyset).
+
+    Devuelve (libros, siguiente), donde siguiente es el token para pedir la
+    página que sigue o None si no hay más. Sólo se leen los campos pedidos y
+    la descripción llega recortada: se pide un carácter de más para saber si
+    hay que mostrar puntos suspensivos.
+    """
+    libros = list(coleccion_libros.aggregate(
+        consulta_catalogo(query, orden, despues, limite, campos)))
+    return cortar_pagina(libros, orden, limite)
+
+def consulta_catalogo(query='', orden='titulo', despues=None, limite=24, campos=CAMPOS):
+    """Pipeline de una página del catálogo (pide un libro de más)"""
+    campo, direccion = ORDENES[orden]
+    filtro = filtro_busqueda(query)
+    if despues:
+        filtro = {'$and': [filtro, _filtro_cursor(despues, orden)]}
+    proyeccion = {nombre: 1 for nombre in campos if nombre != 'descripcion'}
+    if 'descripcion' in campos:
+        proyeccion['descripcion'] = {'$substrCP': [
+            {'$ifNull': ['$descripcion', '']}, 0, LARGO_DESCRIPCION + 1]}
+    if campo:
+        proyeccion[campo] = 1  # Necesario para el cursor
+    orden_mongo = {campo: direccion, '_id': direccion} if campo else {'_id': direccion}
+
+    return [
+        {'$match': filtro},
+        {'$sort': orden_mongo},
+        {'$limit': limite + 1},
+        {'$project': proyeccion},
+    ]
+
+def cortar_pagina(libros, orden, limite):
+    """Quitar el libro de más y armar el cursor de la página siguiente"""
+    siguiente = None
+    if len(libros) > limite:
+        libros = libros[:limite]
+        siguiente = codificar_cursor(libros[-1], orden)
+    return libros, siguiente
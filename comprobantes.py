@@ -0,0 +1,135 @@
+# comprobantes.py
+import io
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+
+# Renderizador único de comprobantes (venta en mostrador y compra del cliente).
+# Las dos rutas dibujaban el mismo documento con pequeñas diferencias; aquí
+# se dibuja una sola vez y VARIANTES marca lo que cambia.
+
+ANCHO, ALTO = A4
+
+# Compresión de las páginas (la de reportlab por defecto). Sin ella el
+# dibujo es un poco más rápido pero cada comprobante ocupa más, en disco
+# (cache_comprobantes) y en la red; ver bench_comprobantes.py
+COMPRESION = 1
+
+VARIANTES = {
+    'venta': {
+        'titulo_pdf': 'Comprobante de Venta',
+        'titulo': 'COMPROBANTE DE VENTA',
+        'seccion': 'INFORMACIÓN DE LA VENTA:',
+        'vendedor': True,
+    },
+    'cliente': {
+        'titulo_pdf': 'Comprobante de Compra',
+        'titulo': 'COMPROBANTE DE COMPRA',
+        'seccion': 'INFORMACIÓN DE LA COMPRA:',
+        'vendedor': False,
+    },
+}
+
+def generar_comprobante(venta, variante='venta'):
+    """Dibujar el comprobante de una venta y devolver los bytes del PDF.
+
+    variante es 'venta' (mostrador, incluye teléfono y vendedor) o 'cliente'.
+    """
+    config = VARIANTES[variante]
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=COMPRESION)
+    pdf.setTitle(f"{config['titulo_pdf']} - {venta['_id']}")
+
+    # Encabezado
+    pdf.setFont("Helvetica-Bold", 18)
+    pdf.drawString(100, ALTO - 50, "BIBLIOTECA DIGITAL")
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(100, ALTO - 70, config['titulo'])
+    pdf.line(100, ALTO - 75, 500, ALTO - 75)
+
+    # Información de la venta
+    fecha = venta['fecha_venta']
+    y_position = ALTO - 100
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(100, y_position, config['seccion'])
+    pdf.setFont("Helvetica", 10)
+    for texto in (f"Folio: {venta['_id']}",
+                  f"Fecha: {fecha.strftime('%d/%m/%Y')}",
+                  f"Hora: {fecha.strftime('%H:%M:%S')}",
+                  f"Estado: {venta.get('estado', 'Completada')}"):
+        y_position -= 15
+        pdf.drawString(100, y_position, texto)
+
+    # Información del cliente
+    y_position -= 25
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(100, y_position, "INFORMACIÓN DEL CLIENTE:")
+    pdf.setFont("Helvetica", 10)
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Nombre: {venta.get('cliente_nombre', 'N/A')}")
+    y_position -= 15
+    pdf.drawString(100, y_position, f"Email: {venta.get('cliente_email', 'N/A')}")
+
+    # Teléfono y vendedor sólo en el comprobante de mostrador
+    if config['vendedor']:
+        if venta.get('cliente_telefono'):
+            y_position -= 15
+            pdf.drawString(100, y_position, f"Teléfono: {venta['cliente_telefono']}")
+        y_position -= 25
+        pdf.setFont("Helvetica-Bold", 12)
+        pdf.drawString(100, y_position, "INFORMACIÓN DEL VENDEDOR:")
+        pdf.setFont("Helvetica", 10)
+        y_position -= 15
+        pdf.drawString(100, y_position, f"Atendió: {venta.get('usuario_nombre', 'N/A')}")
+
+    # Tabla de productos
+    y_position -= 30
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(100, y_position, "DETALLE DE PRODUCTOS:")
+    y_position -= 20
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.drawString(100, y_position, "Producto")
+    pdf.drawString(300, y_position, "Cant.")
+    pdf.drawString(350, y_position, "Precio Unit.")
+    pdf.drawString(450, y_position, "Subtotal")
+    y_position -= 10
+    pdf.line(100, y_position, 500, y_position)
+    y_position -= 10
+
+    pdf.setFont("Helvetica", 9)
+    for item in venta.get('items', []):
+        if y_position < 150:  # Nueva página si es necesario
+            pdf.showPage()
+            y_position = ALTO - 50
+            pdf.setFont("Helvetica", 9)
+
+        titulo = item['titulo']
+        if len(titulo) > 40:
+            titulo = titulo[:37] + "..."
+
+        pdf.drawString(100, y_position, titulo)
+        pdf.drawString(300, y_position, str(item['cantidad']))
+        pdf.drawString(350, y_position, f"${item['precio_unitario']:.2f}")
+        pdf.drawString(450, y_position, f"${item['subtotal']:.2f}")
+        y_position -= 20
+
+    # Línea separadora y totales
+    y_position -= 10
+    pdf.line(100, y_position, 500, y_position)
+    y_position -= 20
+    pdf.setFont("Helvetica", 10)
+    pdf.drawString(350, y_position, f"Subtotal: ${venta.get('subtotal', 0):.2f}")
+    y_position -= 15
+    pdf.drawString(350, y_position, f"IVA (16%): ${venta.get('iva', 0):.2f}")
+    y_position -= 15
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(350, y_position, f"TOTAL: ${venta.get('total', 0):.2f}")
+
+    # Pie de página con agradecimiento
+    y_position -= 40
+    pdf.setFont("Helvetica-Oblique", 10)
+    pdf.drawString(100, y_position, "¡Gracias por su compra en Biblioteca Digital!")
+    y_position -= 15
+    pdf.drawString(100, y_position, "Esperamos volver a servirle pronto.")
+
+    pdf.save()
+    return buffer.getvalue()
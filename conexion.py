@@ -0,0 +1,118 @@
+# conexion.py
+import importlib.util
+import os
+import threading
+import pymongo
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+# Conexión a MongoDB creada al primer uso y una vez por proceso.
+#
+# Crear el módulo no abre sockets ni hace un ping: el MongoClient se construye
+# (con connect=False) la primera vez que una petición toca la base. Si el
+# proceso se bifurca (workers de gunicorn con --preload), el hijo detecta
+# que su pid cambió y crea su propio cliente en lugar de usar el del padre.
+#
+# Las colecciones que exporta app.py son ColeccionPerezosa: resuelven la
+# colección real del cliente del proceso en cada acceso.
+
+# Compresores de red en orden de preferencia y el módulo que necesita cada uno
+COMPRESORES = {'zstd': 'zstandard', 'snappy': 'snappy', 'zlib': None}
+
+def compresores_disponibles(pedidos):
+    """Filtrar los compresores pedidos a los que tienen su librería instalada"""
+    return [nombre for nombre in pedidos
+            if nombre in COMPRESORES
+            and (COMPRESORES[nombre] is None or importlib.util.find_spec(COMPRESORES[nombre]))]
+
+class ConexionMongo:
+    """Cliente de MongoDB perezoso y seguro ante fork"""
+
+    def __init__(self, uri, nombre_db, **opciones):
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.configurar(uri, nombre_db, **opciones)
+
+    def configurar(self, uri, nombre_db, max_pool=100, min_pool=0, espera_cola_ms=2000,
+                   compresores=(), seleccion_ms=5000, escuchas=()):
+        """Fijar URI y opciones; el cliente se vuelve a crear en el próximo acceso"""
+        self.cerrar()
+        self.uri = uri
+        self.nombre_db = nombre_db
+        self.opciones = {
+            'maxPoolSize': max_pool,
+            'minPoolSize': min_pool,
+            'waitQueueTimeoutMS': espera_cola_ms,
+            'serverSelectionTimeoutMS': seleccion_ms,
+        }
+        if escuchas:
+            self.opciones['event_listeners'] = list(escuchas)  # p. ej. EscuchaComandos de metricas.py
+        compresores = compresores_disponibles(compresores)
+        if compresores:
+            self.opciones['compressors'] = ','.join(compresores)
+
+    @property
+    def client(self):
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    # El cliente heredado del padre se descarta sin usarlo
+                    self._client = MongoClient(self.uri, connect=False, **self.opciones)
+                    self._pid = pid
+        return self._client
+
+    def cerrar(self):
+        """Cerrar el cliente de este proceso (p. ej. en el maestro antes de crear workers)"""
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
+
+    @property
+    def db(self):
+        return self.client[self.nombre_db]
+
+    def base_datos(self):
+        return BaseDatosPerezosa(self)
+
+    def vivo(self):
+        """Liveness: el proceso responde, sin tocar la red"""
+        return {'estado': 'ok', 'pid': os.getpid()}
+
+    def listo(self, timeout=2):
+        """Readiness: (listo, detalle) según un ping al servidor acotado por timeout"""
+        try:
+            with pymongo.timeout(timeout):
+                self.client.admin.command('ping')
+        except PyMongoError as e:
+            return False, {'estado': 'no_disponible', 'error': str(e)}
+        return True, {'estado': 'ok'}
+
+class ColeccionPerezosa:
+    """Colección que se resuelve contra el cliente del proceso en cada acceso"""
+
+    def __init__(self, conexion, nombre):
+        self._conexion = conexion
+        self.name = nombre
+
+    def __getattr__(self, atributo):
+        return getattr(self._conexion.db[self.name], atributo)
+
+class BaseDatosPerezosa:
+    """Base de datos perezosa: db['x'] devuelve una ColeccionPerezosa"""
+
+    def __init__(self, conexion):
+        self._conexion = conexion
+
+    @property
+    def name(self):
+        return self._conexion.nombre_db
+
+    def __getattr__(self, atributo):
+        return getattr(self._conexion.db, atributo)
+
+    def __getitem__(self, nombre):
+        return ColeccionPerezosa(self._conexion, nombre)
@@ -0,0 +1,138 @@
+# consultas_n1.py
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from pymongo import monitoring
+
+# Detector de consultas N+1 para desarrollo y pruebas.
+#
+# Cada comando a MongoDB se reduce a una forma: colección, comando y la
+# estructura del filtro con los valores reemplazados por '?'. Un find_one
+# dentro de un for sobre ventas produce muchas veces la misma forma
+# ('pedidos', 'find', {'venta_id': '?'}), y eso es lo que se detecta.
+#
+# Las capturas se apilan en una ContextVar: la del hook de Flask y la de un
+# test (max_consultas) ven los mismos comandos de la misma petición.
+
+capturas_activas = contextvars.ContextVar('capturas_activas', default=())
+
+# Continuaciones de un cursor ya abierto: no son consultas nuevas, y cuántas
+# hay depende del tamaño de lote, no del código
+COMANDOS_IGNORADOS = {'getMore', 'killCursors'}
+
+# Dónde está el filtro en cada comando. Los que no aparecen (insert, por
+# ejemplo) tienen forma vacía: un insert_one dentro de un for repite
+# 'coleccion.insert' y también se detecta.
+CAMPO_FILTRO = {
+    'find': 'filter',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+    'aggregate': 'pipeline',
+    'update': 'updates',
+    'delete': 'deletes',
+}
+
+class ConsultasRepetidas(Exception):
+    pass
+
+def forma(valor):
+    """Estructura de un filtro sin sus valores"""
+    if isinstance(valor, dict):
+        return {clave: forma(v) for clave, v in sorted(valor.items())}
+    if isinstance(valor, list) and valor and all(isinstance(v, dict) for v in valor):
+        return [forma(v) for v in valor]
+    return '?'
+
+def huella_comando(nombre, comando):
+    """(colección, comando, forma del filtro) de un comando, como texto"""
+    coleccion = comando.get(nombre)
+    campo = CAMPO_FILTRO.get(nombre)
+    filtro = forma(comando.get(campo, {})) if campo else ''
+    if nombre in ('update', 'delete'):
+        # Sólo el filtro (q) de cada operación, no los valores a escribir
+        filtro = [operacion.get('q', '?') for operacion in filtro] if isinstance(filtro, list) else filtro
+    return f"{coleccion}.{nombre} {filtro}"
+
+class Captura:
+    """Comandos emitidos mientras la captura está activa"""
+
+    def __init__(self):
+        self.huellas = Counter()
+
+    @property
+    def total(self):
+        return sum(self.huellas.values())
+
+    def repetidas(self, umbral):
+        """Formas que se repiten más de umbral veces, de la más repetida a la menos"""
+        return [(huella, veces) for huella, veces in self.huellas.most_common() if veces > umbral]
+
+    def resumen(self):
+        return self.formatear(self.huellas.most_common())
+
+    @staticmethod
+    def formatear(huellas):
+        return '\n'.join(f"  {veces:>4} x {huella}" for huella, veces in huellas)
+
+def iniciar_captura():
+    """Empezar a capturar comandos; devuelve (captura, token para terminar_captura)"""
+    captura = Captura()
+    return captura, capturas_activas.set(capturas_activas.get() + (captura,))
+
+def terminar_captura(token):
+    capturas_activas.reset(token)
+
+@contextmanager
+def capturar():
+    captura, token = iniciar_captura()
+    try:
+        yield captura
+    finally:
+        terminar_captura(token)
+
+class DetectorN1(monitoring.CommandListener):
+    """CommandListener que anota la forma de cada comando en las capturas activas"""
+
+    def started(self, event):
+        capturas = capturas_activas.get()
+        if not capturas or event.command_name in COMANDOS_IGNORADOS:
+            return
+        huella = huella_comando(event.command_name, event.command)
+        for captura in capturas:
+            captura.huellas[huella] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def revisar(captura, umbral, descripcion, accion='log'):
+    """Avisar (o lanzar ConsultasRepetidas) si alguna forma pasa del umbral"""
+    repetidas = captura.repetidas(umbral)
+    if not repetidas:
+        return
+    detalle = Captura.formatear(repetidas)
+    mensaje = f"Posible N+1 en {descripcion}: {captura.total} comandos a MongoDB\n{detalle}"
+    if accion == 'error':
+        raise ConsultasRepetidas(mensaje)
+    print(mensaje)
+
+@contextmanager
+def max_consultas(maximo, umbral_repetidas=None):
+    """Helper para pytest: falla si el bloque emite más de maximo comandos.
+
+        def test_listar_ventas(cliente_admin):
+            with max_consultas(6, umbral_repetidas=2):
+                assert cliente_admin.get('/ventas').status_code == 200
+
+    Con umbral_repetidas también falla si una misma forma se repite más de
+    esas veces. Necesita que DetectorN1 esté registrado en el cliente.
+    """
+    with capturar() as captura:
+        yield captura
+    assert captura.total <= maximo, (
+        f"{captura.total} comandos a MongoDB (máximo {maximo}):\n{captura.resumen()}")
+    if umbral_repetidas is not None:
+        revisar(captura, umbral_repetidas, 'el bloque', accion='error')
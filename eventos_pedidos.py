@@ -0,0 +1,98 @@
+# eventos_pedidos.py
+import queue
+import threading
+from pymongo.errors import PyMongoError
+
+# Canal de eventos (Server-Sent Events) para los cambios de seguimiento.
+# Un broker en memoria reparte cada cambio a las conexiones abiertas del
+# cliente dueño del pedido. Cada suscriptor tiene una cola acotada: si un
+# navegador lento la llena, se descartan sus eventos más viejos en lugar de
+# bloquear a quien publica.
+#
+# El broker sólo llega a los suscriptores del mismo proceso. Con varios
+# procesos web, los cambios deben venir de un change stream de MongoDB
+# (requiere replica set), que cada proceso escucha por su cuenta.
+
+class BrokerPedidos:
+    """Pub/sub en memoria de cambios de pedidos, por cliente"""
+
+    def __init__(self, tamano_cola=50, latido=15):
+        self.tamano_cola = tamano_cola
+        self.latido = latido
+        self._suscriptores = {}
+        self._lock = threading.Lock()
+
+    def suscribir(self, cliente_id):
+        cola = queue.Queue(maxsize=self.tamano_cola)
+        with self._lock:
+            self._suscriptores.setdefault(cliente_id, set()).add(cola)
+        return cola
+
+    def cancelar(self, cliente_id, cola):
+        with self._lock:
+            colas = self._suscriptores.get(cliente_id)
+            if colas:
+                colas.discard(cola)
+                if not colas:
+                    del self._suscriptores[cliente_id]
+
+    def publicar(self, cliente_id, evento):
+        """Entregar un evento a todas las conexiones del cliente sin bloquear"""
+        with self._lock:
+            colas = list(self._suscriptores.get(cliente_id, ()))
+        for cola in colas:
+            while True:
+                try:
+                    cola.put_nowait(evento)
+                    break
+                except queue.Full:
+                    try:
+                        cola.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def flujo(self, cliente_id, serializar, nombre_evento='estado'):
+        """Generador de text/event-stream para un cliente.
+
+        Envía un comentario de latido cada 'latido' segundos sin eventos para
+        mantener viva la conexión a través de proxies. La suscripción se
+        cancela cuando el navegador cierra la conexión.
+        """
+        cola = self.suscribir(cliente_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    evento = cola.get(timeout=self.latido)
+                except queue.Empty:
+                    yield ": latido\n\n"
+                    continue
+                yield f"event: {nombre_evento}\ndata: {serializar(evento)}\n\n"
+        finally:
+            self.cancelar(cliente_id, cola)
+
+def escuchar_cambios(coleccion_pedidos, broker, convertir):
+    """Publicar en el broker los cambios de pedidos leídos de un change stream.
+
+    Pensado para correr en un hilo. Devuelve False si el servidor no admite
+    change streams (mongod sin replica set).
+    """
+    try:
+        with coleccion_pedidos.watch(
+                [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']}}}],
+                full_document='updateLookup') as cambios:
+            for cambio in cambios:
+                pedido = cambio.get('fullDocument')
+                if pedido and pedido.get('cliente_id'):
+                    broker.publicar(pedido['cliente_id'], convertir(pedido))
+    except PyMongoError as e:
+        print(f"Change stream de pedidos no disponible: {e}")
+        return False
+    return True
+
+def iniciar_escucha(coleccion_pedidos, broker, convertir):
+    hilo = threading.Thread(target=escuchar_cambios,
+                            args=(coleccion_pedidos, broker, convertir),
+                            name='change-stream-pedidos', daemon=True)
+    hilo.start()
+    return hilo
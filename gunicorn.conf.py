@@ -0,0 +1,70 @@
+# gunicorn.conf.py
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# Configuración de gunicorn para wsgi:application.
+#
+# LIBRERIA_PERFIL elige el tipo y número de workers según las rutas que
+# atiende la instancia:
+#
+#   catalogo  gthread. Catálogo, carrito y API: peticiones cortas que pasan
+#             casi todo el tiempo esperando a MongoDB (o salen de la cache del
+#             catálogo), así que varios hilos por proceso cubren esa espera.
+#   pdf       sync. Comprobantes y reportes dibujados con reportlab dentro del
+#             worker: trabajo de CPU que no se reparte entre hilos por el GIL,
+#             así que un proceso por núcleo y un timeout amplio.
+#   eventos   gevent. /api/seguimiento/eventos: conexiones SSE abiertas por
+#             minutos, que con sync o gthread ocuparían un hilo cada una.
+#             Activa el change stream de pedidos, porque los cambios los
+#             escriben otras instancias.
+#   mixto     gthread (por defecto). Todas las rutas en una sola instancia,
+#             salvo el canal SSE: sin gevent responde 503 y la página de
+#             seguimiento consulta cada 30 segundos.
+#
+# Para tener SSE hace falta una instancia 'eventos' a la que el proxy envíe
+# /api/seguimiento/eventos, y LIBRERIA_SEGUIMIENTO_SSE=true en las instancias
+# que sirven las páginas.
+#
+# LIBRERIA_WORKERS y LIBRERIA_HILOS sobrescriben los valores del perfil.
+
+nucleos = multiprocessing.cpu_count()
+
+PERFILES = {
+    'catalogo': {'worker_class': 'gthread', 'workers': 2 * nucleos + 1, 'threads': 8, 'timeout': 30},
+    'pdf': {'worker_class': 'sync', 'workers': nucleos + 1, 'threads': 1, 'timeout': 120},
+    'eventos': {'worker_class': 'gevent', 'workers': nucleos, 'threads': 1, 'timeout': 60},
+    'mixto': {'worker_class': 'gthread', 'workers': nucleos + 1, 'threads': 4, 'timeout': 120},
+}
+
+perfil = PERFILES[os.environ.get('LIBRERIA_PERFIL', 'mixto')]
+
+if perfil['worker_class'] == 'gevent':
+    os.environ.setdefault('LIBRERIA_SEGUIMIENTO_CHANGE_STREAM', 'true')
+
+wsgi_app = 'wsgi:application'
+bind = os.environ.get('LIBRERIA_BIND', '0.0.0.0:5000')
+worker_class = perfil['worker_class']
+workers = int(os.environ.get('LIBRERIA_WORKERS', perfil['workers']))
+threads = int(os.environ.get('LIBRERIA_HILOS', perfil['threads']))
+worker_connections = 1000  # Sólo gevent: conexiones simultáneas por worker
+timeout = perfil['timeout']
+graceful_timeout = 30
+keepalive = 5
+max_requests = 2000  # Reciclar workers de vez en cuando
+max_requests_jitter = 200
+
+# Cada worker importa la app y crea su propio cliente de MongoDB
+preload_app = False
+
+def on_starting(server):
+    """Índices y datos iniciales una vez por despliegue, antes de crear workers.
+
+    Corre en un proceso aparte para que el maestro no importe la app (ni abra
+    conexiones) antes del fork. Con varios hosts se puede desactivar con
+    LIBRERIA_INICIALIZAR=0 y ejecutar el comando en el pipeline de despliegue.
+    """
+    if os.environ.get('LIBRERIA_INICIALIZAR', '1') == '0':
+        return
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'wsgi', 'inicializar'], check=True)
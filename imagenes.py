@@ -0,0 +1,196 @@
+# imagenes.py
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps
+from pymongo import MongoClient
+import catalogo
+
+# Portadas de libros. El original subido se guarda con el hash de su
+# contenido como nombre (dos subidas iguales comparten archivo) y un pool de
+# procesos genera las variantes de tamaño fijo en WebP y JPEG:
+#
+#   <directorio>/originales/<hash>.<ext>
+#   <directorio>/<hash>_<variante>.webp|jpg
+#
+# Cuando las variantes están listas se guardan sus URLs en el campo
+# 'imagenes' de los libros con ese imagen_hash:
+# {variante: {'webp': url, 'jpg': url}}
+#
+# imagen_estado de cada libro: pendiente | lista | error (con imagen_error).
+# Mientras no esté lista, las páginas muestran el original.
+
+# Caja máxima (ancho, alto) de cada variante; se conserva la proporción
+VARIANTES = {
+    'miniatura': (96, 144),
+    'tarjeta': (240, 360),
+    'detalle': (600, 900),
+}
+
+FORMATOS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+EXTENSIONES = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# Nombres que puede servir la ruta de medios: originales y variantes, siempre
+# con el hash del contenido en el nombre (por eso se pueden cachear para siempre)
+NOMBRE_ARCHIVO = re.compile(
+    r'(originales/[0-9a-f]{32}\.(' + '|'.join(EXTENSIONES.values()) + r')'
+    r'|[0-9a-f]{32}_(' + '|'.join(VARIANTES) + r')\.(' + '|'.join(FORMATOS) + r'))')
+
+class ImagenNoValida(ValueError):
+    pass
+
+def urls_variantes(huella, url_base):
+    return {
+        variante: {formato: f"{url_base}/{huella}_{variante}.{formato}" for formato in FORMATOS}
+        for variante in VARIANTES
+    }
+
+def ruta_archivo(directorio, nombre):
+    """Ruta en disco de una portada o variante, o None si el nombre no es válido o no existe"""
+    if not NOMBRE_ARCHIVO.fullmatch(nombre):
+        return None
+    ruta = os.path.join(directorio, nombre)
+    return ruta if os.path.isfile(ruta) else None
+
+def _escribir(imagen, ruta, formato, opciones):
+    """Guardar una imagen de forma atómica"""
+    fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as archivo:
+        imagen.save(archivo, formato, **opciones)
+    os.replace(temporal, ruta)
+
+def generar_variantes(ruta_original, directorio, huella):
+    """Redimensionar el original a cada variante y formato (trabajo de CPU)"""
+    with Image.open(ruta_original) as imagen:
+        imagen = ImageOps.exif_transpose(imagen)
+        if imagen.mode in ('RGBA', 'LA', 'P'):
+            # JPEG no tiene transparencia: aplanar sobre fondo blanco
+            imagen = imagen.convert('RGBA')
+            fondo = Image.new('RGB', imagen.size, 'white')
+            fondo.paste(imagen, mask=imagen.getchannel('A'))
+            imagen = fondo
+        else:
+            imagen = imagen.convert('RGB')
+
+        for variante, tamano in VARIANTES.items():
+            copia = imagen.copy()
+            copia.thumbnail(tamano, Image.LANCZOS)
+            for extension, (formato, opciones) in FORMATOS.items():
+                ruta = os.path.join(directorio, f"{huella}_{variante}.{extension}")
+                if not os.path.exists(ruta):
+                    _escribir(copia, ruta, formato, opciones)
+
+def _procesar(mongo_uri, nombre_db, huella, ruta_original, directorio, url_base):
+    """Generar las variantes dentro de un proceso del pool y publicarlas en los libros"""
+    generar_variantes(ruta_original, directorio, huella)
+    client = MongoClient(mongo_uri)
+    try:
+        db = client[nombre_db]
+        resultado = db['tipolibro'].update_many(
+            {'imagen_hash': huella},
+            {'$set': {'imagenes': urls_variantes(huella, url_base), 'imagen_estado': 'lista'},
+             '$unset': {'imagen_error': ''}}
+        )
+        if resultado.modified_count:
+            catalogo.registrar_cambio(db['versiones'])
+    finally:
+        client.close()
+
+class ProcesadorImagenes:
+    """Guardar portadas subidas y encolar la generación de sus variantes"""
+
+    def __init__(self, coleccion_libros, directorio, url_base, mongo_uri, nombre_db, max_workers=2):
+        self.coleccion_libros = coleccion_libros
+        self.directorio = directorio
+        self.url_base = url_base
+        self.mongo_uri = mongo_uri
+        self.nombre_db = nombre_db
+        self.max_workers = max_workers
+        self._executor = None
+        os.makedirs(os.path.join(directorio, 'originales'), exist_ok=True)
+
+    @property
+    def executor(self):
+        # Igual que la cola de reportes PDF: se crea al primer uso y con 'spawn'
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def guardar(self, archivo):
+        """Guardar el original subido y devolver (huella, ruta, url).
+
+        Sólo se lee el encabezado para validar el formato; el redimensionado
+        queda para el pool. Lanza ImagenNoValida si no es una imagen.
+        """
+        try:
+            with Image.open(archivo.stream) as imagen:
+                extension = EXTENSIONES.get(imagen.format)
+        except (OSError, Image.DecompressionBombError):
+            extension = None
+        if not extension:
+            raise ImagenNoValida('El archivo no es una imagen JPEG, PNG, WebP o GIF')
+        archivo.stream.seek(0)
+
+        # Copiar a un temporal calculando el hash por bloques
+        sha = hashlib.sha256()
+        originales = os.path.join(self.directorio, 'originales')
+        fd, temporal = tempfile.mkstemp(dir=originales, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as destino:
+            for bloque in iter(lambda: archivo.stream.read(64 * 1024), b''):
+                sha.update(bloque)
+                destino.write(bloque)
+        huella = sha.hexdigest()[:32]
+
+        nombre = f"{huella}.{extension}"
+        ruta = os.path.join(originales, nombre)
+        if os.path.exists(ruta):
+            os.remove(temporal)  # Misma imagen ya subida antes
+        else:
+            os.replace(temporal, ruta)
+        return huella, ruta, f"{self.url_base}/originales/{nombre}"
+
+    def encolar(self, huella, ruta_original):
+        try:
+            futuro = self.executor.submit(_procesar, self.mongo_uri, self.nombre_db, huella,
+                                          ruta_original, self.directorio, self.url_base)
+        except BrokenProcessPool as e:
+            self._fallo(huella, e)
+            return None
+        futuro.add_done_callback(lambda f: self._revisar_resultado(huella, f))
+        return futuro
+
+    def _revisar_resultado(self, huella, futuro):
+        """Anotar el error si las variantes no se generaron (imagen dañada, worker caído...)"""
+        if futuro.cancelled():
+            self._fallo(huella, 'Procesamiento cancelado')
+        elif futuro.exception() is not None:
+            self._fallo(huella, futuro.exception())
+
+    def _fallo(self, huella, error):
+        if isinstance(error, BrokenProcessPool):
+            # Un pool roto no acepta más trabajos: se crea otro en el próximo uso
+            self._executor = None
+        print(f"Error al generar las variantes de la portada {huella}: {error}")
+        try:
+            self.coleccion_libros.update_many(
+                {'imagen_hash': huella, 'imagen_estado': 'pendiente'},
+                {'$set': {'imagen_estado': 'error', 'imagen_error': str(error)}})
+        except Exception as e:
+            print(f"No se pudo anotar el error de la portada {huella}: {e}")
+
+    def variantes_listas(self, huella):
+        """URLs de las variantes si ya existen en disco (subida repetida), o None"""
+        # detalle.jpg es la última que escribe generar_variantes
+        ultima = os.path.join(self.directorio, f"{huella}_detalle.jpg")
+        return urls_variantes(huella, self.url_base) if os.path.exists(ultima) else None
@@ -0,0 +1,152 @@
+# indices.py
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+# Registro declarativo de índices por colección.
+# Cada índice lleva nombre explícito para poder reconciliarlo en cada arranque.
+INDICES = {
+    'tipolibro': [
+        IndexModel([('stock', ASCENDING)], name='stock'),
+        # Orden de las páginas del catálogo (por título y por precio)
+        IndexModel([('nombre', ASCENDING), ('_id', ASCENDING)], name='nombre_id'),
+        IndexModel([('precio', ASCENDING), ('_id', ASCENDING)], name='precio_id'),
+        # Publicación de variantes de portada generadas en segundo plano
+        IndexModel([('imagen_hash', ASCENDING)], name='imagen_hash', sparse=True),
+    ],
+    'usuarios': [
+        IndexModel([('email', ASCENDING)], name='email_unico', unique=True),
+    ],
+    'clientes': [
+        IndexModel([('email', ASCENDING)], name='email_unico', unique=True),
+        IndexModel([('activo', ASCENDING)], name='activo'),
+    ],
+    'ventas': [
+        IndexModel([('fecha_venta', DESCENDING), ('_id', DESCENDING)], name='fecha_venta_id'),
+        IndexModel([('cliente_id', ASCENDING), ('fecha_venta', DESCENDING)], name='cliente_fecha'),
+        IndexModel([('tipo', ASCENDING), ('estado', ASCENDING), ('fecha_venta', DESCENDING)], name='tipo_estado_fecha'),
+    ],
+    'pedidos': [
+        IndexModel([('venta_id', ASCENDING)], name='venta_id_unico', unique=True),
+        IndexModel([('cliente_id', ASCENDING), ('ultima_actualizacion', DESCENDING)], name='cliente_actualizacion'),
+    ],
+    'cancelaciones': [
+        IndexModel([('venta_id', ASCENDING)], name='venta_id_unico', unique=True),
+        # Mis compras (app asíncrona) lee las cancelaciones del cliente junto con sus ventas
+        IndexModel([('cliente_id', ASCENDING)], name='cliente_id'),
+    ],
+    'ventas_diarias': [
+        IndexModel([('fecha', ASCENDING), ('tipo', ASCENDING)], name='fecha_tipo_unico', unique=True),
+    ],
+    'trabajos_pdf': [
+        # Un solo trabajo vigente (pendiente o en proceso) por solicitud equivalente
+        IndexModel([('clave', ASCENDING)], name='clave_vigente_unico', unique=True,
+                   partialFilterExpression={'vigente': True}),
+        # Los trabajos se borran un día después de vencer
+        IndexModel([('expira', ASCENDING)], name='expira_ttl', expireAfterSeconds=86400),
+    ],
+    'carritos': [
+        # Los carritos abandonados se borran a los 30 días sin cambios
+        IndexModel([('actualizado', ASCENDING)], name='actualizado_ttl', expireAfterSeconds=30 * 86400),
+    ],
+}
+
+# Opciones que cambian el comportamiento de un índice y se comparan al reconciliar
+OPCIONES = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression')
+
+def _clave(documento):
+    clave = documento['key']
+    return list(clave.items()) if isinstance(clave, dict) else list(clave)
+
+def _definicion(documento):
+    """Normalizar un índice (IndexModel o index_information) para compararlo"""
+    return (_clave(documento),
+            bool(documento.get('unique', False)),
+            bool(documento.get('sparse', False)),
+            documento.get('expireAfterSeconds'),
+            dict(documento['partialFilterExpression']) if 'partialFilterExpression' in documento else None)
+
+def _solo_cambia_ttl(actual, doc):
+    """True si la única diferencia es expireAfterSeconds (se cambia con collMod)"""
+    if actual.get('expireAfterSeconds') is None or doc.get('expireAfterSeconds') is None:
+        return False
+    sin_ttl = lambda d: _definicion(dict(d, expireAfterSeconds=None))
+    return sin_ttl(actual) == sin_ttl(doc)
+
+def _recrear(coleccion, modelo, actual):
+    """Reemplazar un índice; si el nuevo no se puede crear, restaurar el anterior"""
+    nombre = modelo.document['name']
+    anterior = IndexModel(_clave(actual), name=nombre,
+                          **{opcion: actual[opcion] for opcion in OPCIONES if opcion in actual})
+    coleccion.drop_index(nombre)
+    try:
+        coleccion.create_indexes([modelo])
+    except OperationFailure:
+        coleccion.create_indexes([anterior])
+        raise
+
+def asegurar_indices(db, registro=None, recrear=False):
+    """Crear o reconciliar los índices del registro de forma idempotente.
+
+    Devuelve un reporte de desviaciones con las listas 'creados', 'recreados',
+    'modificados' (TTL cambiado en su lugar), 'conflictos' (existen con otra
+    definición), 'sobrantes' (existen en la base pero no en el registro) y
+    'errores'.
+
+    Un índice con otra definición no se toca salvo con recrear=True: hay que
+    borrarlo para crearlo de nuevo (MongoDB no admite dos índices con la
+    misma clave), y mientras tanto la colección se queda sin él. Si el nuevo
+    falla (p. ej. duplicados para un índice único), se restaura el anterior.
+    """
+    registro = registro if registro is not None else INDICES
+    reporte = {'creados': [], 'recreados': [], 'modificados': [], 'conflictos': [],
+               'sobrantes': [], 'errores': []}
+
+    for nombre_coleccion, modelos in registro.items():
+        coleccion = db[nombre_coleccion]
+        existentes = coleccion.index_information()
+        declarados = set()
+
+        for modelo in modelos:
+            doc = modelo.document
+            nombre = doc['name']
+            declarados.add(nombre)
+            etiqueta = f"{nombre_coleccion}.{nombre}"
+            actual = existentes.get(nombre)
+
+            try:
+                if actual is None:
+                    coleccion.create_indexes([modelo])
+                    reporte['creados'].append(etiqueta)
+                elif _definicion(actual) == _definicion(doc):
+                    continue
+                elif _solo_cambia_ttl(actual, doc):
+                    db.command('collMod', nombre_coleccion, index={
+                        'name': nombre, 'expireAfterSeconds': doc['expireAfterSeconds']})
+                    reporte['modificados'].append(etiqueta)
+                elif recrear:
+                    _recrear(coleccion, modelo, actual)
+                    reporte['recreados'].append(etiqueta)
+                else:
+                    reporte['conflictos'].append(etiqueta)
+            except OperationFailure as e:
+                # Por ejemplo, emails duplicados que impiden el índice único
+                reporte['errores'].append(f"{etiqueta}: {e}")
+
+        for nombre in existentes:
+            if nombre != '_id_' and nombre not in declarados:
+                reporte['sobrantes'].append(f"{nombre_coleccion}.{nombre}")
+
+    return reporte
+
+def imprimir_reporte_indices(reporte):
+    """Mostrar en consola el reporte de desviaciones de índices"""
+    if not any(reporte.values()):
+        print("Índices al día: sin desviaciones.")
+        return
+    etiquetas = {'creados': 'creado', 'recreados': 'recreado', 'modificados': 'modificado',
+                 'conflictos': 'con otra definición', 'sobrantes': 'sobrante', 'errores': 'con error'}
+    for clave, texto in etiquetas.items():
+        for etiqueta in reporte[clave]:
+            print(f"Índice {texto}: {etiqueta}")
+    if reporte['conflictos']:
+        print("Para reemplazarlos: flask recrear-indices")
@@ -0,0 +1,120 @@
+# inventario.py
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+def _sumar_lineas(lineas):
+    """Agrupar (libro_id, cantidad) por libro, conservando el orden"""
+    cantidades = {}
+    for libro_id, cantidad in lineas:
+        cantidades[libro_id] = cantidades.get(libro_id, 0) + cantidad
+    return cantidades
+
+# Marcas de devolución que se conservan por libro (ver devolver_inventario)
+MAX_MARCAS_DEVOLUCION = 50
+
+def devolver_inventario(coleccion_libros, lineas, marca=None):
+    """Sumar al stock las cantidades de (libro_id, cantidad) con un solo bulk_write.
+
+    Con marca (p. ej. el id de la venta cancelada), cada libro recibe la
+    devolución una sola vez: el $inc va condicionado a que la marca no esté
+    en su lista 'devoluciones' y la agrega en la misma actualización, así que
+    un reintento no vuelve a sumar. Se guardan las últimas
+    MAX_MARCAS_DEVOLUCION marcas por libro.
+    """
+    operaciones = []
+    for libro_id, cantidad in _sumar_lineas(lineas).items():
+        if not ObjectId.is_valid(libro_id):
+            continue
+        if marca is None:
+            operaciones.append(UpdateOne({'_id': ObjectId(libro_id)}, {'$inc': {'stock': cantidad}}))
+        else:
+            operaciones.append(UpdateOne(
+                {'_id': ObjectId(libro_id), 'devoluciones': {'$ne': marca}},
+                {'$inc': {'stock': cantidad},
+                 '$push': {'devoluciones': {'$each': [marca], '$slice': -MAX_MARCAS_DEVOLUCION}}}))
+    if operaciones:
+        coleccion_libros.bulk_write(operaciones, ordered=False)
+
+def stock_actual(coleccion_libros, lineas):
+    """Stock vigente tras un cambio: lista de (libro_id, stock, delta) con una consulta $in"""
+    cantidades = {libro_id: cantidad for libro_id, cantidad in _sumar_lineas(lineas).items()
+                  if ObjectId.is_valid(libro_id)}
+    return [(str(libro['_id']), libro.get('stock', 0), cantidades[str(libro['_id'])])
+            for libro in coleccion_libros.find(
+                {'_id': {'$in': [ObjectId(libro_id) for libro_id in cantidades]}}, {'stock': 1})]
+
+def _deshacer(coleccion_libros, aplicadas, insertados):
+    """Revertir las líneas ya descontadas y borrar documentos creados por upsert"""
+    insertados = set(insertados)
+    devolver_inventario(coleccion_libros, [
+        (libro_id, cantidad) for libro_id, cantidad in aplicadas
+        if ObjectId(libro_id) not in insertados
+    ])
+    if insertados:
+        coleccion_libros.delete_many({'_id': {'$in': list(insertados)}})
+
+def reservar_inventario(coleccion_libros, lineas, libros=None):
+    """Descontar el stock de todas las líneas de una compra de forma atómica.
+
+    lineas es una lista de (libro_id, cantidad). Devuelve (libros, None) con
+    los libros indexados por id y el stock que les quedó en la base (incluidas
+    otras ventas simultáneas), o (None, mensaje) si alguna línea no se pudo
+    reservar; en ese caso no queda ningún descuento aplicado.
+
+    Cada línea es un $inc condicionado a stock >= cantidad dentro de un
+    bulk_write ordenado. Las actualizaciones llevan upsert=True: si el stock
+    ya no alcanza, el upsert choca con el _id existente y el error indica
+    exactamente qué línea falló, así que sólo se revierten las anteriores.
+
+    libros permite pasar los documentos ya leídos (por ejemplo, por
+    carritos.cotizar) para no volver a consultarlos.
+    """
+    # Una cantidad negativa sumaría stock con el mismo $inc
+    if any(cantidad <= 0 for _, cantidad in lineas):
+        return None, 'Cantidad no válida'
+    cantidades = _sumar_lineas(lineas)
+    if not all(ObjectId.is_valid(libro_id) for libro_id in cantidades):
+        return None, 'Libro no encontrado'
+
+    if libros is None:
+        libros = {str(libro['_id']): libro for libro in coleccion_libros.find(
+            {'_id': {'$in': [ObjectId(libro_id) for libro_id in cantidades]}})}
+    for libro_id, cantidad in cantidades.items():
+        libro = libros.get(libro_id)
+        if not libro:
+            return None, 'Libro no encontrado'
+        if libro.get('stock', 0) < cantidad:
+            return None, f"Stock insuficiente para {libro['nombre']}"
+
+    orden = list(cantidades.items())
+    # Truco del upsert: si el filtro no encuentra el libro con stock suficiente,
+    # el upsert intenta insertar un documento con el mismo _id y el índice de
+    # _id lo rechaza (DuplicateKey), lo que marca la línea que falló. Efecto
+    # secundario: si el libro se borró a la vez, el insert sí prospera y deja
+    # por un momento un documento suelto {_id, stock: -cantidad}, que se borra
+    # abajo con _deshacer.
+    operaciones = [
+        UpdateOne({'_id': ObjectId(libro_id), 'stock': {'$gte': cantidad}},
+                  {'$inc': {'stock': -cantidad}}, upsert=True)
+        for libro_id, cantidad in orden
+    ]
+    try:
+        resultado = coleccion_libros.bulk_write(operaciones, ordered=True)
+    except BulkWriteError as e:
+        fallo = e.details['writeErrors'][0]['index']
+        _deshacer(coleccion_libros, orden[:fallo],
+                  [u['_id'] for u in e.details.get('upserted', [])])
+        return None, f"Stock insuficiente para {libros[orden[fallo][0]]['nombre']}"
+
+    # Un upsert exitoso significa que el libro se eliminó entre la lectura y el descuento
+    if resultado.upserted_ids:
+        _deshacer(coleccion_libros, orden, resultado.upserted_ids.values())
+        return None, 'Libro no encontrado'
+
+    # bulk_write no devuelve los documentos: una sola lectura trae el stock
+    # real de todas las líneas, no la lectura previa menos la cantidad
+    for libro in coleccion_libros.find({'_id': {'$in': [ObjectId(libro_id) for libro_id, _ in orden]}},
+                                       {'stock': 1}):
+        libros[str(libro['_id'])]['stock'] = libro.get('stock', 0)
+    return libros, None
@@ -0,0 +1,255 @@
+# metricas.py
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pymongo import monitoring
+
+# Métricas de la app en formato de texto de Prometheus.
+#
+# Por petición: latencia, código de estado, tamaño de la respuesta y número
+# de comandos a MongoDB, por endpoint. Por comando: cantidad, documentos
+# devueltos, tiempo y errores, por endpoint, colección y comando. Los
+# comandos se atribuyen a la petición en curso con una ContextVar, que
+# vale tanto para hilos (gthread) como para greenlets y tareas de asyncio
+# (app_async.py registra sus peticiones con los mismos hooks; Motor copia
+# el contexto a los hilos donde corre pymongo).
+#
+# Los contadores viven en la memoria de cada proceso. Con varios workers
+# detrás del mismo puerto, cada lectura de /metrics la atiende uno cualquiera,
+# así que con directorio (METRICAS_DIR) cada proceso vuelca sus contadores a
+# un archivo JSON propio y /metrics expone los de todos los procesos vivos,
+# cada serie con su etiqueta pid. Sin directorio, /metrics sólo muestra los
+# del proceso que responde.
+
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LIMITES_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Endpoint y contador de comandos de la petición en curso
+peticion_actual = contextvars.ContextVar('peticion_actual', default=None)
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.cubetas = [0] * len(limites)
+        self.suma = 0
+        self.cantidad = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.cubetas[i] += 1
+        self.suma += valor
+        self.cantidad += 1
+
+def _etiquetas(**valores):
+    partes = []
+    for nombre, valor in valores.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+# Límites de cada histograma por petición
+HISTOGRAMAS = {
+    'latencias': LIMITES_LATENCIA,
+    'tamanos': LIMITES_BYTES,
+    'consultas': LIMITES_CONSULTAS,
+}
+
+class RegistroMetricas:
+    """Contadores e histogramas de peticiones y comandos de MongoDB"""
+
+    def __init__(self, directorio=None, intervalo=1.0):
+        self._lock = threading.Lock()
+        self.directorio = directorio  # Compartido entre workers, o None
+        self.intervalo = intervalo  # Segundos mínimos entre volcados al directorio
+        self._ultimo_volcado = 0.0
+        self.peticiones = defaultdict(int)  # (endpoint, método, estado)
+        self.latencias = {}  # endpoint -> Histograma
+        self.tamanos = {}
+        self.consultas = {}
+        self.comandos = defaultdict(lambda: {'total': 0, 'documentos': 0, 'segundos': 0.0, 'errores': 0})
+
+    def iniciar_peticion(self, endpoint):
+        """Marcar el inicio de una petición; devuelve el token para terminarla"""
+        return peticion_actual.set({'endpoint': endpoint, 'comandos': 0})
+
+    def terminar_peticion(self, token, metodo, estado, segundos, tamano):
+        datos = peticion_actual.get()
+        peticion_actual.reset(token)
+        endpoint = datos['endpoint']
+        with self._lock:
+            self.peticiones[(endpoint, metodo, estado)] += 1
+            self.latencias.setdefault(endpoint, Histograma(LIMITES_LATENCIA)).observar(segundos)
+            self.consultas.setdefault(endpoint, Histograma(LIMITES_CONSULTAS)).observar(datos['comandos'])
+            if tamano is not None:
+                self.tamanos.setdefault(endpoint, Histograma(LIMITES_BYTES)).observar(tamano)
+        self.volcar()
+
+    def observar_comando(self, endpoint, coleccion, comando, segundos, documentos, error=False):
+        with self._lock:
+            datos = self.comandos[(endpoint, coleccion, comando)]
+            datos['total'] += 1
+            datos['documentos'] += documentos
+            datos['segundos'] += segundos
+            datos['errores'] += int(error)
+
+    def instantanea(self):
+        """Copia de los contadores del proceso que se puede guardar como JSON"""
+        with self._lock:
+            return {
+                'peticiones': [[*clave, total] for clave, total in self.peticiones.items()],
+                'histogramas': {
+                    nombre: {endpoint: [h.cubetas, h.suma, h.cantidad]
+                             for endpoint, h in getattr(self, nombre).items()}
+                    for nombre in HISTOGRAMAS
+                },
+                'comandos': [[*clave, dict(datos)] for clave, datos in self.comandos.items()],
+            }
+
+    def volcar(self, forzar=False):
+        """Escribir la instantánea del proceso en el directorio compartido.
+
+        Como mucho una vez por intervalo, salvo con forzar. Se escribe a un
+        temporal y se renombra, así nadie lee un archivo a medias.
+        """
+        if not self.directorio:
+            return
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_volcado < self.intervalo:
+            return
+        self._ultimo_volcado = ahora
+        ruta = os.path.join(self.directorio, f"metricas-{os.getpid()}.json")
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+                json.dump(self.instantanea(), archivo)
+            os.replace(ruta + '.tmp', ruta)
+        except OSError as e:
+            print(f"No se pudieron volcar las métricas en {ruta}: {e}")
+
+    def _procesos(self):
+        """(pid, instantánea) de este proceso y, con directorio, de los demás vivos"""
+        pid_propio = os.getpid()
+        if not self.directorio:
+            return [(pid_propio, self.instantanea())]
+        self.volcar(forzar=True)
+        procesos = []
+        for ruta in sorted(glob.glob(os.path.join(self.directorio, 'metricas-*.json'))):
+            pid = int(os.path.basename(ruta)[len('metricas-'):-len('.json')])
+            if pid != pid_propio and not _vivo(pid):
+                # Worker reciclado o caído: su archivo ya no se actualiza
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(ruta, encoding='utf-8') as archivo:
+                    procesos.append((pid, json.load(archivo)))
+            except (OSError, ValueError):
+                continue
+        return procesos
+
+    @staticmethod
+    def _histograma(lineas, nombre, pid, endpoint, limites, cubetas, suma, cantidad):
+        for limite, valor in zip(limites, cubetas):
+            lineas.append(f"{nombre}_bucket{_etiquetas(pid=pid, endpoint=endpoint, le=limite)} {valor}")
+        lineas.append(f"{nombre}_bucket{_etiquetas(pid=pid, endpoint=endpoint, le='+Inf')} {cantidad}")
+        lineas.append(f"{nombre}_sum{_etiquetas(pid=pid, endpoint=endpoint)} {suma}")
+        lineas.append(f"{nombre}_count{_etiquetas(pid=pid, endpoint=endpoint)} {cantidad}")
+
+    def exponer(self):
+        """Texto en formato de exposición de Prometheus (versión 0.0.4)"""
+        procesos = self._procesos()
+        lineas = ['# HELP libreria_http_peticiones_total Peticiones atendidas.',
+                  '# TYPE libreria_http_peticiones_total counter']
+        for pid, datos in procesos:
+            for endpoint, metodo, estado, total in sorted(datos['peticiones']):
+                lineas.append(f"libreria_http_peticiones_total"
+                              f"{_etiquetas(pid=pid, endpoint=endpoint, metodo=metodo, estado=estado)} {total}")
+
+        histogramas = [
+            ('libreria_http_duracion_segundos', 'Latencia de las peticiones.', 'latencias'),
+            ('libreria_http_respuesta_bytes', 'Tamaño de las respuestas.', 'tamanos'),
+            ('libreria_http_consultas_mongo', 'Comandos a MongoDB por petición.', 'consultas'),
+        ]
+        for nombre, ayuda, clave in histogramas:
+            lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} histogram']
+            for pid, datos in procesos:
+                for endpoint, valores in sorted(datos['histogramas'][clave].items()):
+                    self._histograma(lineas, nombre, pid, endpoint, HISTOGRAMAS[clave], *valores)
+
+        contadores = [
+            ('libreria_mongo_comandos_total', 'Comandos enviados a MongoDB.', 'total'),
+            ('libreria_mongo_documentos_total', 'Documentos devueltos por MongoDB.', 'documentos'),
+            ('libreria_mongo_segundos_total', 'Tiempo en comandos de MongoDB.', 'segundos'),
+            ('libreria_mongo_errores_total', 'Comandos de MongoDB fallidos.', 'errores'),
+        ]
+        for nombre, ayuda, campo in contadores:
+            lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} counter']
+            for pid, datos in procesos:
+                for endpoint, coleccion, comando, valores in sorted(datos['comandos'], key=lambda c: c[:3]):
+                    lineas.append(f"{nombre}{_etiquetas(pid=pid, endpoint=endpoint, coleccion=coleccion, comando=comando)} {valores[campo]}")
+        return '\n'.join(lineas) + '\n'
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Existe, pero es de otro usuario
+    return True
+
+def _documentos(respuesta):
+    """Documentos que devolvió un comando (lotes de cursor, o 'n' en escrituras)"""
+    cursor = respuesta.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if isinstance(respuesta.get('value'), dict):
+        return 1  # findAndModify
+    n = respuesta.get('n')
+    return n if isinstance(n, int) else 0
+
+class EscuchaComandos(monitoring.CommandListener):
+    """CommandListener de pymongo que suma cada comando a la petición en curso.
+
+    Los eventos started/succeeded llegan en el hilo (o tarea) que ejecuta el
+    comando, así que peticion_actual sigue apuntando a la petición.
+    """
+
+    def __init__(self, registro):
+        self.registro = registro
+        self._pendientes = {}
+
+    def started(self, event):
+        comando = event.command
+        coleccion = comando.get(event.command_name)
+        if event.command_name == 'getMore':
+            coleccion = comando.get('collection')
+        if not isinstance(coleccion, str):
+            coleccion = ''  # Comandos de administración (ping, hello...)
+        datos = peticion_actual.get()
+        if datos is not None:
+            datos['comandos'] += 1
+        self._pendientes[(event.connection_id, event.request_id)] = (
+            datos['endpoint'] if datos else '', coleccion)
+
+    def _terminar(self, event, documentos, error):
+        pendiente = self._pendientes.pop((event.connection_id, event.request_id), None)
+        if pendiente is None:
+            return
+        endpoint, coleccion = pendiente
+        self.registro.observar_comando(endpoint, coleccion, event.command_name,
+                                       event.duration_micros / 1e6, documentos, error)
+
+    def succeeded(self, event):
+        self._terminar(event, _documentos(event.reply), False)
+
+    def failed(self, event):
+        self._terminar(event, 0, True)
@@ -0,0 +1,117 @@
+# reportes_pdf.py
+from datetime import datetime
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+
+# Motor de reportes PDF en flujo: las filas se dibujan conforme llegan del
+# cursor, página por página, sin construir una tabla completa en memoria.
+#
+# La memoria baja, pero no queda fija: el Canvas de reportlab guarda cada
+# página cerrada (comprimida) hasta save(), así que crece con el número de
+# ventas. Lo que se evita es la lista de ventas, la tabla de platypus y el
+# PDF completo en un BytesIO.
+
+MARGEN = 50
+ALTO_FILA = 18
+COLUMNAS = [
+    # (encabezado, ancho, longitud máxima del texto)
+    ('Folio', 90, 11),
+    ('Cliente', 170, 28),
+    ('Fecha', 120, 16),
+    ('Total', 70, 12),
+    ('Tipo', 62, 10),
+]
+
+def _recortar(texto, maximo):
+    texto = str(texto)
+    return texto if len(texto) <= maximo else texto[:maximo - 3] + '...'
+
+def _dibujar_fila(pdf, y, valores, encabezado=False):
+    """Dibujar una fila de la tabla con el estilo del reporte original"""
+    x = MARGEN
+    for (_, ancho, maximo), valor in zip(COLUMNAS, valores):
+        pdf.setFillColor(colors.grey if encabezado else colors.beige)
+        pdf.setStrokeColor(colors.black)
+        pdf.rect(x, y, ancho, ALTO_FILA, stroke=1, fill=1)
+        pdf.setFillColor(colors.whitesmoke if encabezado else colors.black)
+        pdf.setFont('Helvetica-Bold' if encabezado else 'Helvetica', 10 if encabezado else 9)
+        pdf.drawCentredString(x + ancho / 2, y + 5, _recortar(valor, maximo))
+        x += ancho
+
+def _pie(pdf, pagina):
+    pdf.setFillColor(colors.black)
+    pdf.setFont('Helvetica', 8)
+    pdf.drawRightString(letter[0] - MARGEN, MARGEN / 2, f"Página {pagina}")
+
+def escribir_reporte_ventas(destino, ventas, titulo, total_ventas, total_ingresos):
+    """Escribir el reporte de ventas en destino (archivo o buffer binario).
+
+    ventas puede ser un cursor de MongoDB: se recorre una sola vez y cada
+    página se cierra en cuanto se llena, repitiendo el encabezado de la tabla.
+    Las páginas cerradas siguen en memoria (comprimidas) hasta pdf.save().
+    """
+    ancho_pagina, alto_pagina = letter
+    pdf = canvas.Canvas(destino, pagesize=letter, pageCompression=1)
+    pdf.setTitle(titulo)
+
+    # Título y estadísticas en la primera página
+    y = alto_pagina - MARGEN
+    pdf.setFont('Helvetica-Bold', 18)
+    pdf.drawCentredString(ancho_pagina / 2, y - 18, titulo)
+    y -= 50
+    pdf.setFont('Helvetica', 10)
+    pdf.drawString(MARGEN, y, f"Total de Ventas: {total_ventas}")
+    y -= 14
+    pdf.drawString(MARGEN, y, f"Ingresos Totales: ${total_ingresos:.2f}")
+    y -= 30
+
+    encabezados = [c[0] for c in COLUMNAS]
+    pagina = 1
+    hay_filas = False
+
+    for venta in ventas:
+        if not hay_filas or y < MARGEN + ALTO_FILA:
+            if hay_filas:
+                _pie(pdf, pagina)
+                pdf.showPage()
+                pagina += 1
+                y = alto_pagina - MARGEN - ALTO_FILA
+            _dibujar_fila(pdf, y, encabezados, encabezado=True)
+            y -= ALTO_FILA
+            hay_filas = True
+
+        _dibujar_fila(pdf, y, [
+            str(venta.get('_id', ''))[:8] + '...',
+            venta.get('cliente_nombre', ''),
+            venta.get('fecha_venta', datetime.now()).strftime('%d/%m/%Y %H:%M'),
+            f"${venta.get('total', 0):.2f}",
+            venta.get('tipo', '')
+        ])
+        y -= ALTO_FILA
+
+    if not hay_filas:
+        pdf.setFont('Helvetica', 10)
+        pdf.drawString(MARGEN, y, "No hay ventas en el período seleccionado")
+
+    _pie(pdf, pagina)
+    pdf.save()
+
+def generar_reporte_ventas(coleccion_ventas, query, titulo, destino):
+    """Calcular totales y escribir en destino el reporte de las ventas de query"""
+    totales = list(coleccion_ventas.aggregate([
+        {"$match": query},
+        {"$group": {"_id": None, "total_ventas": {"$sum": 1}, "total_ingresos": {"$sum": "$total"}}}
+    ]))
+    total_ventas = totales[0]['total_ventas'] if totales else 0
+    total_ingresos = totales[0]['total_ingresos'] if totales else 0
+
+    # Las ventas se leen por lotes y se dibujan conforme llegan
+    ventas_cursor = coleccion_ventas.find(
+        query,
+        {'cliente_nombre': 1, 'fecha_venta': 1, 'total': 1, 'tipo': 1}
+    ).sort('fecha_venta', -1).batch_size(500)
+    try:
+        escribir_reporte_ventas(destino, ventas_cursor, titulo, total_ventas, total_ingresos)
+    finally:
+        ventas_cursor.close()
@@ -0,0 +1,163 @@
+# resumen_ventas.py
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from indices import INDICES
+
+# Resumen diario de ventas (colección ventas_diarias), un documento por día y tipo:
+# {fecha: 'YYYY-MM-DD', tipo, ventas, subtotal, iva, total, unidades,
+#  libros: {libro_id: {titulo, cantidad, ingresos}},
+#  clientes: {cliente_id: {nombre, compras, gastado}}}
+
+def _incrementos(venta, signo=1):
+    """Calcular los $inc y $set que aporta una venta a su resumen diario"""
+    inc = {
+        'ventas': signo,
+        'subtotal': signo * venta.get('subtotal', 0),
+        'iva': signo * venta.get('iva', 0),
+        'total': signo * venta.get('total', 0),
+    }
+    datos = {}
+
+    unidades = 0
+    for item in venta.get('items', []):
+        libro_id = item.get('libro_id')
+        if not libro_id:
+            continue
+        cantidad = item.get('cantidad', 0)
+        unidades += cantidad
+        inc[f'libros.{libro_id}.cantidad'] = inc.get(f'libros.{libro_id}.cantidad', 0) + signo * cantidad
+        inc[f'libros.{libro_id}.ingresos'] = inc.get(f'libros.{libro_id}.ingresos', 0) + signo * item.get('subtotal', 0)
+        datos[f'libros.{libro_id}.titulo'] = item.get('titulo', '')
+    inc['unidades'] = signo * unidades
+
+    cliente_id = venta.get('cliente_id')
+    if cliente_id:
+        inc[f'clientes.{cliente_id}.compras'] = signo
+        inc[f'clientes.{cliente_id}.gastado'] = signo * venta.get('total', 0)
+        datos[f'clientes.{cliente_id}.nombre'] = venta.get('cliente_nombre', '')
+
+    return inc, datos
+
+def _actualizacion(venta, signo=1):
+    """Filtro y documento de actualización del resumen diario de una venta"""
+    inc, datos = _incrementos(venta, signo)
+    actualizacion = {'$inc': inc}
+    if datos:
+        actualizacion['$set'] = datos
+    filtro = {'fecha': venta['fecha_venta'].strftime('%Y-%m-%d'), 'tipo': venta.get('tipo', 'presencial')}
+    return filtro, actualizacion
+
+def registrar_venta(coleccion_diaria, venta):
+    """Sumar una venta nueva a su resumen diario"""
+    filtro, actualizacion = _actualizacion(venta)
+    coleccion_diaria.update_one(filtro, actualizacion, upsert=True)
+
+# Ventas revertidas que se recuerdan por resumen diario
+MAX_REVERTIDAS = 200
+
+def revertir_venta(coleccion_diaria, venta):
+    """Restar una venta cancelada de su resumen diario, una sola vez.
+
+    El id de la venta se agrega a 'revertidas' en la misma actualización que
+    resta, y el filtro exige que no esté: un reintento no vuelve a restar.
+    Sin upsert, porque el resumen ya existe desde registrar_venta.
+    """
+    filtro, actualizacion = _actualizacion(venta, -1)
+    venta_id = str(venta['_id'])
+    filtro['revertidas'] = {'$ne': venta_id}
+    actualizacion['$push'] = {'revertidas': {'$each': [venta_id], '$slice': -MAX_REVERTIDAS}}
+    coleccion_diaria.update_one(filtro, actualizacion)
+
+def _sumar_ventas(coleccion_ventas, destino, filtro, lote):
+    """Sumar al resumen de destino las ventas no canceladas que cumplen filtro"""
+    operaciones = []
+    procesadas = 0
+    for venta in coleccion_ventas.find(dict(filtro, estado={'$ne': 'cancelada'})).batch_size(lote):
+        operaciones.append(UpdateOne(*_actualizacion(venta), upsert=True))
+        procesadas += 1
+        if len(operaciones) >= lote:
+            destino.bulk_write(operaciones, ordered=False)
+            operaciones = []
+    if operaciones:
+        destino.bulk_write(operaciones, ordered=False)
+    return procesadas
+
+def reconstruir_resumen(coleccion_ventas, coleccion_diaria, lote=1000):
+    """Reconstruir ventas_diarias desde cero a partir de las ventas existentes.
+
+    El resumen nuevo se arma en una colección temporal con los mismos índices
+    y reemplaza al actual con un rename, así que los reportes nunca ven un
+    resumen vacío o a medias. Las ventas se reparten por _id: primero las
+    anteriores al corte y después, en una segunda pasada, las que llegaron
+    mientras tanto, de modo que cada venta se suma una sola vez.
+
+    Lo que se registre o cancele entre esa segunda pasada y el rename se
+    pierde (fue a la colección reemplazada): para un resultado exacto hay que
+    correrlo con las ventas detenidas. Las ventas canceladas no se suman,
+    igual que si se hubieran revertido. Devuelve el número de ventas procesadas.
+    """
+    db = coleccion_diaria.database
+    nombre_temporal = f"{coleccion_diaria.name}_reconstruccion"
+    db.drop_collection(nombre_temporal)
+    temporal = db.create_collection(nombre_temporal)
+    modelos = INDICES.get(coleccion_diaria.name)
+    if modelos:
+        temporal.create_indexes(modelos)
+
+    corte = ObjectId()
+    procesadas = _sumar_ventas(coleccion_ventas, temporal, {'_id': {'$lt': corte}}, lote)
+    procesadas += _sumar_ventas(coleccion_ventas, temporal, {'_id': {'$gte': corte}}, lote)
+    temporal.rename(coleccion_diaria.name, dropTarget=True)
+    return procesadas
+
+def totales_desde(coleccion_diaria, fecha_inicio):
+    """Sumar ventas e ingresos de los días a partir de fecha_inicio"""
+    resultado = list(coleccion_diaria.aggregate([
+        {'$match': {'fecha': {'$gte': fecha_inicio.strftime('%Y-%m-%d')}}},
+        {'$group': {'_id': None, 'ventas': {'$sum': '$ventas'}, 'total': {'$sum': '$total'}}}
+    ]))
+    return resultado[0] if resultado else {'ventas': 0, 'total': 0}
+
+def ventas_por_dia(coleccion_diaria, fecha_inicio):
+    """Serie diaria (todas las modalidades juntas) a partir de fecha_inicio"""
+    return list(coleccion_diaria.aggregate([
+        {'$match': {'fecha': {'$gte': fecha_inicio.strftime('%Y-%m-%d')}}},
+        {'$group': {
+            '_id': '$fecha',
+            'total_ventas': {'$sum': '$ventas'},
+            'total_ingresos': {'$sum': '$total'}
+        }},
+        {'$sort': {'_id': 1}}
+    ]))
+
+def top_libros(coleccion_diaria, limite=5):
+    """Libros más vendidos recorriendo sólo los resúmenes diarios"""
+    return list(coleccion_diaria.aggregate([
+        {'$project': {'libros': {'$objectToArray': '$libros'}}},
+        {'$unwind': '$libros'},
+        {'$group': {
+            '_id': '$libros.k',
+            'titulo': {'$last': '$libros.v.titulo'},
+            'total_vendido': {'$sum': '$libros.v.cantidad'},
+            'total_ingresos': {'$sum': '$libros.v.ingresos'}
+        }},
+        {'$match': {'total_vendido': {'$gt': 0}}},
+        {'$sort': {'total_vendido': -1}},
+        {'$limit': limite}
+    ]))
+
+def top_clientes(coleccion_diaria, limite=5):
+    """Clientes con más compras recorriendo sólo los resúmenes diarios"""
+    return list(coleccion_diaria.aggregate([
+        {'$project': {'clientes': {'$objectToArray': '$clientes'}}},
+        {'$unwind': '$clientes'},
+        {'$group': {
+            '_id': '$clientes.k',
+            'cliente_nombre': {'$last': '$clientes.v.nombre'},
+            'total_compras': {'$sum': '$clientes.v.compras'},
+            'total_gastado': {'$sum': '$clientes.v.gastado'}
+        }},
+        {'$match': {'total_compras': {'$gt': 0}}},
+        {'$sort': {'total_compras': -1}},
+        {'$limit': limite}
+    ]))
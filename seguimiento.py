@@ -0,0 +1,184 @@
+# seguimiento.py
+import hashlib
+import json
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+# Tablero de seguimiento de pedidos online. Cada venta online tiene un
+# documento en pedidos (venta_id = str(venta._id)) con el estado logístico y
+# los comentarios. El tablero pagina las ventas abiertas y trae su
+# seguimiento con un $lookup; los seguimientos que falten se crean en bloque.
+
+ESTADOS_ABIERTOS = ['pendiente', 'en_proceso', 'enviado']
+
+def documento_seguimiento(venta):
+    """Seguimiento inicial de una venta online, fechado con la venta"""
+    return {
+        'venta_id': str(venta['_id']),
+        'cliente_id': venta['cliente_id'],
+        'cliente_nombre': venta.get('cliente_nombre', ''),
+        'estado': 'pendiente',
+        'fecha_pedido': venta['fecha_venta'],
+        'ultima_actualizacion': venta['fecha_venta'],
+        'comentarios': [{
+            'fecha': venta['fecha_venta'],
+            'mensaje': 'Pedido recibido',
+            'usuario': 'Sistema'
+        }]
+    }
+
+def _unir_seguimiento():
+    """Etapas para adjuntar a cada venta su documento de pedidos"""
+    return [
+        {'$addFields': {'venta_id': {'$toString': '$_id'}}},
+        {'$lookup': {
+            'from': 'pedidos',
+            'localField': 'venta_id',
+            'foreignField': 'venta_id',
+            'as': 'seguimiento'
+        }},
+    ]
+
+def asegurar_seguimiento(coleccion_pedidos, ventas):
+    """Crear en un solo bulk_write los seguimientos que falten.
+
+    Son upserts con $setOnInsert sobre venta_id (índice único), así que
+    dos peticiones simultáneas no duplican el seguimiento.
+    """
+    operaciones = [
+        UpdateOne({'venta_id': str(venta['_id'])},
+                  {'$setOnInsert': documento_seguimiento(venta)}, upsert=True)
+        for venta in ventas
+    ]
+    if operaciones:
+        coleccion_pedidos.bulk_write(operaciones, ordered=False)
+    return len(operaciones)
+
+def tablero_pedidos(coleccion_ventas, coleccion_pedidos, estado=None, pagina=1, por_pagina=20):
+    """Una página del tablero de pedidos abiertos, con su seguimiento.
+
+    estado filtra por uno de ESTADOS_ABIERTOS (None para todos). Devuelve
+    (pedidos, total). El conteo, el orden y la paginación se resuelven con el
+    índice tipo_estado_fecha y el $lookup sólo corre para la página pedida.
+    """
+    filtro = {'tipo': 'online', 'estado': estado if estado else {'$in': ESTADOS_ABIERTOS}}
+    total = coleccion_ventas.count_documents(filtro)
+    pedidos = list(coleccion_ventas.aggregate([
+        {'$match': filtro},
+        {'$sort': {'fecha_venta': -1}},
+        {'$skip': (pagina - 1) * por_pagina},
+        {'$limit': por_pagina},
+    ] + _unir_seguimiento()))
+
+    faltantes = [pedido for pedido in pedidos if not pedido['seguimiento']]
+    asegurar_seguimiento(coleccion_pedidos, faltantes)
+
+    for pedido in pedidos:
+        seguimiento = pedido.pop('seguimiento')
+        seguimiento = seguimiento[0] if seguimiento else documento_seguimiento(pedido)
+        pedido['estado_seguimiento'] = seguimiento.get('estado', 'pendiente')
+        pedido['ultima_actualizacion'] = seguimiento.get('ultima_actualizacion', '')
+        pedido['comentarios'] = seguimiento.get('comentarios', [])
+    return pedidos, total
+
+def reconstruir_seguimiento(coleccion_ventas, coleccion_pedidos, lote=1000):
+    """Crear los seguimientos de todas las ventas online que no tengan uno.
+
+    Devuelve el número de seguimientos creados.
+    """
+    cursor = coleccion_ventas.aggregate([
+        {'$match': {'tipo': 'online'}},
+    ] + _unir_seguimiento() + [
+        {'$match': {'seguimiento': {'$size': 0}}},
+        {'$project': {'cliente_id': 1, 'cliente_nombre': 1, 'fecha_venta': 1}},
+    ], batchSize=lote)
+    creados = 0
+    ventas = []
+    for venta in cursor:
+        ventas.append(venta)
+        if len(ventas) >= lote:
+            creados += asegurar_seguimiento(coleccion_pedidos, ventas)
+            ventas = []
+    creados += asegurar_seguimiento(coleccion_pedidos, ventas)
+    return creados
+
+def filtro_cliente(cliente_id, venta_ids=None):
+    filtro = {'cliente_id': cliente_id}
+    if venta_ids is not None:
+        filtro['venta_id'] = {'$in': venta_ids}
+    return filtro
+
+def version_estados(coleccion_pedidos, cliente_id, venta_ids=None):
+    """ETag débil de los seguimientos de un cliente.
+
+    Sale de cuántos seguimientos hay y de su última actualización, con una
+    sola agregación que no trae comentarios; si nada cambió el sondeo se
+    responde con 304 sin leer los documentos.
+    """
+    resultado = list(coleccion_pedidos.aggregate(consulta_version(cliente_id, venta_ids)))
+    return huella_version(resultado, venta_ids)
+
+def consulta_version(cliente_id, venta_ids=None):
+    return [
+        {'$match': filtro_cliente(cliente_id, venta_ids)},
+        {'$group': {'_id': None, 'n': {'$sum': 1}, 'ultima': {'$max': '$ultima_actualizacion'}}}
+    ]
+
+def huella_version(resultado, venta_ids=None):
+    """ETag a partir del resultado de consulta_version"""
+    resumen = resultado[0] if resultado else {'n': 0, 'ultima': None}
+    datos = json.dumps({
+        'ids': sorted(venta_ids) if venta_ids is not None else None,
+        'n': resumen['n'],
+        'ultima': resumen['ultima']
+    }, default=str)
+    return hashlib.sha256(datos.encode()).hexdigest()[:32]
+
+def estado_pedido(pedido):
+    """Estado de un seguimiento tal como lo reciben los clientes"""
+    return {
+        'venta_id': pedido['venta_id'],
+        'estado': pedido.get('estado', 'pendiente'),
+        'ultima_actualizacion': pedido['ultima_actualizacion'].strftime('%Y-%m-%d %H:%M'),
+        'comentarios': pedido.get('comentarios', [])
+    }
+
+def estado_sin_seguimiento(venta):
+    """Estado de una venta que todavía no tiene documento en pedidos"""
+    return {
+        'venta_id': str(venta['_id']),
+        'estado': 'pendiente',
+        'ultima_actualizacion': venta['fecha_venta'].strftime('%Y-%m-%d %H:%M'),
+        'comentarios': []
+    }
+
+def aplicar_seguimiento(venta, pedido):
+    """Copiar a la venta el estado de su seguimiento (o el inicial si no tiene)"""
+    if pedido:
+        venta['estado_seguimiento'] = pedido.get('estado', 'pendiente')
+        venta['ultima_actualizacion'] = pedido.get('ultima_actualizacion', '')
+        venta['comentarios'] = pedido.get('comentarios', [])
+    else:
+        venta['estado_seguimiento'] = 'pendiente'
+        venta['ultima_actualizacion'] = venta['fecha_venta']
+        venta['comentarios'] = []
+    return venta
+
+def estados_cliente(coleccion_ventas, coleccion_pedidos, cliente_id, venta_ids=None):
+    """Estado de seguimiento de varios pedidos de un cliente (o de todos).
+
+    Una consulta a pedidos; sólo las ventas pedidas que aún no tienen
+    seguimiento se buscan en ventas, para confirmar que son del cliente.
+    """
+    estados = [estado_pedido(pedido) for pedido in coleccion_pedidos.find(
+        filtro_cliente(cliente_id, venta_ids),
+        {'venta_id': 1, 'estado': 1, 'ultima_actualizacion': 1, 'comentarios': 1})]
+
+    encontrados = {estado['venta_id'] for estado in estados}
+    faltantes = [ObjectId(venta_id) for venta_id in (venta_ids or [])
+                 if venta_id not in encontrados and ObjectId.is_valid(venta_id)]
+    if faltantes:
+        for venta in coleccion_ventas.find(
+                {'_id': {'$in': faltantes}, 'cliente_id': cliente_id}, {'fecha_venta': 1}):
+            estados.append(estado_sin_seguimiento(venta))
+    return estados
@@ -0,0 +1,27 @@
+# test_app_async.py
+"""Humo de la app asíncrona: importa y registra sus rutas (python -m pytest).
+
+Se salta si no están quart o motor, que sólo hacen falta para app_async.py.
+"""
+import asyncio
+import pytest
+
+pytest.importorskip('quart')
+pytest.importorskip('motor')
+
+import app_async
+
+def rutas():
+    return {regla.rule for regla in app_async.app.url_map.iter_rules()}
+
+def test_rutas_de_clientes():
+    assert {'/catalogo', '/mis-compras', '/mi-seguimiento',
+            '/api/seguimiento', '/api/seguimiento/<venta_id>'} <= rutas()
+
+def test_catalogo_pide_sesion():
+    async def pedir():
+        return await app_async.app.test_client().get('/catalogo')
+
+    respuesta = asyncio.run(pedir())
+    assert respuesta.status_code == 302
+    assert respuesta.headers['Location'].endswith('/login-cliente')
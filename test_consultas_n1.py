@@ -0,0 +1,84 @@
+# test_consultas_n1.py
+"""Pruebas del detector de consultas N+1 (python -m pytest).
+
+mongomock no emite eventos de monitoreo, así que las colecciones se envuelven
+en ColeccionEscuchada, que le pasa al detector los mismos eventos started
+que mandaría pymongo.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+import app as app_libreria
+import consultas_n1
+from consultas_n1 import ConsultasRepetidas, max_consultas
+
+def evento(nombre, comando):
+    return SimpleNamespace(command_name=nombre, command=comando)
+
+class ColeccionEscuchada:
+    """Colección de mongomock que avisa al detector de cada lectura"""
+
+    def __init__(self, coleccion, detector):
+        self._coleccion = coleccion
+        self._detector = detector
+
+    def __getattr__(self, atributo):
+        metodo = getattr(self._coleccion, atributo)
+        if atributo not in ('find', 'find_one'):
+            return metodo
+
+        def leer(filtro=None, *args, **kwargs):
+            self._detector.started(evento('find', {'find': self._coleccion.name, 'filter': filtro or {}}))
+            return metodo(filtro, *args, **kwargs)
+        return leer
+
+@pytest.fixture
+def db(monkeypatch):
+    base = mongomock.MongoClient()['libros']
+    for nombre, coleccion in [('ventas', 'ventas'), ('pedidos', 'pedidos')]:
+        monkeypatch.setattr(app_libreria, f'coleccion_{nombre}',
+                            ColeccionEscuchada(base[coleccion], app_libreria.detector_n1))
+    monkeypatch.setitem(app_libreria.app.config, 'TESTING', True)
+    return base
+
+@pytest.fixture
+def cliente():
+    cliente = app_libreria.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['cliente_id'] = 'c1'
+    return cliente
+
+def test_forma_sin_valores():
+    huella = consultas_n1.huella_comando('find', {'find': 'pedidos', 'filter': {'venta_id': 'a1'}})
+    assert huella == consultas_n1.huella_comando('find', {'find': 'pedidos', 'filter': {'venta_id': 'b2'}})
+    assert huella == "pedidos.find {'venta_id': '?'}"
+
+def test_detecta_consulta_repetida():
+    detector = consultas_n1.DetectorN1()
+    with pytest.raises(ConsultasRepetidas):
+        with max_consultas(10, umbral_repetidas=2):
+            for venta_id in ('a', 'b', 'c'):
+                detector.started(evento('find', {'find': 'pedidos', 'filter': {'venta_id': venta_id}}))
+
+def test_get_more_no_cuenta():
+    detector = consultas_n1.DetectorN1()
+    with max_consultas(1) as captura:
+        detector.started(evento('find', {'find': 'ventas', 'filter': {}}))
+        for _ in range(5):
+            detector.started(evento('getMore', {'getMore': 123, 'collection': 'ventas'}))
+    assert captura.total == 1
+
+def test_api_seguimiento(db, cliente):
+    venta_id = db['ventas'].insert_one(
+        {'cliente_id': 'c1', 'fecha_venta': datetime(2024, 1, 1), 'tipo': 'online'}).inserted_id
+    db['pedidos'].insert_one({'venta_id': str(venta_id), 'estado': 'enviado',
+                              'ultima_actualizacion': datetime(2024, 1, 2), 'comentarios': []})
+
+    # La venta del cliente y su seguimiento: dos lecturas, ninguna repetida
+    with max_consultas(2, umbral_repetidas=1):
+        respuesta = cliente.get(f'/api/seguimiento/{venta_id}')
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['estado'] == 'enviado'
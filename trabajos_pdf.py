@@ -0,0 +1,233 @@
+# trabajos_pdf.py
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from reportes_pdf import generar_reporte_ventas
+
+# Cola de reportes PDF en segundo plano. El estado de cada trabajo vive en la
+# colección trabajos_pdf (visible para todos los procesos web) y el PDF se
+# genera en un pool de procesos, fuera del hilo que atiende la petición.
+#
+# Documento de trabajo:
+# {_id, clave, vigente, estado: pendiente|en_proceso|terminado|error,
+#  titulo, nombre_archivo, ruta, error, creado, latido, terminado, expira, archivo_borrado}
+#
+# vigente es True sólo mientras el trabajo está pendiente o en proceso: es lo
+# que comparten las solicitudes equivalentes. Un reporte terminado no se
+# reutiliza, así que cada solicitud nueva ve los datos del momento.
+
+ESTADOS_EN_CURSO = ('pendiente', 'en_proceso')
+
+# El proceso web que tiene el trabajo en su pool renueva 'latido' cada
+# INTERVALO_LATIDO segundos. Si el worker muere o gunicorn lo recicla
+# (max_requests), su pool desaparece con él: pasado el plazo de abandono el
+# trabajo se retira y la siguiente solicitud equivalente crea uno nuevo.
+INTERVALO_LATIDO = 15
+
+def _renderizar(mongo_uri, nombre_db, trabajo_id, query, titulo, ruta):
+    """Generar un reporte dentro de un proceso del pool.
+
+    Cada proceso abre su propia conexión: los clientes de MongoDB no se
+    pueden compartir entre procesos.
+    """
+    client = MongoClient(mongo_uri)
+    try:
+        db = client[nombre_db]
+        trabajos = db['trabajos_pdf']
+        trabajos.update_one({'_id': trabajo_id}, {'$set': {'estado': 'en_proceso'}})
+        try:
+            temporal = ruta + '.tmp'
+            with open(temporal, 'wb') as archivo:
+                generar_reporte_ventas(db['ventas'], query, titulo, archivo)
+            os.replace(temporal, ruta)
+            trabajos.update_one({'_id': trabajo_id}, {'$set': {
+                'estado': 'terminado',
+                'vigente': False,
+                'terminado': datetime.now()
+            }})
+        except Exception as e:
+            trabajos.update_one({'_id': trabajo_id}, {'$set': {
+                'estado': 'error',
+                'vigente': False,
+                'error': str(e)
+            }})
+    finally:
+        client.close()
+
+class ColaReportesPDF:
+    """Encolar, consultar y expirar reportes PDF generados en segundo plano"""
+
+    def __init__(self, coleccion, directorio, mongo_uri, nombre_db,
+                 max_workers=2, vigencia=timedelta(minutes=30), abandono=timedelta(minutes=2)):
+        self.coleccion = coleccion
+        self.directorio = directorio
+        self.mongo_uri = mongo_uri
+        self.nombre_db = nombre_db
+        self.max_workers = max_workers
+        self.vigencia = vigencia
+        self.abandono = abandono
+        self._executor = None
+        self._en_curso = {}  # trabajo_id -> Future del pool de este proceso
+        self._lock = threading.Lock()
+        self._hilo_latidos = None
+        os.makedirs(directorio, exist_ok=True)
+
+    @property
+    def executor(self):
+        # Se crea al primer uso y con 'spawn' para no heredar hilos ni sockets del servidor
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    @staticmethod
+    def clave(tipo, query):
+        """Identificador de solicitudes equivalentes (mismo tipo y rango de fechas)"""
+        datos = json.dumps({'tipo': tipo, 'query': query}, sort_keys=True, default=str)
+        return hashlib.sha256(datos.encode()).hexdigest()
+
+    def encolar(self, tipo, query, titulo, nombre_archivo):
+        """Devolver el trabajo vigente para la solicitud o crear uno nuevo.
+
+        Las solicitudes idénticas concurrentes comparten un solo trabajo: la
+        inserción es un upsert atómico sobre (clave, vigente=True), y sólo
+        los trabajos pendientes o en proceso están vigentes.
+
+        Si dos solicitudes llegan a la vez, las dos pueden no encontrar el
+        trabajo e intentar insertarlo; MongoDB no reintenta ese upsert (el
+        filtro no es una igualdad sobre la clave del índice parcial), así que
+        la que pierde recibe DuplicateKeyError y lee el trabajo de la otra.
+        """
+        self.limpiar_vencidos()
+        self.liberar_abandonados()
+        clave = self.clave(tipo, query)
+        nuevo_id = ObjectId()
+        trabajo = None
+        for _ in range(2):
+            ahora = datetime.now()
+            try:
+                trabajo = self.coleccion.find_one_and_update(
+                    {'clave': clave, 'vigente': True},
+                    {'$setOnInsert': {
+                        '_id': nuevo_id,
+                        'estado': 'pendiente',
+                        'titulo': titulo,
+                        'nombre_archivo': nombre_archivo,
+                        'ruta': os.path.join(self.directorio, f"{nuevo_id}.pdf"),
+                        'creado': ahora,
+                        'latido': ahora,
+                        'expira': ahora + self.vigencia
+                    }},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                trabajo = self.coleccion.find_one({'clave': clave, 'vigente': True})
+            if trabajo is not None:
+                break
+        if trabajo is None:
+            raise RuntimeError('No se pudo encolar el reporte, intenta de nuevo')
+        if trabajo['_id'] == nuevo_id:
+            try:
+                futuro = self.executor.submit(_renderizar, self.mongo_uri, self.nombre_db,
+                                              nuevo_id, query, titulo, trabajo['ruta'])
+            except BrokenProcessPool as e:
+                self._fallo_trabajo(nuevo_id, e)
+                trabajo = self.coleccion.find_one({'_id': nuevo_id})
+            else:
+                with self._lock:
+                    self._en_curso[nuevo_id] = futuro
+                    self._iniciar_latidos()
+                futuro.add_done_callback(lambda f: self._revisar_resultado(nuevo_id, f))
+        return trabajo
+
+    def _iniciar_latidos(self):
+        if self._hilo_latidos is None or not self._hilo_latidos.is_alive():
+            self._hilo_latidos = threading.Thread(target=self._latir, name='latidos-reportes-pdf',
+                                                  daemon=True)
+            self._hilo_latidos.start()
+
+    def _latir(self):
+        """Renovar 'latido' de los trabajos que siguen en el pool de este proceso"""
+        while True:
+            time.sleep(INTERVALO_LATIDO)
+            with self._lock:
+                ids = list(self._en_curso)
+            if not ids:
+                continue
+            try:
+                self.coleccion.update_many({'_id': {'$in': ids}, 'vigente': True},
+                                           {'$set': {'latido': datetime.now()}})
+            except Exception as e:
+                print(f"No se pudo renovar el latido de los reportes PDF: {e}")
+
+    def liberar_abandonados(self):
+        """Retirar los trabajos vigentes cuyo proceso web dejó de renovar el latido"""
+        self.coleccion.update_many(
+            {'vigente': True, 'latido': {'$lt': datetime.now() - self.abandono}},
+            {'$set': {'estado': 'error', 'vigente': False,
+                      'error': 'El proceso que generaba el reporte se detuvo'}})
+
+    def _revisar_resultado(self, trabajo_id, futuro):
+        """Marcar con error los trabajos cuyo proceso no llegó a terminar.
+
+        _renderizar anota sus propios errores, pero no los del proceso
+        (worker muerto, pool roto) ni los previos a su try interno.
+        """
+        with self._lock:
+            self._en_curso.pop(trabajo_id, None)
+        if futuro.cancelled():
+            self._fallo_trabajo(trabajo_id, 'Trabajo cancelado')
+        elif futuro.exception() is not None:
+            self._fallo_trabajo(trabajo_id, futuro.exception())
+
+    def _fallo_trabajo(self, trabajo_id, error):
+        if isinstance(error, BrokenProcessPool):
+            # Un pool roto no acepta más trabajos: se crea otro en el próximo uso
+            self._executor = None
+        print(f"Error en el reporte PDF {trabajo_id}: {error}")
+        try:
+            self.coleccion.update_one(
+                {'_id': trabajo_id, 'estado': {'$in': list(ESTADOS_EN_CURSO)}},
+                {'$set': {'estado': 'error', 'vigente': False, 'error': str(error)}})
+        except Exception as e:
+            print(f"No se pudo marcar el reporte PDF {trabajo_id} con error: {e}")
+
+    def obtener(self, trabajo_id):
+        if not ObjectId.is_valid(trabajo_id):
+            return None
+        trabajo = self.coleccion.find_one({'_id': ObjectId(trabajo_id)})
+        if trabajo and trabajo['expira'] <= datetime.now():
+            return None
+        return trabajo
+
+    def limpiar_vencidos(self):
+        """Retirar los trabajos vencidos y borrar sus archivos.
+
+        Los documentos los elimina después el índice TTL sobre 'expira'.
+        """
+        ahora = datetime.now()
+        vencidos = list(self.coleccion.find(
+            {'expira': {'$lte': ahora}, 'archivo_borrado': {'$ne': True}}, {'ruta': 1}))
+        if not vencidos:
+            return
+        self.coleccion.update_many(
+            {'_id': {'$in': [t['_id'] for t in vencidos]}},
+            {'$set': {'vigente': False, 'archivo_borrado': True}}
+        )
+        for trabajo in vencidos:
+            try:
+                os.remove(trabajo['ruta'])
+            except (FileNotFoundError, KeyError):
+                pass
@@ -0,0 +1,14 @@
+# wsgi.py
+"""Punto de entrada WSGI para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+La configuración sale de LIBRERIA_CONFIG (ruta a un archivo .py, opcional)
+y de las variables de entorno LIBRERIA_*. Los índices y el usuario
+administrador se crean con `flask --app wsgi inicializar`, que
+gunicorn.conf.py ejecuta una vez al arrancar el maestro.
+"""
+import os
+from app import create_app
+
+application = create_app(os.environ.get('LIBRERIA_CONFIG'))